@@ -5,6 +5,7 @@ Celery Configuration - Async task queue setup with Redis broker
 import os
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_process_init, worker_process_shutdown
 
 # Set Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Real_MFA.settings')
@@ -63,11 +64,57 @@ app.conf.update(
         },
         'send-pending-notifications': {
             'task': 'notification.tasks.send_pending_notifications',
-            'schedule': crontab(minute=0),  # Every hour
+            'schedule': crontab(),  # Every minute (only due rows are read)
+        },
+        'sweep-notification-outbox': {
+            'task': 'notification.tasks.sweep_notification_outbox',
+            'schedule': crontab(),  # Every minute
+        },
+        'purge-orphan-notification-bodies': {
+            'task': 'notification.tasks.purge_orphan_notification_bodies',
+            'schedule': crontab(hour=4, minute=0),  # Daily at 4 AM
+        },
+        'sweep-mfa-challenges': {
+            'task': 'otp.tasks.sweep_mfa_challenges',
+            'schedule': crontab(),  # Every minute
+        },
+        'flush-device-risk-scores': {
+            'task': 'devices.tasks.flush_device_risk_scores',
+            'schedule': crontab(),  # Every minute
+        },
+        'expire-device-trust': {
+            'task': 'devices.tasks.expire_device_trust',
+            'schedule': crontab(minute='*/5'),  # Every 5 minutes
+        },
+        'archive-inactive-sessions': {
+            'task': 'devices.tasks.archive_inactive_sessions',
+            'schedule': crontab(hour=3, minute=30),  # Daily at 3:30 AM
+        },
+        'reconcile-active-sessions': {
+            'task': 'devices.tasks.reconcile_active_sessions',
+            'schedule': crontab(minute=15),  # Hourly
+        },
+        'purge-emergency-code-artifacts': {
+            'task': 'otp.tasks.purge_emergency_code_artifacts',
+            'schedule': crontab(minute=30),  # Every hour
         },
     },
 )
 
+@worker_process_init.connect
+def compile_notification_templates(**kwargs):
+    """Compile every registered email template before the first task needs it"""
+    from notification.registry import registry
+    registry.warm()
+
+
+@worker_process_shutdown.connect
+def close_pooled_email_connections(**kwargs):
+    """QUIT pooled SMTP sessions instead of dropping them on exit"""
+    from Real_MFA.email_provider import smtp_pool
+    smtp_pool.close_all()
+
+
 @app.task(bind=True)
 def debug_task(self):
     """Debug task for testing Celery setup"""
@@ -1,6 +1,10 @@
 """
-Celery Tasks - Async email sending with rate limiting
+Celery Tasks - Async email sending
 Email verification and notification delivery
+
+Provider send rates are enforced cluster-wide by Real_MFA.email_quota (not
+Celery's per-worker rate_limit); OTPs take the 'otp' lane, everything else
+here the 'alert' lane.
 """
 
 from celery import shared_task
@@ -11,11 +15,11 @@ from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
 from accounts.models import User
 from notification.models import EmailNotification
-from Real_MFA.email_provider import send_app_email
+from notification.registry import registry
+from Real_MFA.email_provider import ProviderHTTPError, send_app_email
 import uuid
 import smtplib
 import logging
-import urllib.error
 
 logger = logging.getLogger(__name__)
 
@@ -28,11 +32,70 @@ def _short_exc(exc: Exception) -> str:
     return msg
 
 
-@shared_task(bind=True, rate_limit='2/s', max_retries=3)
+def _send_templated(user, name, context=None, lane='alert'):
+    """
+    Render a registered notification template, send it to the user and log it.
+    Returns the provider send result.
+    """
+    email = registry.render(name, {'user': user, **(context or {})})
+    send_result = send_app_email(
+        subject=email.subject,
+        message=email.text,
+        from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', ''),
+        recipient_list=[user.email],
+        html_message=email.html,
+        fail_silently=False,
+        lane=lane,
+    )
+
+    EmailNotification.objects.create(
+        user=user,
+        to_email=user.email,
+        subject=email.subject,
+        email_type=email.email_type,
+        template_name=email.template_name,
+        body=email.html,
+        status='sent',
+        sent_at=timezone.now(),
+        provider=send_result.get('provider', 'smtp'),
+        # Unique constraint: blank string will collide on every insert.
+        provider_message_id=send_result.get('message_id') or f"smtp-{uuid.uuid4()}"
+    )
+    return send_result
+
+
+@shared_task(bind=True, max_retries=3)
+def send_notification_email(self, user_id, template, context=None):
+    """
+    Send any registered notification template (notification.registry) to a user.
+    context must be JSON-serializable; `user` and the shared site context are added.
+    """
+    try:
+        user = User.objects.get(id=user_id)
+        _send_templated(user, template, context)
+        logger.info("Notification email '%s' sent to %s", template, user.email)
+        return {'status': 'success', 'user_id': str(user_id), 'template': template}
+
+    except User.DoesNotExist:
+        logger.error(f"User {user_id} not found for notification email '{template}'")
+        return {'status': 'failed', 'reason': 'User not found'}
+
+    except Exception as exc:
+        logger.error("Error sending notification email '%s': %s", template, _short_exc(exc))
+        if getattr(settings, 'DEBUG', False) or getattr(self.request, 'is_eager', False):
+            return {'status': 'failed', 'reason': 'send_failed', 'error': _short_exc(exc)}
+
+        # Unknown templates and provider rejections will not succeed on retry.
+        if isinstance(exc, KeyError) or (isinstance(exc, ProviderHTTPError) and exc.code in (400, 401, 403, 404)):
+            return {'status': 'failed', 'reason': 'rejected', 'error': _short_exc(exc)}
+
+        raise self.retry(exc=exc, countdown=5 ** self.request.retries)
+
+
+@shared_task(bind=True, max_retries=3)
 def send_verification_email(self, user_id):
     """
     Send email verification link to user
-    Rate limited to 2 emails/second to avoid Gmail throttling
     Retries with exponential backoff on failure
     """
     try:
@@ -51,18 +114,6 @@ def send_verification_email(self, user_id):
         if getattr(settings, 'DEBUG', False) or str(getattr(settings, 'PRINT_VERIFICATION_LINK', False)).lower() == 'true':
             logger.info("Verification link for %s: %s", user.email, verification_link)
         
-        # Email content
-        subject = "Verify Your Email - Real MFA"
-        html_message = f"""
-        <h2>Welcome to Real MFA!</h2>
-        <p>Thank you for registering. Please verify your email by clicking the link below:</p>
-        <a href="{verification_link}" style="background-color: #007bff; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px;">
-            Verify Email
-        </a>
-        <p>This link expires in 24 hours.</p>
-        <p>If you didn't register, please ignore this email.</p>
-        """
-        
         # If using SMTP in development but you don't want to configure credentials,
         # skip sending and just rely on the printed link for manual verification.
         if (
@@ -73,31 +124,9 @@ def send_verification_email(self, user_id):
                 "SMTP is configured but EMAIL_HOST_PASSWORD is empty; skipping email send for %s",
                 user.email,
             )
-        else:
-            # Send email using configured provider mode.
-            send_result = send_app_email(
-                subject=subject,
-                message="Please verify your email by clicking the link above.",
-                from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', ''),
-                recipient_list=[user.email],
-                html_message=html_message,
-                fail_silently=False
-            )
-        
-        # Log email notification
-        EmailNotification.objects.create(
-            user=user,
-            to_email=user.email,
-            subject=subject,
-            email_type='email_verification',
-            template_name='email_verification.html',
-            body=html_message,
-            status='sent',
-            sent_at=timezone.now(),
-            provider=send_result.get('provider', 'smtp'),
-            # Unique constraint: blank string will collide on every insert.
-            provider_message_id=send_result.get('message_id') or f"smtp-{uuid.uuid4()}"
-        )
+            return {'status': 'skipped', 'reason': 'smtp_not_configured', 'user_id': str(user_id)}
+
+        _send_templated(user, 'email_verification', {'verification_link': verification_link})
         
         logger.info(f"Verification email sent to {user.email}")
         return {'status': 'success', 'user_id': str(user_id)}
@@ -122,7 +151,7 @@ def send_verification_email(self, user_id):
         raise self.retry(exc=exc, countdown=5 ** self.request.retries)
 
 
-@shared_task(bind=True, rate_limit='2/s', max_retries=3)
+@shared_task(bind=True, max_retries=3)
 def send_password_reset_otp(self, user_id, otp_code):
     """
     Send password reset OTP to user's email
@@ -134,40 +163,7 @@ def send_password_reset_otp(self, user_id, otp_code):
         if getattr(settings, 'DEBUG', False):
             logger.info("Password Reset OTP for %s: %s", user.email, otp_code)
         
-        subject = "Password Reset Code - Real MFA"
-        html_message = f"""
-        <h2>Password Reset Request</h2>
-        <p>You requested to reset your password. Use the code below:</p>
-        <div style="background-color: #f4f4f4; padding: 20px; text-align: center; font-size: 32px; font-weight: bold; letter-spacing: 5px; margin: 20px 0;">
-            {otp_code}
-        </div>
-        <p>This code expires in <strong>15 minutes</strong>.</p>
-        <p>If you didn't request this, please ignore this email or contact support if you're concerned.</p>
-        """
-        
-        # Send email using configured provider mode.
-        send_result = send_app_email(
-            subject=subject,
-            message=f"Your password reset code is: {otp_code}. This code expires in 15 minutes.",
-            from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', ''),
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False
-        )
-        
-        # Log notification
-        EmailNotification.objects.create(
-            user=user,
-            to_email=user.email,
-            subject=subject,
-            email_type='password_reset',
-            template_name='password_reset_otp.html',
-            body=html_message,
-            status='sent',
-            sent_at=timezone.now(),
-            provider=send_result.get('provider', 'smtp'),
-            provider_message_id=send_result.get('message_id') or f"smtp-{uuid.uuid4()}"
-        )
+        _send_templated(user, 'password_reset_otp', {'otp_code': otp_code}, lane='otp')
         
         logger.info(f"Password reset OTP sent to {user.email}")
         return {'status': 'success', 'user_id': str(user_id)}
@@ -183,7 +179,7 @@ def send_password_reset_otp(self, user_id, otp_code):
         raise self.retry(exc=exc, countdown=5 ** self.request.retries)
 
 
-@shared_task(bind=True, rate_limit='2/s', max_retries=3)
+@shared_task(bind=True, max_retries=3)
 def send_device_verification_otp(self, user_id, otp_code):
     """
     Send device verification OTP to user's email
@@ -195,40 +191,7 @@ def send_device_verification_otp(self, user_id, otp_code):
         if getattr(settings, 'DEBUG', False):
             logger.info("Device Verification OTP for %s: %s", user.email, otp_code)
         
-        subject = "Device Verification Code - Real MFA"
-        html_message = f"""
-        <h2>New Device Login Attempt</h2>
-        <p>A login attempt was made from a new device. Use the code below to verify:</p>
-        <div style="background-color: #f4f4f4; padding: 20px; text-align: center; font-size: 32px; font-weight: bold; letter-spacing: 5px; margin: 20px 0;">
-            {otp_code}
-        </div>
-        <p>This code expires in <strong>10 minutes</strong>.</p>
-        <p>If this wasn't you, please change your password immediately.</p>
-        """
-        
-        # Send email using configured provider mode.
-        send_result = send_app_email(
-            subject=subject,
-            message=f"Your device verification code is: {otp_code}. This code expires in 10 minutes.",
-            from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', ''),
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False
-        )
-        
-        # Log notification
-        EmailNotification.objects.create(
-            user=user,
-            to_email=user.email,
-            subject=subject,
-            email_type='device_verification',
-            template_name='device_verification_otp.html',
-            body=html_message,
-            status='sent',
-            sent_at=timezone.now(),
-            provider=send_result.get('provider', 'smtp'),
-            provider_message_id=send_result.get('message_id') or f"smtp-{uuid.uuid4()}"
-        )
+        _send_templated(user, 'device_verification_otp', {'otp_code': otp_code}, lane='otp')
         
         logger.info(f"Device verification OTP sent to {user.email}")
         return {'status': 'success', 'user_id': str(user_id)}
@@ -243,7 +206,7 @@ def send_device_verification_otp(self, user_id, otp_code):
             return {'status': 'failed', 'reason': 'send_failed', 'error': _short_exc(exc)}
 
         # Provider permission/auth errors are permanent and should not be retried.
-        if isinstance(exc, urllib.error.HTTPError) and exc.code in (400, 401, 403, 404):
+        if isinstance(exc, ProviderHTTPError) and exc.code in (400, 401, 403, 404):
             return {'status': 'failed', 'reason': 'provider_rejected', 'error': _short_exc(exc)}
 
         raise self.retry(exc=exc, countdown=5 ** self.request.retries)
@@ -1,66 +1,291 @@
 """Email delivery helpers with SMTP and Brevo API support."""
 
-import json
 import logging
-import urllib.error
-import urllib.request
+import os
+import queue
+import smtplib
+import socket
+import time
 from typing import Dict, List, Optional
 
+import requests
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, get_connection
+from requests.adapters import HTTPAdapter
+
+from Real_MFA.email_quota import SendQuotaExceeded, send_quota
 
 logger = logging.getLogger(__name__)
 
+# A dropped connection is reopened and the message retried once; any other
+# error is a problem with the message itself and is raised as-is.
+_RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout)
 
-def _send_via_brevo_api(
+
+class _PooledConnection:
+    __slots__ = ("backend", "sent", "last_used")
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """
+    Per-process pool of open email backend connections.
+
+    Opening an SMTP connection costs a TLS handshake and AUTH, so connections
+    stay open between messages:
+    - connections idle longer than EMAIL_SMTP_KEEPALIVE_SECONDS are probed
+      with NOOP before reuse and replaced if the server dropped them
+    - a connection is retired after EMAIL_SMTP_MAX_MESSAGES_PER_CONNECTION
+      messages, as providers throttle or cut long-lived sessions
+    - at most EMAIL_SMTP_POOL_SIZE idle connections are kept
+    Connections are checked out by one sender at a time, so threaded senders
+    never share an smtplib session. A forked worker starts with an empty pool.
+    """
+
+    def __init__(self):
+        self._idle = queue.LifoQueue()
+
+    def _open(self) -> _PooledConnection:
+        backend = get_connection(fail_silently=False)
+        backend.open()
+        return _PooledConnection(backend)
+
+    @staticmethod
+    def _is_alive(pooled: _PooledConnection) -> bool:
+        keepalive = float(getattr(settings, "EMAIL_SMTP_KEEPALIVE_SECONDS", 30))
+        smtp = getattr(pooled.backend, "connection", None)
+        if smtp is None or time.monotonic() - pooled.last_used < keepalive:
+            return True
+        try:
+            return smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _checkout(self) -> _PooledConnection:
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+            if self._is_alive(pooled):
+                return pooled
+            self._discard(pooled)
+
+    def _checkin(self, pooled: _PooledConnection) -> None:
+        max_messages = int(getattr(settings, "EMAIL_SMTP_MAX_MESSAGES_PER_CONNECTION", 100))
+        pool_size = int(getattr(settings, "EMAIL_SMTP_POOL_SIZE", 4))
+        if pooled.sent >= max_messages or self._idle.qsize() >= pool_size:
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        self._idle.put(pooled)
+
+    @staticmethod
+    def _discard(pooled: _PooledConnection) -> None:
+        try:
+            pooled.backend.close()
+        except Exception:
+            logger.debug("Error closing pooled email connection", exc_info=True)
+
+    def send(self, message: EmailMultiAlternatives) -> int:
+        """Send one message on a pooled connection; returns the sent count."""
+        for attempt in (1, 2):
+            pooled = self._checkout()
+            try:
+                sent = pooled.backend.send_messages([message])
+            except _RECONNECT_ERRORS:
+                self._discard(pooled)
+                if attempt == 2:
+                    raise
+                logger.info("Pooled SMTP connection dropped; reconnecting")
+                continue
+            except Exception:
+                self._discard(pooled)
+                raise
+            pooled.sent += 1
+            self._checkin(pooled)
+            return sent or 0
+        return 0
+
+    def close_all(self) -> None:
+        """Close every idle connection (worker shutdown)."""
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def _reset_after_fork(self) -> None:
+        # Sockets inherited from the parent belong to the parent's sessions
+        self._idle = queue.LifoQueue()
+
+
+smtp_pool = SMTPConnectionPool()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=smtp_pool._reset_after_fork)
+
+
+def _send_via_smtp(
     subject: str,
     message: str,
     recipient_list: List[str],
     html_message: Optional[str] = None,
     from_email: Optional[str] = None,
+    fail_silently: bool = False,
 ) -> Dict[str, str]:
-    api_key = getattr(settings, "BREVO_API_KEY", "")
-    if not api_key:
-        raise ValueError("BREVO_API_KEY is not configured")
-
-    sender_email = from_email or getattr(settings, "DEFAULT_FROM_EMAIL", "")
-    if not sender_email:
-        raise ValueError("DEFAULT_FROM_EMAIL is not configured")
-
-    payload = {
-        "sender": {"email": sender_email},
-        "to": [{"email": email} for email in recipient_list],
-        "subject": subject,
-        "textContent": message or "",
-        "htmlContent": html_message or message or "",
-    }
-
-    endpoint = getattr(settings, "BREVO_API_ENDPOINT", "https://api.brevo.com/v3/smtp/email")
-    req = urllib.request.Request(
-        endpoint,
-        data=json.dumps(payload).encode("utf-8"),
-        headers={
-            "accept": "application/json",
-            "content-type": "application/json",
-            "api-key": api_key,
-        },
-        method="POST",
+    email = EmailMultiAlternatives(
+        subject=subject,
+        body=message,
+        from_email=from_email or getattr(settings, "DEFAULT_FROM_EMAIL", ""),
+        to=recipient_list,
     )
+    if html_message:
+        email.attach_alternative(html_message, "text/html")
 
-    timeout = int(getattr(settings, "EMAIL_TIMEOUT", 30))
     try:
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
-            body = resp.read().decode("utf-8") if resp else "{}"
-            data = json.loads(body or "{}")
-            message_id = data.get("messageId") or data.get("messageIds", [None])[0]
-            return {
-                "provider": "brevo_api",
-                "message_id": str(message_id or ""),
-            }
-    except urllib.error.HTTPError as exc:
-        details = exc.read().decode("utf-8", errors="ignore")
-        logger.error("Brevo API HTTP error: %s %s", exc.code, details)
-        raise
+        sent_count = smtp_pool.send(email)
+    except Exception:
+        if not fail_silently:
+            raise
+        sent_count = 0
+    return {
+        "provider": "smtp",
+        "message_id": "",
+        "sent_count": str(sent_count),
+    }
+
+
+class ProviderHTTPError(Exception):
+    """Non-2xx response from an email provider API."""
+
+    def __init__(self, code: int, details: str = ""):
+        super().__init__(f"HTTP {code}: {details}")
+        self.code = code
+        self.details = details
+
+
+class BrevoClient:
+    """
+    Brevo transactional email API over a keep-alive connection pool.
+
+    One requests.Session per process keeps up to BREVO_HTTP_POOL_SIZE
+    connections open, so consecutive sends skip the TCP and TLS setup.
+    send_batch() sends several messages in one POST using messageVersions.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._pid = None
+
+    def _get_session(self) -> requests.Session:
+        # A forked worker must not reuse the parent's sockets
+        if self._session is None or self._pid != os.getpid():
+            pool_size = int(getattr(settings, "BREVO_HTTP_POOL_SIZE", 10))
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session, self._pid = session, os.getpid()
+        return self._session
+
+    def _post(self, payload: Dict) -> Dict:
+        api_key = getattr(settings, "BREVO_API_KEY", "")
+        if not api_key:
+            raise ValueError("BREVO_API_KEY is not configured")
+
+        endpoint = getattr(settings, "BREVO_API_ENDPOINT", "https://api.brevo.com/v3/smtp/email")
+        timeout = int(getattr(settings, "EMAIL_TIMEOUT", 30))
+        response = self._get_session().post(
+            endpoint,
+            json=payload,
+            headers={
+                "accept": "application/json",
+                "api-key": api_key,
+            },
+            timeout=timeout,
+        )
+        if response.status_code >= 400:
+            logger.error("Brevo API HTTP error: %s %s", response.status_code, response.text)
+            raise ProviderHTTPError(response.status_code, response.text)
+        return response.json() if response.content else {}
+
+    @staticmethod
+    def _sender(from_email: Optional[str]) -> Dict[str, str]:
+        sender_email = from_email or getattr(settings, "DEFAULT_FROM_EMAIL", "")
+        if not sender_email:
+            raise ValueError("DEFAULT_FROM_EMAIL is not configured")
+        return {"email": sender_email}
+
+    def send(
+        self,
+        subject: str,
+        message: str,
+        recipient_list: List[str],
+        html_message: Optional[str] = None,
+        from_email: Optional[str] = None,
+    ) -> Dict[str, str]:
+        data = self._post({
+            "sender": self._sender(from_email),
+            "to": [{"email": email} for email in recipient_list],
+            "subject": subject,
+            "textContent": message or "",
+            "htmlContent": html_message or message or "",
+        })
+        message_id = data.get("messageId") or (data.get("messageIds") or [None])[0]
+        return {
+            "provider": "brevo_api",
+            "message_id": str(message_id or ""),
+        }
+
+    def send_batch(self, messages: List[Dict[str, str]], from_email: Optional[str] = None) -> List[str]:
+        """
+        Send single-recipient messages in one request.
+
+        messages: dicts with to, subject, message and html_message.
+        Returns the provider message ids in the same order.
+        """
+        first = messages[0]
+        data = self._post({
+            "sender": self._sender(from_email),
+            "subject": first["subject"],
+            "textContent": first.get("message") or "",
+            "htmlContent": first.get("html_message") or first.get("message") or "",
+            "messageVersions": [
+                {
+                    "to": [{"email": item["to"]}],
+                    "subject": item["subject"],
+                    "textContent": item.get("message") or "",
+                    "htmlContent": item.get("html_message") or item.get("message") or "",
+                }
+                for item in messages
+            ],
+        })
+        message_ids = [str(message_id or "") for message_id in data.get("messageIds") or []]
+        return message_ids + [""] * (len(messages) - len(message_ids))
+
+
+brevo_client = BrevoClient()
+
+
+def _send_via_brevo_api(
+    subject: str,
+    message: str,
+    recipient_list: List[str],
+    html_message: Optional[str] = None,
+    from_email: Optional[str] = None,
+) -> Dict[str, str]:
+    return brevo_client.send(
+        subject=subject,
+        message=message,
+        recipient_list=recipient_list,
+        html_message=html_message,
+        from_email=from_email,
+    )
 
 
 def send_app_email(
@@ -71,6 +296,7 @@ def send_app_email(
     html_message: Optional[str] = None,
     from_email: Optional[str] = None,
     fail_silently: bool = False,
+    lane: str = "alert",
 ) -> Dict[str, str]:
     """
     Send email based on EMAIL_DELIVERY_MODE.
@@ -79,10 +305,15 @@ def send_app_email(
     - smtp: SMTP only
     - brevo_api: Brevo API only
     - smtp_with_brevo_fallback: SMTP first, then Brevo API on SMTP failure
+
+    A permit is taken from the provider's send quota (Real_MFA.email_quota)
+    on `lane` before each provider call; SendQuotaExceeded is raised when
+    none frees up within the lane's wait budget.
     """
     mode = str(getattr(settings, "EMAIL_DELIVERY_MODE", "smtp")).strip().lower()
 
     if mode == "brevo_api":
+        send_quota.acquire("brevo_api", lane)
         return _send_via_brevo_api(
             subject=subject,
             message=message,
@@ -93,21 +324,18 @@ def send_app_email(
 
     if mode == "smtp_with_brevo_fallback":
         try:
-            sent_count = send_mail(
+            send_quota.acquire("smtp", lane)
+            return _send_via_smtp(
                 subject=subject,
                 message=message,
-                from_email=from_email or getattr(settings, "DEFAULT_FROM_EMAIL", ""),
                 recipient_list=recipient_list,
                 html_message=html_message,
-                fail_silently=fail_silently,
+                from_email=from_email,
             )
-            return {
-                "provider": "smtp",
-                "message_id": "",
-                "sent_count": str(sent_count),
-            }
         except Exception:
+            # SMTP throttled (SendQuotaExceeded) falls back the same way
             logger.warning("SMTP failed; falling back to Brevo API", exc_info=True)
+            send_quota.acquire("brevo_api", lane)
             return _send_via_brevo_api(
                 subject=subject,
                 message=message,
@@ -116,16 +344,76 @@ def send_app_email(
                 from_email=from_email,
             )
 
-    sent_count = send_mail(
+    send_quota.acquire("smtp", lane)
+    return _send_via_smtp(
         subject=subject,
         message=message,
-        from_email=from_email or getattr(settings, "DEFAULT_FROM_EMAIL", ""),
         recipient_list=recipient_list,
         html_message=html_message,
+        from_email=from_email,
         fail_silently=fail_silently,
     )
+
+
+def is_permanent_failure(exc: Exception) -> bool:
+    """Rejected recipient or request: the same message would fail again."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(exc, ProviderHTTPError) and exc.code == 400
+
+
+def failure_result(provider: str, exc: Exception) -> Dict:
+    """Send result for a failed message, as send_app_email_batch reports it."""
     return {
-        "provider": "smtp",
-        "message_id": "",
-        "sent_count": str(sent_count),
+        "provider": provider,
+        "error": str(exc),
+        "permanent": is_permanent_failure(exc),
+        # Never reached the provider: retry without counting an attempt
+        "throttled": isinstance(exc, SendQuotaExceeded),
     }
+
+
+def send_app_email_batch(
+    messages: List[Dict[str, str]],
+    from_email: Optional[str] = None,
+    lane: str = "bulk",
+) -> List[Dict[str, str]]:
+    """
+    Send single-recipient messages rendered from the same template.
+
+    In brevo_api mode they go out BREVO_BATCH_SIZE at a time through the
+    batch endpoint; other modes send one by one over pooled SMTP connections.
+    messages: dicts with to, subject, message and html_message.
+    Returns one result per message, in order; failed messages carry "error"
+    and "permanent" (retrying cannot help, see is_permanent_failure), and
+    "throttled" when no send permit was free on `lane`.
+    """
+    mode = str(getattr(settings, "EMAIL_DELIVERY_MODE", "smtp")).strip().lower()
+    results = []
+
+    if mode == "brevo_api":
+        batch_size = int(getattr(settings, "BREVO_BATCH_SIZE", 100))
+        for start in range(0, len(messages), batch_size):
+            chunk = messages[start:start + batch_size]
+            try:
+                send_quota.acquire("brevo_api", lane)
+                message_ids = brevo_client.send_batch(chunk, from_email=from_email)
+            except Exception as exc:
+                results.extend(failure_result("brevo_api", exc) for _ in chunk)
+                continue
+            results.extend({"provider": "brevo_api", "message_id": message_id} for message_id in message_ids)
+        return results
+
+    for item in messages:
+        try:
+            results.append(send_app_email(
+                subject=item["subject"],
+                message=item.get("message") or "",
+                recipient_list=[item["to"]],
+                html_message=item.get("html_message"),
+                from_email=from_email,
+                lane=lane,
+            ))
+        except Exception as exc:
+            results.append(failure_result(mode, exc))
+    return results
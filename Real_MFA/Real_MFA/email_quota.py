@@ -0,0 +1,222 @@
+"""
+Email Send Quota - Cluster-wide token bucket per provider with priority lanes
+
+Every provider call takes a permit first (one per SMTP message, one per Brevo
+API request), so the provider sees one send rate however many workers run:
+
+    acquire('smtp', lane='otp')   # blocks until a permit is free
+
+Each provider has one bucket (EMAIL_SEND_RATE_LIMITS: refill rate per second
+and burst capacity) held in Redis and updated by a Lua script, using the
+Redis clock so workers on different hosts agree. Lanes share the bucket but
+lower lanes must leave a reserve (EMAIL_QUOTA_LANE_RESERVE, a fraction of
+the capacity) untouched:
+
+    otp    login / password reset / device OTPs   reserve 0
+    alert  security alerts, verification email   reserve 0.2
+    bulk   retries (drain) and digests            reserve 0.5
+
+so a retry backlog drains the bucket only down to half and an OTP always
+finds a permit ahead of it. Without Redis (cache-backed KV) each process
+keeps its own bucket: the limit then holds per process only.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from accounts.redis_utils import redis_client
+
+logger = logging.getLogger(__name__)
+
+LANES = ('otp', 'alert', 'bulk')
+
+DEFAULT_LANE_RESERVE = {'otp': 0.0, 'alert': 0.2, 'bulk': 0.5}
+DEFAULT_LANE_WAIT_SECONDS = {'otp': 10.0, 'alert': 30.0, 'bulk': 5.0}
+
+
+class SendQuotaExceeded(Exception):
+    """No permit became free within the lane's wait budget."""
+
+    def __init__(self, provider: str, lane: str, retry_after: float):
+        self.provider = provider
+        self.lane = lane
+        self.retry_after = retry_after
+        super().__init__(f"{provider} send quota exhausted for lane '{lane}' (retry in {retry_after:.2f}s)")
+
+
+# KEYS[1] bucket hash; ARGV rate, capacity, permits, reserve (tokens), ttl
+# Returns {granted, tokens left, seconds until the request would fit}
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local permits = tonumber(ARGV[3])
+local reserve = tonumber(ARGV[4])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local granted = 0
+local wait = 0
+if tokens - permits >= reserve then
+    tokens = tokens - permits
+    granted = 1
+else
+    wait = (reserve + permits - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[5]))
+return {granted, tostring(tokens), tostring(wait)}
+"""
+
+
+def _key(provider):
+    return f"email_quota:{provider}"
+
+
+def provider_limits(provider):
+    """(rate per second, capacity) for a provider, or None when it is not limited"""
+    limits = getattr(settings, 'EMAIL_SEND_RATE_LIMITS', {}).get(provider)
+    if not limits or not limits[0]:
+        return None
+    rate, capacity = float(limits[0]), float(limits[1])
+    return rate, max(capacity, 1.0)
+
+
+def _reserve(lane, capacity):
+    reserves = getattr(settings, 'EMAIL_QUOTA_LANE_RESERVE', DEFAULT_LANE_RESERVE)
+    return float(reserves.get(lane, DEFAULT_LANE_RESERVE['bulk'])) * capacity
+
+
+class _LocalBucket:
+    """Per-process fallback when there is no Redis to share the bucket through"""
+
+    def __init__(self, capacity):
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, rate, capacity, permits, reserve):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            if self.tokens - permits >= reserve:
+                self.tokens -= permits
+                return True, self.tokens, 0.0
+            return False, self.tokens, (reserve + permits - self.tokens) / rate
+
+
+class SendQuota:
+    """Token buckets per provider, shared through Redis when it is available"""
+
+    def __init__(self):
+        self._script = None
+        self._local = {}
+        self._local_lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return hasattr(redis_client, 'register_script')
+
+    def _local_bucket(self, provider, capacity):
+        with self._local_lock:
+            bucket = self._local.get(provider)
+            if bucket is None:
+                bucket = self._local[provider] = _LocalBucket(capacity)
+            return bucket
+
+    def try_take(self, provider, lane='alert', permits=1):
+        """
+        One attempt at taking permits: (granted, tokens left, seconds to wait).
+        Unlimited providers always grant.
+        """
+        limits = provider_limits(provider)
+        if limits is None:
+            return True, float('inf'), 0.0
+        rate, capacity = limits
+        permits = min(float(permits), capacity)
+        reserve = min(_reserve(lane, capacity), capacity - permits)
+
+        if self.shared:
+            try:
+                if self._script is None:
+                    self._script = redis_client.register_script(_TAKE_SCRIPT)
+                # Idle buckets are full again after capacity / rate seconds
+                ttl = int(capacity / rate) + 60
+                granted, tokens, wait = self._script(
+                    keys=[_key(provider)], args=[rate, capacity, permits, reserve, ttl],
+                )
+                return bool(granted), float(tokens), float(wait)
+            except Exception as exc:
+                logger.warning("Shared email quota unavailable, using a per-process bucket: %s", exc)
+        return self._local_bucket(provider, capacity).take(rate, capacity, permits, reserve)
+
+    def acquire(self, provider, lane='alert', permits=1, timeout=None):
+        """
+        Block until permits are granted on the lane, or raise SendQuotaExceeded
+        after `timeout` seconds (default: EMAIL_QUOTA_LANE_WAIT_SECONDS[lane]).
+        """
+        if timeout is None:
+            waits = getattr(settings, 'EMAIL_QUOTA_LANE_WAIT_SECONDS', DEFAULT_LANE_WAIT_SECONDS)
+            timeout = float(waits.get(lane, DEFAULT_LANE_WAIT_SECONDS['bulk']))
+        deadline = time.monotonic() + timeout
+        while True:
+            granted, _, wait = self.try_take(provider, lane, permits)
+            if granted:
+                return
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise SendQuotaExceeded(provider, lane, wait)
+            time.sleep(wait)
+
+    def status(self):
+        """Current quota per configured provider, for the email_quota command"""
+        report = {}
+        for provider in getattr(settings, 'EMAIL_SEND_RATE_LIMITS', {}):
+            limits = provider_limits(provider)
+            if limits is None:
+                continue
+            rate, capacity = limits
+            tokens = self._peek(provider, rate, capacity)
+            report[provider] = {
+                'rate_per_second': rate,
+                'capacity': capacity,
+                'tokens': round(tokens, 2),
+                'shared': self.shared,
+                'lanes': {
+                    lane: {
+                        'reserve': _reserve(lane, capacity),
+                        'available': max(0, int(tokens - _reserve(lane, capacity))),
+                    }
+                    for lane in LANES
+                },
+            }
+        return report
+
+    def _peek(self, provider, rate, capacity):
+        """Tokens in the bucket right now, without taking any"""
+        if self.shared:
+            try:
+                tokens, ts = redis_client.hmget(_key(provider), 'tokens', 'ts')
+                if tokens is None:
+                    return capacity
+                seconds, micros = redis_client.time()
+                elapsed = max(0.0, seconds + micros / 1e6 - float(ts))
+                return min(capacity, float(tokens) + elapsed * rate)
+            except Exception as exc:
+                logger.warning("Shared email quota unavailable: %s", exc)
+        bucket = self._local.get(provider)
+        if bucket is None:
+            return capacity
+        return min(capacity, bucket.tokens + (time.monotonic() - bucket.updated) * rate)
+
+
+send_quota = SendQuota()
+acquire = send_quota.acquire
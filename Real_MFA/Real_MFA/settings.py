@@ -313,6 +313,9 @@ CORS_EXPOSE_HEADERS = [
 # SMTP provider is controlled fully by environment variables.
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'noreply@realmfa.com')
+# Shared context for every notification template (notification.registry)
+SITE_NAME = os.getenv('SITE_NAME', 'Real MFA')
+SUPPORT_EMAIL = os.getenv('SUPPORT_EMAIL', DEFAULT_FROM_EMAIL)
 
 # SMTP settings
 EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
@@ -325,6 +328,53 @@ EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', 30))
 EMAIL_DELIVERY_MODE = os.getenv('EMAIL_DELIVERY_MODE', 'smtp')
 BREVO_API_KEY = os.getenv('BREVO_API_KEY', '')
 BREVO_API_ENDPOINT = os.getenv('BREVO_API_ENDPOINT', 'https://api.brevo.com/v3/smtp/email')
+BREVO_HTTP_POOL_SIZE = int(os.getenv('BREVO_HTTP_POOL_SIZE', 10))
+# Messages per messageVersions request when queued notifications share a template (Brevo max 1000)
+BREVO_BATCH_SIZE = int(os.getenv('BREVO_BATCH_SIZE', 100))
+
+# send_pending_notifications (every minute) leases due batches so several workers
+# can drain in parallel; each batch is sent on NOTIFICATION_DRAIN_THREADS threads.
+NOTIFICATION_DRAIN_BATCH_SIZE = int(os.getenv('NOTIFICATION_DRAIN_BATCH_SIZE', 200))
+NOTIFICATION_DRAIN_THREADS = int(os.getenv('NOTIFICATION_DRAIN_THREADS', 4))
+NOTIFICATION_DRAIN_LEASE_SECONDS = int(os.getenv('NOTIFICATION_DRAIN_LEASE_SECONDS', 300))
+NOTIFICATION_DRAIN_MAX_SECONDS = int(os.getenv('NOTIFICATION_DRAIN_MAX_SECONDS', 50))
+# Failed sends retry after BASE * 2^(n-1) seconds (with jitter, capped at MAX);
+# after max_retries, or on a permanent rejection, the row becomes 'dead'.
+NOTIFICATION_RETRY_BASE_SECONDS = int(os.getenv('NOTIFICATION_RETRY_BASE_SECONDS', 60))
+NOTIFICATION_RETRY_MAX_SECONDS = int(os.getenv('NOTIFICATION_RETRY_MAX_SECONDS', 6 * 3600))
+
+# Security alerts go through notification_outbox: written in the request's
+# transaction, published on commit, re-published by the sweep after STALE_SECONDS.
+NOTIFICATION_OUTBOX_STALE_SECONDS = int(os.getenv('NOTIFICATION_OUTBOX_STALE_SECONDS', 120))
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_OUTBOX_MAX_ATTEMPTS', 5))
+NOTIFICATION_OUTBOX_RETENTION_DAYS = int(os.getenv('NOTIFICATION_OUTBOX_RETENTION_DAYS', 7))
+
+# Low-severity alerts (these email types) are held for WINDOW_SECONDS from the
+# first one and sent as one digest per user; 0 disables. Critical alerts
+# (security_alert types such as suspicious_login) are never held.
+NOTIFICATION_DIGEST_WINDOW_SECONDS = int(os.getenv('NOTIFICATION_DIGEST_WINDOW_SECONDS', 120))
+NOTIFICATION_DIGEST_EMAIL_TYPES = ['account_alert']
+
+# Email / log bodies are stored once per unique text (notification_bodies);
+# bodies of 256+ bytes are zlib-compressed when that makes them smaller.
+NOTIFICATION_BODY_COMPRESSION = os.getenv('NOTIFICATION_BODY_COMPRESSION', 'True') == 'True'
+
+# SMTP connections are pooled per worker process and reused across messages.
+EMAIL_SMTP_POOL_SIZE = int(os.getenv('EMAIL_SMTP_POOL_SIZE', 4))
+EMAIL_SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv('EMAIL_SMTP_MAX_MESSAGES_PER_CONNECTION', 100))
+EMAIL_SMTP_KEEPALIVE_SECONDS = int(os.getenv('EMAIL_SMTP_KEEPALIVE_SECONDS', 30))
+
+# Cluster-wide send quota per provider (Real_MFA.email_quota): refill rate per
+# second and burst capacity; a rate of 0 disables the limit. Permits are per
+# SMTP message and per Brevo API request.
+EMAIL_SEND_RATE_LIMITS = {
+    'smtp': (float(os.getenv('EMAIL_SMTP_RATE_PER_SECOND', 2)), int(os.getenv('EMAIL_SMTP_BURST', 10))),
+    'brevo_api': (float(os.getenv('BREVO_RATE_PER_SECOND', 10)), int(os.getenv('BREVO_BURST', 50))),
+}
+# Share of the bucket lower-priority lanes must leave for the lanes above
+EMAIL_QUOTA_LANE_RESERVE = {'otp': 0.0, 'alert': 0.2, 'bulk': 0.5}
+# How long a send waits for a permit before SendQuotaExceeded
+EMAIL_QUOTA_LANE_WAIT_SECONDS = {'otp': 10.0, 'alert': 30.0, 'bulk': 5.0}
 
 # Verification email dispatch mode:
 # False (default) sends in-request so delivery works without a Celery worker.
@@ -352,12 +402,64 @@ TOTP_ISSUER_NAME = 'Real_MFA'
 TOTP_QR_CODE_SIZE = 10
 TOTP_ALLOW_INSECURE = os.getenv('TOTP_ALLOW_INSECURE', 'False') == 'True'
 
+# ============================================================================
+# MFA CHALLENGES
+# Active challenges live in Redis; terminal states are flushed to the DB.
+# ============================================================================
+MFA_CHALLENGE_TTL_SECONDS = int(os.getenv('MFA_CHALLENGE_TTL_SECONDS', 600))
+MFA_CHALLENGE_MAX_ATTEMPTS = int(os.getenv('MFA_CHALLENGE_MAX_ATTEMPTS', 3))
+MFA_CHALLENGE_FLUSH_BATCH_SIZE = int(os.getenv('MFA_CHALLENGE_FLUSH_BATCH_SIZE', 500))
+
+# Repeated OTP requests for the same user/device/purpose inside this window
+# reuse the pending OTP instead of creating and emailing a new one.
+OTP_DISPATCH_DEDUP_WINDOW_SECONDS = int(os.getenv('OTP_DISPATCH_DEDUP_WINDOW_SECONDS', 15))
+
+# ============================================================================
+# DEVICES & SESSIONS
+# ============================================================================
+# Risk scores are updated per event from Redis aggregates and flushed in batches.
+DEVICE_RISK_HALF_LIFE_HOURS = float(os.getenv('DEVICE_RISK_HALF_LIFE_HOURS', 24))
+DEVICE_RISK_COMPROMISE_THRESHOLD = int(os.getenv('DEVICE_RISK_COMPROMISE_THRESHOLD', 90))
+DEVICE_RISK_FLUSH_BATCH_SIZE = int(os.getenv('DEVICE_RISK_FLUSH_BATCH_SIZE', 500))
+
+# Expired trust is flipped in bulk by the expire_device_trust beat task
+DEVICE_TRUST_EXPIRY_BATCH_SIZE = int(os.getenv('DEVICE_TRUST_EXPIRY_BATCH_SIZE', 1000))
+
+# Sessions revoked / expired for longer than this move to sessions_archive
+SESSION_ARCHIVE_AFTER_DAYS = int(os.getenv('SESSION_ARCHIVE_AFTER_DAYS', 30))
+SESSION_ARCHIVE_CHUNK_SIZE = int(os.getenv('SESSION_ARCHIVE_CHUNK_SIZE', 1000))
+
+# Consecutive logins further apart than MIN_DISTANCE and faster than
+# MAX_SPEED are logged as device_location_anomaly. GeoIP is city-level at
+# best, so short hops are ignored.
+IMPOSSIBLE_TRAVEL_MAX_SPEED_KMH = float(os.getenv('IMPOSSIBLE_TRAVEL_MAX_SPEED_KMH', 1000))
+IMPOSSIBLE_TRAVEL_MIN_DISTANCE_KM = float(os.getenv('IMPOSSIBLE_TRAVEL_MIN_DISTANCE_KM', 500))
+IMPOSSIBLE_TRAVEL_CHECK_ON_LOGIN = os.getenv('IMPOSSIBLE_TRAVEL_CHECK_ON_LOGIN', 'True') == 'True'
+
+# Active sessions per user (0 = unlimited, the default). Policy when a login
+# would exceed the cap: 'reject' the login or 'evict_oldest' session(s).
+# Opt-in: with evict_oldest, the first login after enabling it revokes the
+# oldest sessions of every user already over the cap.
+MAX_CONCURRENT_SESSIONS = int(os.getenv('MAX_CONCURRENT_SESSIONS', 0))
+MAX_CONCURRENT_SESSIONS_POLICY = os.getenv('MAX_CONCURRENT_SESSIONS_POLICY', 'evict_oldest')
+
+# ============================================================================
+# BULK EMERGENCY CODES
+# Artifacts are Fernet-encrypted and kept outside MEDIA_ROOT / STATIC_ROOT.
+# ============================================================================
+EMERGENCY_CODES_ARTIFACT_DIR = Path(os.getenv('EMERGENCY_CODES_ARTIFACT_DIR', BASE_DIR / 'private' / 'emergency_codes'))
+EMERGENCY_CODES_ARTIFACT_TTL_HOURS = int(os.getenv('EMERGENCY_CODES_ARTIFACT_TTL_HOURS', 24))
+EMERGENCY_CODES_CHUNK_SIZE = int(os.getenv('EMERGENCY_CODES_CHUNK_SIZE', 500))
+
 # ============================================================================
 # REDIS CONFIGURATION
 # ============================================================================
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 REDIS_DB = int(os.getenv('REDIS_DB', 0))
+# 'auto' uses Redis when reachable and falls back to the cache-backed KV;
+# 'cache' always uses the cache-backed KV (benchmarks, local dev).
+REDIS_KV_BACKEND = os.getenv('REDIS_KV_BACKEND', 'auto')
 
 # ============================================================================
 # CACHING (Redis-backed for TTL support)
@@ -5,7 +5,8 @@ Admin Serializers - Comprehensive user data for admin dashboard
 from rest_framework import serializers
 from django.utils import timezone
 from .models import User, Profile, PasswordHistory
-from devices.models import Device, Session
+from devices.archive import session_history
+from devices.models import ArchivedSession, Device, Session
 from otp.models import OTP, TOTPDevice, BackupCode
 from notification.models import EmailNotification, SMSNotification
 
@@ -57,6 +58,7 @@ class AdminDeviceSerializer(serializers.ModelSerializer):
 class AdminSessionSerializer(serializers.ModelSerializer):
     """Session details for admin view"""
     duration = serializers.SerializerMethodField()
+    is_archived = serializers.SerializerMethodField()
     
     class Meta:
         model = Session
@@ -67,7 +69,7 @@ class AdminSessionSerializer(serializers.ModelSerializer):
             'country', 'city',
             'is_active', 'expires_at', 'last_activity',
             'revoked_at', 'revoked_reason',
-            'duration', 'created_at', 'updated_at'
+            'duration', 'is_archived', 'created_at', 'updated_at'
         ]
     
     def get_duration(self, obj):
@@ -75,6 +77,9 @@ class AdminSessionSerializer(serializers.ModelSerializer):
         if obj.revoked_at:
             return (obj.revoked_at - obj.created_at).total_seconds()
         return (timezone.now() - obj.created_at).total_seconds()
+    
+    def get_is_archived(self, obj):
+        return isinstance(obj, ArchivedSession)
 
 
 class AdminOTPSerializer(serializers.ModelSerializer):
@@ -223,7 +228,7 @@ class AdminUserDetailSerializer(serializers.ModelSerializer):
         return AdminDeviceSerializer(devices, many=True).data
     
     def get_sessions(self, obj):
-        sessions = obj.sessions.all().order_by('-created_at')[:50]  # Last 50 sessions
+        sessions = session_history(obj, limit=50)  # Last 50 sessions, hot and archived
         return AdminSessionSerializer(sessions, many=True).data
     
     def get_otps(self, obj):
@@ -68,6 +68,11 @@ urlpatterns = [
     path('mfa/bulk-enable/', admin_views.AdminBulkEnableMFAView.as_view(), name='admin-bulk-enable-mfa'),
     path('mfa/bulk-disable/', admin_views.AdminBulkDisableMFAView.as_view(), name='admin-bulk-disable-mfa'),
     
+    # Bulk emergency codes (background job + encrypted artifact)
+    path('mfa/emergency-codes/bulk/', admin_views.AdminBulkEmergencyCodesView.as_view(), name='admin-bulk-emergency-codes'),
+    path('mfa/emergency-codes/jobs/<uuid:job_id>/', admin_views.AdminEmergencyCodesJobView.as_view(), name='admin-emergency-codes-job'),
+    path('mfa/emergency-codes/jobs/<uuid:job_id>/download/', admin_views.AdminEmergencyCodesDownloadView.as_view(), name='admin-emergency-codes-download'),
+    
     # MFA policy settings
     path('mfa/policy/', admin_views.AdminMFAPolicyView.as_view(), name='admin-mfa-policy'),
 ]
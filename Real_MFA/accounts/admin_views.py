@@ -2,6 +2,8 @@
 Admin Views - Comprehensive user management APIs for admin dashboard
 """
 
+import uuid
+
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -619,19 +621,23 @@ class AdminSearchView(APIView):
         
         # Search sessions
         if search_type in ['all', 'sessions']:
-            from devices.models import Session
-            sessions = Session.objects.filter(
+            from devices.models import ArchivedSession, Session
+            session_filter = (
                 Q(ip_address__icontains=query) |
                 Q(device_name__icontains=query) |
                 Q(user_agent__icontains=query)
-            ).select_related('user')[:limit]
+            )
+            sessions = list(Session.objects.filter(session_filter).select_related('user')[:limit])
+            if len(sessions) < limit:
+                sessions += ArchivedSession.objects.filter(session_filter).select_related('user')[:limit - len(sessions)]
             
             results['sessions'] = [{
                 'id': str(session.id),
                 'user_email': session.user.email,
                 'device_name': session.device_name,
                 'ip_address': session.ip_address,
-                'is_active': session.is_active
+                'is_active': session.is_active,
+                'is_archived': isinstance(session, ArchivedSession)
             } for session in sessions]
             total_count += len(results['sessions'])
         
@@ -810,7 +816,8 @@ class AdminResetUserMFAView(APIView):
         # Revoke trusted devices
         from devices.models import Device
         trusted_devices = Device.objects.filter(user=user, is_trusted=True)
-        trusted_count = trusted_devices.count()
+        trusted_ids = list(trusted_devices.values_list('id', flat=True))
+        trusted_count = len(trusted_ids)
         if trusted_count > 0:
             trusted_devices.update(
                 is_trusted=False,
@@ -818,6 +825,10 @@ class AdminResetUserMFAView(APIView):
                 trust_expires_at=None,
                 mfa_skip_until=None
             )
+            from devices.signals import device_trust_changed
+            device_trust_changed.send(
+                sender=Device, device_ids=trusted_ids, user_ids=[user.id], reason='admin_revoked'
+            )
             actions_taken.append(f'Revoked {trusted_count} trusted devices')
         
         # Log the action
@@ -838,8 +849,8 @@ class AdminResetUserMFAView(APIView):
         
         # Send notification to user
         if notify_user:
-            from notification.utils import send_security_alert
-            send_security_alert(
+            from notification.utils import queue_security_alert
+            queue_security_alert(
                 user,
                 'mfa_disabled',
                 {'reason': 'Reset by administrator', 'admin_email': request.user.email},
@@ -1094,12 +1105,17 @@ class AdminRevokeTrustedDevicesView(APIView):
         devices = Device.objects.filter(user=user, is_trusted=True, is_deleted=False)
         count = devices.count()
         
+        device_ids = list(devices.values_list('id', flat=True))
         devices.update(
             is_trusted=False,
             can_skip_mfa=False,
             trust_expires_at=None,
             mfa_skip_until=None
         )
+        from devices.signals import device_trust_changed
+        device_trust_changed.send(
+            sender=Device, device_ids=device_ids, user_ids=[user.id], reason='admin_revoked'
+        )
         
         # Log action
         from audits_logs.models import AuditLog
@@ -1175,13 +1191,13 @@ class AdminMFAAuditHistoryView(APIView):
                 'emergency_codes_generated', 'trusted_devices_revoked',
                 'mfa_challenge_failed', 'mfa_challenge_success'
             ]
-        ).order_by('-timestamp')[:50]
+        ).order_by('-created_at')[:50]
         
         events = [{
             'id': str(log.id),
-            'timestamp': log.timestamp.isoformat(),
+            'timestamp': log.created_at.isoformat(),
             'event_type': log.event_type,
-            'action': log.action,
+            'action': log.metadata.get('action', ''),
             'ip_address': log.ip_address,
             'user_agent': log.user_agent,
             'metadata': log.metadata
@@ -1449,6 +1465,227 @@ class AdminBulkDisableMFAView(APIView):
         })
 
 
+class AdminBulkEmergencyCodesView(APIView):
+    """
+    Issue emergency backup codes for many users as a background job
+    
+    POST /api/admin/mfa/emergency-codes/bulk/
+    
+    Body (either user_ids or filter):
+    {
+        "user_ids": ["uuid1", "uuid2"],
+        "filter": {"role": "user", "mfa_enabled": true},
+        "codes_per_user": 10,
+        "reason": "IdP outage"
+    }
+    
+    Response (202):
+    {
+        "status": "accepted",
+        "job_id": "uuid",
+        "encryption_key": "...",   # shown once, needed to decrypt the artifact
+        "status_url": "...",
+        "download_url": "..."
+    }
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.role == 'admin'
+    
+    def post(self, request):
+        if not self.has_permission(request, None):
+            return Response(
+                {'error': 'Admin access required'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        from django.db import transaction
+        from django.urls import reverse
+        from otp import emergency_codes
+        from otp.models import EmergencyCodeJob
+        from otp.tasks import generate_emergency_codes_job
+        
+        if not emergency_codes.is_available():
+            return Response(
+                {'error': 'Encrypted artifacts are unavailable (cryptography not installed)'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        
+        user_ids = request.data.get('user_ids') or []
+        user_filter = request.data.get('filter') or {}
+        reason = request.data.get('reason', 'Bulk emergency codes by admin')
+        
+        if not user_ids and not user_filter:
+            return Response(
+                {'error': 'user_ids or filter required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        unknown_filters = set(user_filter) - set(EmergencyCodeJob.ALLOWED_FILTERS)
+        if unknown_filters:
+            return Response(
+                {'error': f"Unsupported filter(s): {', '.join(sorted(unknown_filters))}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if not isinstance(user_ids, list):
+            return Response(
+                {'error': 'user_ids must be a list of user ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            user_ids = [uuid.UUID(str(user_id)) for user_id in user_ids]
+        except ValueError:
+            return Response(
+                {'error': 'user_ids must contain valid user ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            codes_per_user = int(request.data.get('codes_per_user', 10))
+        except (TypeError, ValueError):
+            codes_per_user = 0
+        if not 1 <= codes_per_user <= 20:
+            return Response(
+                {'error': 'codes_per_user must be between 1 and 20'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        job = EmergencyCodeJob.objects.create(
+            requested_by=request.user,
+            user_ids=[str(user_id) for user_id in user_ids],
+            user_filter=user_filter,
+            codes_per_user=codes_per_user,
+            reason=reason,
+            ip_address=request.META.get('REMOTE_ADDR'),
+            user_agent=request.META.get('HTTP_USER_AGENT', ''),
+        )
+        encryption_key = emergency_codes.create_job_key(job.id)
+        
+        # Enqueue only once the job row is committed
+        transaction.on_commit(lambda: generate_emergency_codes_job.delay(str(job.id)))
+        
+        return Response({
+            'status': 'accepted',
+            'job_id': str(job.id),
+            'encryption_key': encryption_key,
+            'status_url': reverse('admin-emergency-codes-job', args=[job.id]),
+            'download_url': reverse('admin-emergency-codes-download', args=[job.id]),
+            'message': 'Store the encryption key now; it is not shown again'
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class AdminEmergencyCodesJobView(APIView):
+    """
+    Get progress of a bulk emergency code job
+    
+    GET /api/admin/mfa/emergency-codes/jobs/{job_id}/
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.role == 'admin'
+    
+    def get(self, request, job_id):
+        if not self.has_permission(request, None):
+            return Response(
+                {'error': 'Admin access required'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        from otp.models import EmergencyCodeJob
+        
+        try:
+            job = EmergencyCodeJob.objects.get(id=job_id)
+        except EmergencyCodeJob.DoesNotExist:
+            return Response(
+                {'error': 'Job not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        return Response({
+            'job_id': str(job.id),
+            'status': job.status,
+            'total_users': job.total_users,
+            'processed_users': job.processed_users,
+            'codes_per_user': job.codes_per_user,
+            'error': job.error,
+            'created_at': job.created_at,
+            'started_at': job.started_at,
+            'completed_at': job.completed_at,
+            'artifact_available': job.is_artifact_available(),
+            'artifact_sha256': job.artifact_sha256,
+            'artifact_expires_at': job.artifact_expires_at,
+            'downloaded_at': job.downloaded_at
+        })
+
+
+class AdminEmergencyCodesDownloadView(APIView):
+    """
+    Stream the encrypted artifact of a completed (or partial) bulk emergency code job
+    
+    GET /api/admin/mfa/emergency-codes/jobs/{job_id}/download/
+    
+    The file is Fernet-encrypted; decrypt with the key returned at creation:
+    python manage.py decrypt_emergency_codes <file> --key <key>
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.role == 'admin'
+    
+    def get(self, request, job_id):
+        if not self.has_permission(request, None):
+            return Response(
+                {'error': 'Admin access required'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        from django.http import FileResponse
+        from otp.models import EmergencyCodeJob
+        
+        try:
+            job = EmergencyCodeJob.objects.get(id=job_id)
+        except EmergencyCodeJob.DoesNotExist:
+            return Response(
+                {'error': 'Job not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        # A partial artifact holds the codes issued before the job failed
+        if job.status not in ('completed', 'partial'):
+            return Response(
+                {'error': f'Job is {job.status}', 'status': job.status},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        if not job.is_artifact_available():
+            return Response(
+                {'error': 'Artifact expired'},
+                status=status.HTTP_410_GONE
+            )
+        
+        try:
+            artifact = open(job.artifact_path, 'rb')
+        except FileNotFoundError:
+            return Response(
+                {'error': 'Artifact expired'},
+                status=status.HTTP_410_GONE
+            )
+        
+        EmergencyCodeJob.objects.filter(id=job.id).update(downloaded_at=timezone.now())
+        
+        response = FileResponse(
+            artifact,
+            as_attachment=True,
+            filename=f'emergency-codes-{job.id}.enc',
+            content_type='application/octet-stream'
+        )
+        response['X-Artifact-SHA256'] = job.artifact_sha256
+        return response
+
+
 class AdminMFAPolicyView(APIView):
     """
     Get or set MFA policy settings (stored in Django settings or database)
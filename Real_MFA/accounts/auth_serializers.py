@@ -5,17 +5,25 @@ OTP resend moved to otp app
 """
 
 import json
+import uuid
 from rest_framework import serializers
 from django.conf import settings
 from django.contrib.auth import authenticate
+from django.db.models import F
 from django.utils import timezone
 from rest_framework_simplejwt.tokens import RefreshToken
 from .models import User
-from .redis_utils import redis_client
+from .redis_utils import redis_client, OTPDispatchDeduplicator
 from .validators import get_location_from_ip
+from devices.cache import DeviceDecisionCache
+from devices.limits import ConcurrentSessionLimiter
 from devices.models import Device, Session
+from devices.risk import DeviceRiskEngine
+from devices.travel import ImpossibleTravelDetector
+from devices.upsert import upsert_device
 from otp.models import OTP
 from otp.utils import generate_otp_code, hash_otp, get_client_ip
+from otp.challenges import MFAChallengeStore
 
 
 def _dispatch_device_verification_otp(user_id: str, otp_code: str) -> None:
@@ -127,12 +135,8 @@ class LoginSerializer(serializers.Serializer):
         fingerprint = device_data.get('fingerprint_hash')
         ip_address = get_client_ip(request)
         
-        # Try to find existing device
-        device = Device.objects.filter(
-            user=user,
-            fingerprint_hash=fingerprint,
-            is_deleted=False
-        ).first()
+        # Try to find existing device (cached decision record, no SELECT on repeat logins)
+        device = DeviceDecisionCache.get(user.id, fingerprint)
         
         attrs['user'] = user
         attrs['device_obj'] = device
@@ -152,11 +156,23 @@ class LoginSerializer(serializers.Serializer):
             'jti': str(refresh.payload.get('jti'))
         }
     
+    def touch_device(self, device, location_data):
+        """Record a login on a known device in one UPDATE (no decision fields change)"""
+        Device.objects.filter(pk=device.pk).update(
+            total_logins=F('total_logins') + 1,
+            last_ip=location_data['ip'],
+            last_used_at=timezone.now(),
+            country=location_data['country'],
+            city=location_data['city'],
+            latitude=location_data['latitude'],
+            longitude=location_data['longitude'],
+        )
+    
     def create_session(self, user, device, tokens, location_data, request):
         """Create a new session record"""
         user_agent = request.META.get('HTTP_USER_AGENT', '') if request else ''
         
-        Session.objects.create(
+        session = Session.objects.create(
             user=user,
             token_jti=tokens['jti'],  # This is now refresh token's jti
             fingerprint_hash=device.fingerprint_hash if device else '',
@@ -168,40 +184,61 @@ class LoginSerializer(serializers.Serializer):
             os=device.os if device else '',
             country=location_data['country'],
             city=location_data['city'],
+            latitude=location_data.get('latitude'),
+            longitude=location_data.get('longitude'),
             expires_at=timezone.now() + timezone.timedelta(days=7)  # Match JWT expiry
         )
+        ConcurrentSessionLimiter.track(session)
+        ImpossibleTravelDetector.check_session(session)
+        return session
     
     def send_device_otp(self, user, ip_address):
         """Generate and send OTP for device verification"""
-        # Invalidate any existing device verification OTPs
-        OTP.objects.filter(
-            user=user,
-            purpose='device_verification',
-            is_used=False
-        ).update(is_used=True)
-        
-        # Generate new OTP
-        otp_code = generate_otp_code(6)
+        fingerprint_hash = self.validated_data['device']['fingerprint_hash']
         expires_at = timezone.now() + timezone.timedelta(minutes=10)
+        otp_id = uuid.uuid4()
         
-        # Create OTP record
-        otp = OTP.objects.create(
-            user=user,
-            code_hash=hash_otp(otp_code),
-            purpose='device_verification',
-            target=user.email,
-            ip_address=ip_address,
-            expires_at=expires_at
-        )
-        
-        # Store pending device verification in Redis (expires in 10 minutes)
-        # Use fingerprint_hash to allow multiple devices to verify simultaneously
-        fingerprint_hash = self.validated_data['device']['fingerprint_hash']
-        pending_key = f"pending_device_verification:{user.id}:{fingerprint_hash}"
-        redis_client.setex(pending_key, 600, str(otp.id))
+        # Retries / double-submits inside the dedup window reuse the pending OTP
+        pending = OTPDispatchDeduplicator.claim(user.id, fingerprint_hash, 'device_verification', otp_id, expires_at)
+        if pending is not None:
+            return {
+                'otp_id': pending['otp_id'],
+                'expires_at': pending['expires_at'],
+                'deduplicated': True
+            }
         
-        # Send OTP email with same dispatch policy used by verification emails.
-        _dispatch_device_verification_otp(str(user.id), otp_code)
+        try:
+            # Invalidate any existing device verification OTPs
+            OTP.objects.filter(
+                user=user,
+                purpose='device_verification',
+                is_used=False
+            ).update(is_used=True)
+            
+            # Generate new OTP
+            otp_code = generate_otp_code(6)
+            
+            # Create OTP record
+            otp = OTP.objects.create(
+                id=otp_id,
+                user=user,
+                code_hash=hash_otp(otp_code),
+                purpose='device_verification',
+                target=user.email,
+                ip_address=ip_address,
+                expires_at=expires_at
+            )
+            
+            # Store pending device verification in Redis (expires in 10 minutes)
+            # Use fingerprint_hash to allow multiple devices to verify simultaneously
+            pending_key = f"pending_device_verification:{user.id}:{fingerprint_hash}"
+            redis_client.setex(pending_key, 600, str(otp.id))
+            
+            # Send OTP email with same dispatch policy used by verification emails.
+            _dispatch_device_verification_otp(str(user.id), otp_code)
+        except Exception:
+            OTPDispatchDeduplicator.release(user.id, fingerprint_hash, 'device_verification')
+            raise
         
         return {
             'otp_id': str(otp.id),
@@ -226,12 +263,21 @@ class LoginSerializer(serializers.Serializer):
             # Store pending MFA login in Redis
             fingerprint_hash = device_data['fingerprint_hash']
             pending_mfa_key = f"pending_mfa_login:{user.id}:{fingerprint_hash}"
-            redis_client.setex(pending_mfa_key, 600, json.dumps({
+            user_agent = request.META.get('HTTP_USER_AGENT', '') if request else ''
+            challenge_id = MFAChallengeStore.issue(
+                user=user,
+                challenge_type='totp',
+                ip_address=location_data['ip'],
+                user_agent=user_agent,
+                session_id=pending_mfa_key,
+            )
+            redis_client.setex(pending_mfa_key, settings.MFA_CHALLENGE_TTL_SECONDS, json.dumps({
                 'user_id': str(user.id),
                 'fingerprint_hash': fingerprint_hash,
                 'device_data': device_data,
                 'ip_address': location_data['ip'],
-                'location': location_data
+                'location': location_data,
+                'challenge_id': challenge_id
             }))
             
             return {
@@ -246,15 +292,12 @@ class LoginSerializer(serializers.Serializer):
         # =====================================================================
         # SCENARIO 1: Known trusted device - login immediately (MFA not enabled)
         # =====================================================================
-        if device and device.is_trusted and not device.is_trust_expired():
+        if device and device.has_active_trust():
+            ConcurrentSessionLimiter.enforce(user, location_data['ip'])
+            DeviceRiskEngine.record_login(device, location_data)
+
             # Update device last used info and location
-            device.total_logins += 1
-            device.last_ip = location_data['ip']
-            device.country = location_data['country']
-            device.city = location_data['city']
-            device.latitude = location_data['latitude']
-            device.longitude = location_data['longitude']
-            device.save(update_fields=['total_logins', 'last_ip', 'last_used_at', 'country', 'city', 'latitude', 'longitude'])
+            self.touch_device(device, location_data)
             
             # Update user login info
             user.last_login_ip = location_data['ip']
@@ -290,15 +333,12 @@ class LoginSerializer(serializers.Serializer):
         # =====================================================================
         # SCENARIO 2: Known verified but not trusted device
         # =====================================================================
-        if device and device.is_verified and not device.is_trusted:
+        if device and device.is_verified and not device.has_active_trust():
+            ConcurrentSessionLimiter.enforce(user, location_data['ip'])
+            DeviceRiskEngine.record_login(device, location_data)
+
             # Update device info and location
-            device.total_logins += 1
-            device.last_ip = location_data['ip']
-            device.country = location_data['country']
-            device.city = location_data['city']
-            device.latitude = location_data['latitude']
-            device.longitude = location_data['longitude']
-            device.save(update_fields=['total_logins', 'last_ip', 'last_used_at', 'country', 'city', 'latitude', 'longitude'])
+            self.touch_device(device, location_data)
             
             # Update user login info
             user.last_login_ip = location_data['ip']
@@ -404,6 +444,14 @@ class MFAVerifyLoginSerializer(serializers.Serializer):
             })
         
         pending_login = json.loads(pending_data)
+        challenge_id = pending_login.get('challenge_id')
+        
+        # Challenge must still be pending (not expired / locked out)
+        if challenge_id and not MFAChallengeStore.is_valid(challenge_id):
+            redis_client.delete(pending_key)
+            raise serializers.ValidationError({
+                "error": "MFA challenge expired or too many failed attempts. Please login again."
+            })
         
         # Verify TOTP code
         if totp_code:
@@ -414,6 +462,9 @@ class MFAVerifyLoginSerializer(serializers.Serializer):
             
             totp = pyotp.TOTP(user.totp_device.secret)
             if not totp.verify(totp_code, valid_window=1):
+                if challenge_id:
+                    MFAChallengeStore.record_failure(challenge_id)
+                DeviceRiskEngine.record_failed_otp(user.id)
                 raise serializers.ValidationError({
                     "error": "Invalid TOTP code."
                 })
@@ -433,6 +484,9 @@ class MFAVerifyLoginSerializer(serializers.Serializer):
             ).first()
             
             if not backup:
+                if challenge_id:
+                    MFAChallengeStore.record_failure(challenge_id)
+                DeviceRiskEngine.record_failed_otp(user.id)
                 raise serializers.ValidationError({
                     "error": "Invalid or already used backup code."
                 })
@@ -457,36 +511,50 @@ class MFAVerifyLoginSerializer(serializers.Serializer):
         
         location_data = pending_login.get('location', {})
         device_data = pending_login.get('device_data', {})
+        challenge_id = pending_login.get('challenge_id')
         
-        # Find or create device
-        device, created = Device.objects.get_or_create(
-            user=user,
-            fingerprint_hash=fingerprint_hash,
-            defaults={
-                'device_name': device_data.get('device_name', ''),
-                'device_type': device_data.get('device_type', 'unknown'),
-                'browser': device_data.get('browser', ''),
-                'os': device_data.get('os', ''),
-                'ip_address': location_data.get('ip', ''),
-                'country': location_data.get('country', ''),
-                'city': location_data.get('city', ''),
-                'is_verified': True,
-                'verified_at': timezone.now()
-            }
-        )
+        # Close the challenge before anything is issued: of two concurrent
+        # verifies of one challenge only the first gets a session
+        if challenge_id and not MFAChallengeStore.mark_verified(challenge_id):
+            redis_client.delete(f"pending_mfa_login:{user.id}:{fingerprint_hash}")
+            raise serializers.ValidationError({
+                "error": "MFA challenge already used or expired. Please login again."
+            })
+        
+        ConcurrentSessionLimiter.enforce(user, location_data.get('ip'))
         
-        if not created:
-            # Update existing device
-            device.last_ip = location_data.get('ip', '')
-            device.country = location_data.get('country', '')
-            device.city = location_data.get('city', '')
-            device.total_logins += 1
-            device.is_deleted = False
-            device.save(update_fields=['last_ip', 'country', 'city', 'total_logins', 'last_used_at', 'is_deleted'])
+        # Register the device or refresh it, counting the login, in one statement
+        now = timezone.now()
+        values = {
+            'device_name': device_data.get('device_name', ''),
+            'device_type': device_data.get('device_type', 'unknown'),
+            'browser': device_data.get('browser', ''),
+            'os': device_data.get('os', ''),
+            'ip_address': location_data.get('ip', ''),
+            'last_ip': location_data.get('ip', ''),
+            'country': location_data.get('country', ''),
+            'city': location_data.get('city', ''),
+            'latitude': location_data.get('latitude'),
+            'longitude': location_data.get('longitude'),
+            'is_verified': True,
+            'verified_at': now,
+            'is_deleted': False,
+            'deleted_at': None,
+        }
         
         # Trust device if requested (allows skipping MFA next time)
         if trust_device:
-            device.mark_trusted(days=trust_days)
+            values.update(
+                is_trusted=True,
+                trust_expires_at=now + timezone.timedelta(days=trust_days),
+                can_skip_mfa=True,
+            )
+            values['mfa_skip_until'] = values['trust_expires_at']
+        
+        device, created = upsert_device(user, fingerprint_hash, values, list(values))
+        if challenge_id:
+            MFAChallengeStore.attach_device(challenge_id, device)
+        DeviceRiskEngine.record_verified(device, location_data)
         
         # Update user login info
         user.last_login_ip = location_data.get('ip', '')
@@ -504,7 +572,7 @@ class MFAVerifyLoginSerializer(serializers.Serializer):
         
         # Create session record
         user_agent = request.META.get('HTTP_USER_AGENT', '') if request else ''
-        Session.objects.create(
+        session = Session.objects.create(
             user=user,
             token_jti=tokens['jti'],
             fingerprint_hash=fingerprint_hash,
@@ -516,8 +584,12 @@ class MFAVerifyLoginSerializer(serializers.Serializer):
             os=device.os,
             country=location_data.get('country', ''),
             city=location_data.get('city', ''),
+            latitude=location_data.get('latitude'),
+            longitude=location_data.get('longitude'),
             expires_at=timezone.now() + timezone.timedelta(days=7)
         )
+        ConcurrentSessionLimiter.track(session)
+        ImpossibleTravelDetector.check_session(session)
         
         # Clean up Redis
         redis_client.delete(f"pending_mfa_login:{user.id}:{fingerprint_hash}")
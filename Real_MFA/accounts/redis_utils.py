@@ -30,8 +30,17 @@ class _CacheKV:
     def get(self, key):
         return cache.get(key)
 
-    def set(self, key, value):
-        cache.set(key, value, timeout=None)
+    def set(self, key, value, ex=None, nx=False):
+        timeout = int(ex) if ex else None
+        if nx:
+            # cache.add only writes when the key is absent (SET NX)
+            if not cache.add(key, value, timeout=timeout):
+                return False
+        else:
+            cache.set(key, value, timeout=timeout)
+        if timeout:
+            cache.set(self._exp_key(key), time.time() + timeout, timeout=timeout)
+        return True
 
     def setex(self, key, ttl_seconds, value):
         ttl_seconds = int(ttl_seconds)
@@ -81,7 +90,7 @@ class _CacheKV:
 def _get_kv_client():
     """Return a Redis client if available/reachable, else a cache-backed KV."""
 
-    if redis is None:
+    if redis is None or getattr(settings, 'REDIS_KV_BACKEND', 'auto') == 'cache':
         return _CacheKV()
 
     try:
@@ -192,3 +201,44 @@ class CooldownManager:
         """Set 60 second cooldown after resend"""
         key = f"resend_cooldown:{user_id}"
         redis_client.setex(key, 60, "1")
+
+
+class OTPDispatchDeduplicator:
+    """
+    Idempotent OTP dispatch per (user, device, purpose)
+    
+    The first request inside the window claims the dispatch and sends the OTP;
+    retries and double-submits get the pending OTP's metadata back instead of
+    a new OTP row and another provider call. The claimer picks the OTP id up
+    front, so a duplicate arriving while the OTP is still being created gets
+    its id too.
+    """
+    
+    @staticmethod
+    def _key(user_id, fingerprint_hash, purpose):
+        return f"otp_dispatch:{user_id}:{fingerprint_hash}:{purpose}"
+    
+    @staticmethod
+    def claim(user_id, fingerprint_hash, purpose, otp_id, expires_at):
+        """
+        Try to claim the dispatch for the OTP the caller is about to create as `otp_id`.
+        Returns None if claimed (caller must send), else the pending OTP metadata.
+        """
+        key = OTPDispatchDeduplicator._key(user_id, fingerprint_hash, purpose)
+        window = getattr(settings, 'OTP_DISPATCH_DEDUP_WINDOW_SECONDS', 15)
+        payload = json.dumps({'otp_id': str(otp_id), 'expires_at': expires_at.isoformat()})
+        
+        if redis_client.set(key, payload, ex=window, nx=True):
+            return None
+        
+        existing = redis_client.get(key)
+        if existing is None:
+            # Window closed between the two calls; treat as a fresh claim
+            redis_client.set(key, payload, ex=window)
+            return None
+        return json.loads(existing)
+    
+    @staticmethod
+    def release(user_id, fingerprint_hash, purpose):
+        """Drop the claim so a failed dispatch can be retried immediately"""
+        redis_client.delete(OTPDispatchDeduplicator._key(user_id, fingerprint_hash, purpose))
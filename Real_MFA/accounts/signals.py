@@ -95,7 +95,7 @@ def notify_password_changed(sender, instance, created, **kwargs):
         from notification.utils import notify_password_changed
         try:
             notify_password_changed(instance)
-            logger.info(f"Password change notification sent to {instance.email}")
+            logger.info(f"Password change notification queued for {instance.email}")
         except Exception as e:
             logger.error(f"Failed to send password change notification: {e}")
         # Clean up flag
@@ -124,10 +124,10 @@ def notify_mfa_status_changed(sender, instance, created, **kwargs):
         try:
             if instance.mfa_enabled:
                 notify_mfa_enabled(instance, instance.mfa_method or 'TOTP')
-                logger.info(f"MFA enabled notification sent to {instance.email}")
+                logger.info(f"MFA enabled notification queued for {instance.email}")
             else:
                 notify_mfa_disabled(instance, getattr(instance, '_old_mfa_enabled', 'Unknown'))
-                logger.info(f"MFA disabled notification sent to {instance.email}")
+                logger.info(f"MFA disabled notification queued for {instance.email}")
         except Exception as e:
             logger.error(f"Failed to send MFA status change notification: {e}")
         # Clean up flags
@@ -180,7 +180,7 @@ def notify_profile_changed(sender, instance, created, **kwargs):
             # Get request from middleware if available
             request = getattr(instance, '_request', None)
             notify_profile_changed(instance.user, instance._profile_changed_fields, request)
-            logger.info(f"Profile change notification sent to {instance.user.email}")
+            logger.info(f"Profile change notification queued for {instance.user.email}")
         except Exception as e:
             logger.error(f"Failed to send profile change notification: {e}")
         # Clean up temporary attribute
@@ -1,3 +1,209 @@
-from django.test import TestCase
+import json
+import tempfile
+import time
+import unittest
+import uuid
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import pyotp
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from devices.models import Device, Session
+from otp import emergency_codes
+from otp.challenges import MFAChallengeStore
+from otp.models import OTP, BackupCode, EmergencyCodeJob, MFAChallenge, TOTPDevice
+from otp.serializers import ResendDeviceOTPSerializer
+from otp.tasks import generate_emergency_codes_job
+from .auth_serializers import MFAVerifyLoginSerializer
+from .models import User
+from .redis_utils import OTPDispatchDeduplicator, redis_client
+
+try:
+    import fakeredis
+except ImportError:  # pragma: no cover
+    fakeredis = None
+
+# Redis stand-in for the cache-backed KV store
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+BULK_URL = '/api/admin-dashboard/mfa/emergency-codes/bulk/'
+
+
+@unittest.skipUnless(emergency_codes.is_available(), 'cryptography is not installed')
+@override_settings(CACHES=LOCMEM_CACHE)
+class BulkEmergencyCodesTests(TestCase):
+    def setUp(self):
+        artifacts = tempfile.TemporaryDirectory()
+        self.addCleanup(artifacts.cleanup)
+        artifact_dir = self.settings(EMERGENCY_CODES_ARTIFACT_DIR=Path(artifacts.name))
+        artifact_dir.enable()
+        self.addCleanup(artifact_dir.disable)
+        self.admin = User.objects.create(
+            username='admin', email='admin@example.com', email_verified=True, role='admin',
+        )
+        self.user = User.objects.create(username='frank', email='frank@example.com', email_verified=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_invalid_user_ids_are_rejected(self):
+        for user_ids in (['not-a-uuid'], [str(self.user.id), 42], 'frank'):
+            response = self.client.post(BULK_URL, {'user_ids': user_ids}, format='json')
+            self.assertEqual(response.status_code, 400, user_ids)
+        self.assertFalse(EmergencyCodeJob.objects.exists())
+
+    def test_bulk_issuance_shows_in_the_mfa_audit_history(self):
+        with self.captureOnCommitCallbacks():
+            response = self.client.post(
+                BULK_URL, {'user_ids': [str(self.user.id)], 'codes_per_user': 5}, format='json',
+            )
+        self.assertEqual(response.status_code, 202)
+        generate_emergency_codes_job(response.data['job_id'])
+        self.assertEqual(BackupCode.objects.filter(user=self.user, is_used=False).count(), 5)
+
+        history = self.client.get(f'/api/admin-dashboard/users/{self.user.id}/mfa/audit-history/')
+        self.assertEqual(history.status_code, 200)
+        [event] = history.data['events']
+        self.assertEqual(event['event_type'], 'emergency_codes_generated')
+        self.assertEqual(event['metadata']['job_id'], response.data['job_id'])
+        self.assertEqual(event['metadata']['generated_by'], str(self.admin.id))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class MFAVerifyReplayTests(TestCase):
+    fingerprint = 'replay-fingerprint'
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='mallory', email='mallory@example.com', email_verified=True, mfa_enabled=True,
+        )
+        self.totp = pyotp.TOTP(TOTPDevice.objects.create(
+            user=self.user, secret=pyotp.random_base32(), is_verified=True,
+        ).secret)
+
+    def _pending_login(self):
+        pending_key = f"pending_mfa_login:{self.user.id}:{self.fingerprint}"
+        challenge_id = MFAChallengeStore.issue(self.user, 'totp', '10.0.0.1', session_id=pending_key)
+        redis_client.setex(pending_key, 600, json.dumps({
+            'user_id': str(self.user.id),
+            'fingerprint_hash': self.fingerprint,
+            'device_data': {'fingerprint_hash': self.fingerprint},
+            'ip_address': '10.0.0.1',
+            'location': {'ip': '10.0.0.1'},
+            'challenge_id': challenge_id,
+        }))
+        return challenge_id
+
+    def _validated(self):
+        serializer = MFAVerifyLoginSerializer(
+            data={'user_id': str(self.user.id), 'fingerprint_hash': self.fingerprint, 'totp_code': self.totp.now()},
+            context={'request': RequestFactory().post('/', REMOTE_ADDR='10.0.0.1')},
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer
+
+    def _assert_single_login(self, challenge_id):
+        # Both requests pass validate() before either saves
+        first, second = self._validated(), self._validated()
+        result = first.save()
+        with self.assertRaises(ValidationError):
+            second.save()
+
+        self.assertEqual(Session.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(MFAChallengeStore.get(challenge_id)['status'], 'verified')
+        return result
+
+    def test_concurrent_verifies_get_one_session(self):
+        challenge_id = self._pending_login()
+        result = self._assert_single_login(challenge_id)
+        challenge = MFAChallenge.objects.get(pk=challenge_id)
+        self.assertEqual(str(challenge.verified_device_id), result['device']['id'])
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_concurrent_verifies_get_one_session_with_redis(self):
+        with mock.patch('otp.challenges.redis_client', fakeredis.FakeStrictRedis(decode_responses=True)):
+            challenge_id = self._pending_login()
+            result = self._assert_single_login(challenge_id)
+            self.assertEqual(MFAChallengeStore.flush(), 1)
+        challenge = MFAChallenge.objects.get(pk=challenge_id)
+        self.assertEqual(challenge.status, 'verified')
+        self.assertEqual(str(challenge.verified_device_id), result['device']['id'])
+
+    def test_verify_restores_a_soft_deleted_device(self):
+        self._pending_login()
+        deleted_at = timezone.now()
+        device = Device.objects.create(
+            user=self.user, fingerprint_hash=self.fingerprint, ip_address='10.0.0.9',
+            is_deleted=True, deleted_at=deleted_at,
+        )
+        result = self._validated().save()
+
+        self.assertEqual(result['device']['id'], str(device.id))
+        device.refresh_from_db()
+        self.assertFalse(device.is_deleted)
+        self.assertIsNone(device.deleted_at)
+        self.assertTrue(device.is_verified)
+        self.assertEqual(device.ip_address, '10.0.0.1')
+
+
+@override_settings(CACHES=LOCMEM_CACHE, OTP_DISPATCH_DEDUP_WINDOW_SECONDS=15)
+class OTPDispatchDeduplicatorTests(TestCase):
+    fingerprint = 'dedup-fingerprint'
+
+    def setUp(self):
+        self.user = User.objects.create(username='dora', email='dora@example.com', email_verified=True)
+        self.expires_at = timezone.now() + timezone.timedelta(minutes=10)
+
+    def _claim(self, otp_id=None):
+        return OTPDispatchDeduplicator.claim(
+            self.user.id, self.fingerprint, 'device_verification', otp_id or uuid.uuid4(), self.expires_at,
+        )
+
+    def _resend(self):
+        redis_client.setex(f"pending_device_verification:{self.user.id}:{self.fingerprint}", 600, 'pending')
+        redis_client.delete(f"device_otp_cooldown:{self.user.id}:{self.fingerprint}")
+        serializer = ResendDeviceOTPSerializer(
+            data={'user_id': str(self.user.id), 'fingerprint_hash': self.fingerprint},
+            context={'request': RequestFactory().post('/', REMOTE_ADDR='10.0.0.1')},
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def test_repeat_inside_the_window_gets_the_claimed_otp(self):
+        otp_id = uuid.uuid4()
+        self.assertIsNone(self._claim(otp_id))
+        # The first request has not created its OTP yet
+        pending = self._claim()
+        self.assertEqual(pending['otp_id'], str(otp_id))
+        self.assertEqual(pending['expires_at'], self.expires_at.isoformat())
+
+    def test_repeat_after_the_window_claims_again(self):
+        self.assertIsNone(self._claim())
+        with mock.patch('time.time', return_value=time.time() + 16):
+            self.assertIsNone(self._claim())
+
+    def test_release_lets_a_failed_dispatch_retry(self):
+        self.assertIsNone(self._claim())
+        OTPDispatchDeduplicator.release(self.user.id, self.fingerprint, 'device_verification')
+        self.assertIsNone(self._claim())
+
+    @mock.patch('otp.serializers._dispatch_device_verification_otp')
+    def test_double_submitted_resend_sends_one_otp(self, dispatch):
+        first = self._resend()
+        second = self._resend()
+
+        otp = OTP.objects.get(user=self.user, purpose='device_verification')
+        self.assertEqual(first['otp_id'], str(otp.id))
+        self.assertTrue(second['deduplicated'])
+        self.assertEqual(second['otp_id'], str(otp.id))
+        self.assertEqual(second['remaining_resends'], first['remaining_resends'])
+        dispatch.assert_called_once()
+
+        with mock.patch('time.time', return_value=time.time() + 16):
+            third = self._resend()
+        self.assertNotIn('deduplicated', third)
+        self.assertNotEqual(third['otp_id'], first['otp_id'])
+        self.assertEqual(dispatch.call_count, 2)
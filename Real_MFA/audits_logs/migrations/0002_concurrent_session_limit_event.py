@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-19 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audits_logs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='auditlog',
+            name='event_type',
+            field=models.CharField(choices=[('login_success', 'Login Success'), ('login_failed', 'Login Failed'), ('logout', 'Logout'), ('session_expired', 'Session Expired'), ('concurrent_session_limit_exceeded', 'Concurrent Session Limit Exceeded'), ('account_created', 'Account Created'), ('account_updated', 'Account Updated'), ('account_deleted', 'Account Deleted'), ('email_changed', 'Email Changed'), ('email_verified', 'Email Verified'), ('phone_changed', 'Phone Changed'), ('password_changed', 'Password Changed'), ('password_reset_requested', 'Password Reset Requested'), ('password_reset_completed', 'Password Reset Completed'), ('password_failed_attempts', 'Password Failed Attempts'), ('mfa_enabled', 'MFA Enabled'), ('mfa_disabled', 'MFA Disabled'), ('mfa_method_added', 'MFA Method Added'), ('mfa_method_removed', 'MFA Method Removed'), ('device_added', 'Device Added'), ('device_removed', 'Device Removed'), ('device_verified', 'Device Verified'), ('device_trusted', 'Device Trusted'), ('device_compromised', 'Device Compromised')], db_index=True, max_length=50),
+        ),
+    ]
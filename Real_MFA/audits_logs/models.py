@@ -488,6 +488,7 @@ class AuditLog(TimeStampedModel):
         ('login_failed', 'Login Failed'),
         ('logout', 'Logout'),
         ('session_expired', 'Session Expired'),
+        ('concurrent_session_limit_exceeded', 'Concurrent Session Limit Exceeded'),
         
         # Account events
         ('account_created', 'Account Created'),
@@ -0,0 +1,15 @@
+"""
+Benchmarks - Reproducible performance suites for hot authentication paths
+
+Runs against SQLite and the cache-backed Redis stand-in, so no external
+services are needed. Usage (from the project root):
+
+    python -m benchmarks                              # all suites
+    python -m benchmarks otp_flows --iterations 500
+    python -m benchmarks --output baseline.json       # save a baseline
+    python -m benchmarks --compare baseline.json      # exit 1 on regression
+
+    python -m benchmarks.index_writes                 # index write-amplification report
+
+Set REDIS_KV_BACKEND=auto to run against a local Redis server instead.
+"""
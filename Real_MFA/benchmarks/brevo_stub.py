@@ -0,0 +1,121 @@
+"""
+Brevo API stand-in - Local HTTP server for the transactional email endpoint
+
+Answers POST /v3/smtp/email like Brevo does: a single message gets
+{"messageId": ...}, a messageVersions batch gets {"messageIds": [...]} in
+version order. HTTP/1.1 keep-alive is honoured, and connections, requests and
+messages are counted so tests and benchmarks can check connection reuse.
+latency_ms adds a fixed delay per request to mimic the network round trip.
+
+    with BrevoStubServer(latency_ms=20) as stub:
+        settings.BREVO_API_ENDPOINT = stub.endpoint
+"""
+
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PATH = '/v3/smtp/email'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; Nagle would hold the body back
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        stub = self.server
+
+        if stub.latency_ms:
+            time.sleep(stub.latency_ms / 1000)
+        if self.path != PATH:
+            self._reply(404, {'code': 'not_found', 'message': self.path})
+            return
+        if not self.headers.get('api-key'):
+            self._reply(401, {'code': 'unauthorized', 'message': 'Key not found'})
+            return
+        if stub.fail_status:
+            self._reply(stub.fail_status, {'code': 'stub_failure', 'message': 'Configured failure'})
+            return
+
+        versions = body.get('messageVersions')
+        count = len(versions) if versions else 1
+        with stub.lock:
+            stub.requests += 1
+            stub.messages += count
+            stub.payloads.append(body)
+            ids = [f"<stub-{next(stub.ids)}@brevo.local>" for _ in range(count)]
+
+        self._reply(201, {'messageIds': ids} if versions else {'messageId': ids[0]})
+
+
+class BrevoStubServer:
+    """Run the stand-in on a background thread"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, fail_status=None):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.lock = threading.Lock()
+        self.httpd.ids = itertools.count(1)
+        self.httpd.latency_ms = latency_ms
+        self.httpd.fail_status = fail_status
+        self.reset()
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{PATH}"
+
+    @property
+    def stats(self):
+        return {
+            'connections': self.httpd.connections,
+            'requests': self.httpd.requests,
+            'messages': self.httpd.messages,
+        }
+
+    @property
+    def payloads(self):
+        return self.httpd.payloads
+
+    def reset(self):
+        self.httpd.connections = 0
+        self.httpd.requests = 0
+        self.httpd.messages = 0
+        self.httpd.payloads = []
+
+    def start(self):
+        # A short poll interval keeps stop() quick
+        self._thread = threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,227 @@
+"""
+Benchmark Harness - Timing, query counting, JSON reports and baseline comparison
+"""
+
+import argparse
+import gc
+import importlib
+import json
+import os
+import platform
+import sys
+import time
+
+# Registered suites: name -> module path
+SUITES = {
+    'otp_flows': 'benchmarks.suites.otp_flows',
+    'write_path': 'benchmarks.suites.write_path',
+    'email_delivery': 'benchmarks.suites.email_delivery',
+    'email_templates': 'benchmarks.suites.email_templates',
+    'notification_policy': 'benchmarks.suites.notification_policy',
+}
+
+DEFAULT_ITERATIONS = 200
+DEFAULT_WARMUP = 20
+DEFAULT_THRESHOLD = 0.25  # 25% slower / p99 higher counts as a regression
+
+
+class Case:
+    """
+    A single benchmarked operation.
+
+    setup() runs before every iteration outside the timed region and its
+    return value is passed to run(). Only run() is timed and query-counted.
+    items is the number of units (e.g. messages) one run() handles; when set,
+    throughput is also reported per item, so batched and single-item cases
+    can be compared.
+    """
+
+    def __init__(self, name, run, setup=None, iterations=None, items=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.iterations = iterations
+        self.items = items
+
+
+def setup_django():
+    """Configure Django with benchmark settings and build the schema"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0, interactive=False)
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def measure(case, iterations, warmup):
+    """
+    Run a case and return its timing and query statistics.
+
+    As with timeit, the garbage collector is off while the iterations run:
+    an occasional full collection of the Django process heap (~100 ms) would
+    otherwise land in one case's p99 at random.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    iterations = case.iterations or iterations
+
+    for _ in range(warmup):
+        case.run(case.setup() if case.setup else None)
+
+    timings = []
+    total_queries = 0
+    gc.collect()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(iterations):
+            arg = case.setup() if case.setup else None
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                case.run(arg)
+                elapsed = time.perf_counter() - start
+            timings.append(elapsed)
+            total_queries += len(captured.captured_queries)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    total_time = sum(timings)
+    timings.sort()
+    stats = {
+        'iterations': iterations,
+        'ops_per_sec': round(iterations / total_time, 2) if total_time else 0.0,
+        'mean_ms': round(total_time / iterations * 1000, 4),
+        'p50_ms': round(_percentile(timings, 50) * 1000, 4),
+        'p99_ms': round(_percentile(timings, 99) * 1000, 4),
+        'queries_per_op': round(total_queries / iterations, 2),
+    }
+    if case.items:
+        stats['items_per_op'] = case.items
+        stats['items_per_sec'] = round(iterations * case.items / total_time, 2) if total_time else 0.0
+    return stats
+
+
+def run_suites(names, iterations, warmup):
+    """Run the named suites and return {case_name: stats}"""
+    results = {}
+    for name in names:
+        module = importlib.import_module(SUITES[name])
+        for case in module.cases():
+            results[f"{name}.{case.name}"] = measure(case, iterations, warmup)
+            print(_format_row(f"{name}.{case.name}", results[f"{name}.{case.name}"]))
+    return results
+
+
+def build_report(results, iterations, warmup):
+    import django
+    from django.conf import settings
+    from django.db import connection
+    from accounts.redis_utils import redis_client
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'kv_backend': type(redis_client).__name__,
+            'celery_eager': getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False),
+            'iterations': iterations,
+            'warmup': warmup,
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results against a baseline report.
+
+    Returns a list of regression messages. Query counts are deterministic,
+    so any increase is flagged; timings are flagged beyond the threshold.
+    """
+    regressions = []
+    baseline_results = baseline.get('results', {})
+
+    for name, current in sorted(results.items()):
+        previous = baseline_results.get(name)
+        if previous is None:
+            continue
+
+        if current['queries_per_op'] > previous['queries_per_op']:
+            regressions.append(
+                f"{name}: queries/op {previous['queries_per_op']} -> {current['queries_per_op']}"
+            )
+        if previous['ops_per_sec'] and current['ops_per_sec'] < previous['ops_per_sec'] * (1 - threshold):
+            regressions.append(
+                f"{name}: ops/sec {previous['ops_per_sec']} -> {current['ops_per_sec']}"
+            )
+        if previous['p99_ms'] and current['p99_ms'] > previous['p99_ms'] * (1 + threshold):
+            regressions.append(
+                f"{name}: p99 {previous['p99_ms']}ms -> {current['p99_ms']}ms"
+            )
+
+    return regressions
+
+
+def _format_row(name, stats):
+    row = (
+        f"{name:<40} {stats['ops_per_sec']:>10.1f} ops/s  "
+        f"p50 {stats['p50_ms']:>8.3f}ms  p99 {stats['p99_ms']:>8.3f}ms  "
+        f"{stats['queries_per_op']:>6.2f} q/op"
+    )
+    if 'items_per_sec' in stats:
+        row += f"  {stats['items_per_sec']:>10.1f} items/s ({stats['items_per_op']}/op)"
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Run performance benchmarks.')
+    parser.add_argument('suites', nargs='*', help=f"Suites to run (default: all). Available: {', '.join(SUITES)}")
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP)
+    parser.add_argument('--output', help='Write the JSON report to this path')
+    parser.add_argument('--compare', help='Baseline JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Allowed relative slowdown before flagging a regression')
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.suites if name not in SUITES]
+    if unknown:
+        parser.error(f"Unknown suite(s): {', '.join(unknown)}")
+
+    setup_django()
+
+    results = run_suites(args.suites or list(SUITES), args.iterations, args.warmup)
+    report = build_report(results, args.iterations, args.warmup)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+        print(f"\nReport written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fh:
+            baseline = json.load(fh)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.compare}:", file=sys.stderr)
+            for line in regressions:
+                print(f"  - {line}", file=sys.stderr)
+            return 1
+        print(f"\nNo regressions against {args.compare}")
+
+    return 0
@@ -0,0 +1,170 @@
+"""
+Index write-amplification report
+
+Runs the write_path suite against the current schema with the index set it
+had before rationalization (dropped indexes added back, the partial indexes
+removed) and against the current schema as migrated, then prints the number
+of indexes maintained per table and the per-case throughput delta. The
+"before" set is built with schema_editor on the current tables, so columns
+added by later migrations stay in place for both runs. Index sets are
+alternated for several rounds and the best round per case is kept, which
+filters out most scheduler noise. Usage (from the project root):
+
+    python -m benchmarks.index_writes
+    python -m benchmarks.index_writes --rounds 5 --output index_writes.json
+"""
+
+import argparse
+import importlib
+import json
+import sys
+
+from .harness import DEFAULT_ITERATIONS, DEFAULT_WARMUP, SUITES, measure, setup_django
+
+# Index set before rationalization, relative to the current models:
+# (app_label, model) -> indexes to add back (field lists, db_index duplicates
+# listed twice) and the partial indexes to drop
+BEFORE_RATIONALIZATION = {
+    ('otp', 'OTP'): {
+        'add': [['code_hash'], ['purpose'], ['is_used'], ['user', 'purpose', 'is_used'], ['expires_at']],
+        'remove': ['otps_user_purpose_unused_idx'],
+    },
+    ('otp', 'BackupCode'): {
+        'add': [['code_hash'], ['is_used'], ['user', 'is_used']],
+        'remove': [],
+    },
+    ('devices', 'Device'): {
+        'add': [
+            ['fingerprint_hash'], ['fingerprint_hash'], ['is_verified'], ['is_trusted'],
+            ['is_compromised'], ['is_compromised'], ['last_used_at'], ['last_used_at'], ['risk_score'],
+        ],
+        'remove': ['devices_compromised_idx'],
+    },
+    ('devices', 'Session'): {
+        'add': [['token_jti'], ['is_active'], ['expires_at'], ['expires_at']],
+        'remove': ['sessions_active_expiry_idx'],
+    },
+}
+
+WRITE_PATH_TABLES = ['otps', 'backup_codes', 'devices', 'sessions']
+
+
+def _index_counts():
+    """Indexes (including unique constraints) maintained per table, excluding the PK"""
+    from django.db import connection
+
+    counts = {}
+    with connection.cursor() as cursor:
+        for table in WRITE_PATH_TABLES:
+            constraints = connection.introspection.get_constraints(cursor, table)
+            counts[table] = sum(
+                1 for info in constraints.values()
+                if (info['index'] or info['unique']) and not info['primary_key']
+            )
+    return counts
+
+
+def _before_changes():
+    """[(model, indexes to add, indexes to remove)] for the pre-rationalization set"""
+    from django.apps import apps
+    from django.db import models
+
+    changes = []
+    for (app_label, model_name), spec in BEFORE_RATIONALIZATION.items():
+        model = apps.get_model(app_label, model_name)
+        table = model._meta.db_table
+        added = [
+            models.Index(fields=fields, name=f"bench_{table}_{position}"[:30])
+            for position, fields in enumerate(spec['add'])
+        ]
+        removed = [index for index in model._meta.indexes if index.name in spec['remove']]
+        changes.append((model, added, removed))
+    return changes
+
+
+def _use_before_indexes(changes):
+    from django.db import connection
+
+    with connection.schema_editor() as schema_editor:
+        for model, added, removed in changes:
+            for index in removed:
+                schema_editor.remove_index(model, index)
+            for index in added:
+                schema_editor.add_index(model, index)
+
+
+def _use_current_indexes(changes):
+    from django.db import connection
+
+    with connection.schema_editor() as schema_editor:
+        for model, added, removed in changes:
+            for index in added:
+                schema_editor.remove_index(model, index)
+            for index in removed:
+                schema_editor.add_index(model, index)
+
+
+def _run_write_path(iterations, warmup):
+    module = importlib.import_module(SUITES['write_path'])
+    return {case.name: measure(case, iterations, warmup) for case in module.cases()}
+
+
+def _keep_best(best, results):
+    for name, stats in results.items():
+        if name not in best or stats['ops_per_sec'] > best[name]['ops_per_sec']:
+            best[name] = stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.index_writes')
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--output', help='Write the JSON report to this path')
+    args = parser.parse_args(argv)
+
+    setup_django()
+
+    from django.core.management import call_command
+
+    changes = _before_changes()
+    before, after = {}, {}
+    before_indexes = after_indexes = None
+    for _ in range(args.rounds):
+        call_command('flush', verbosity=0, interactive=False)
+        _use_before_indexes(changes)
+        before_indexes = _index_counts()
+        _keep_best(before, _run_write_path(args.iterations, args.warmup))
+
+        call_command('flush', verbosity=0, interactive=False)
+        _use_current_indexes(changes)
+        after_indexes = _index_counts()
+        _keep_best(after, _run_write_path(args.iterations, args.warmup))
+
+    print(f"{'table':<24} {'before indexes':>14} {'after indexes':>14}")
+    for table in WRITE_PATH_TABLES:
+        print(f"{table:<24} {before_indexes[table]:>14} {after_indexes[table]:>14}")
+
+    print(f"\n{'case':<24} {'before ops/s':>14} {'after ops/s':>14} {'delta':>9}")
+    cases = {}
+    for name, stats in after.items():
+        old = before[name]['ops_per_sec']
+        new = stats['ops_per_sec']
+        delta = (new - old) / old * 100 if old else 0.0
+        cases[name] = {'before': before[name], 'after': stats, 'ops_per_sec_delta_pct': round(delta, 1)}
+        print(f"{name:<24} {old:>14.1f} {new:>14.1f} {delta:>+8.1f}%")
+
+    if args.output:
+        report = {
+            'indexes': {'before': before_indexes, 'after': after_indexes},
+            'cases': cases,
+        }
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+        print(f"\nReport written to {args.output}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
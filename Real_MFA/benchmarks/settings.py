@@ -0,0 +1,49 @@
+"""
+Benchmark settings - Isolated SQLite database, in-memory cache and mail outbox
+"""
+
+import os
+
+from Real_MFA.settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('BENCH_DB_NAME', ':memory:'),
+    }
+}
+
+# Redis stand-in: the cache-backed KV over an in-process cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'real-mfa-benchmarks',
+    }
+}
+REDIS_KV_BACKEND = os.getenv('REDIS_KV_BACKEND', 'cache')
+
+# Run Celery tasks inline and keep email in memory
+CELERY_TASK_ALWAYS_EAGER = True
+CELERY_TASK_EAGER_PROPAGATES = True
+SEND_VERIFICATION_EMAIL_ASYNC = False
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+EMAIL_DELIVERY_MODE = 'smtp'
+# Measure the code, not the provider send quota
+EMAIL_SEND_RATE_LIMITS = {}
+
+# Fixture creation only - keeps setup time out of the way
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': 'ERROR',
+    },
+}
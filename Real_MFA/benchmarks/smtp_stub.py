@@ -0,0 +1,107 @@
+"""
+SMTP stand-in - Local plain-text SMTP server for the pooled SMTP sender
+
+Speaks just enough SMTP for Django's SMTP backend (no TLS, no AUTH): greeting,
+EHLO/HELO, MAIL, RCPT, DATA, NOOP, RSET and QUIT. Connections, messages and
+NOOP probes are counted so tests can check connection reuse.
+drop_after_message closes the connection after every message, like a server
+cutting idle sessions.
+
+    with SMTPStubServer() as stub:
+        settings.EMAIL_HOST, settings.EMAIL_PORT = stub.host, stub.port
+"""
+
+import socketserver
+import threading
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def _read_data(self):
+        while True:
+            line = self.rfile.readline()
+            if not line or line == b'.\r\n':
+                return
+
+    def handle(self):
+        stub = self.server
+        with stub.lock:
+            stub.connections += 1
+
+        self._reply('220 stub.local ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line.decode('ascii', 'replace').strip().split(' ', 1)[0].upper()
+
+            if verb in ('EHLO', 'HELO', 'MAIL', 'RCPT', 'RSET'):
+                self._reply('250 OK')
+            elif verb == 'NOOP':
+                with stub.lock:
+                    stub.noops += 1
+                self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                self._read_data()
+                with stub.lock:
+                    stub.messages += 1
+                self._reply('250 OK queued')
+                if stub.drop_after_message:
+                    return
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Command not implemented')
+
+
+class SMTPStubServer:
+    """Run the stand-in on a background thread"""
+
+    def __init__(self, host='127.0.0.1', port=0, drop_after_message=False):
+        self.server = socketserver.ThreadingTCPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.drop_after_message = drop_after_message
+        self.reset()
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def stats(self):
+        return {
+            'connections': self.server.connections,
+            'messages': self.server.messages,
+            'noops': self.server.noops,
+        }
+
+    def reset(self):
+        self.server.connections = 0
+        self.server.messages = 0
+        self.server.noops = 0
+
+    def start(self):
+        # A short poll interval keeps stop() quick
+        self._thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1 @@
+"""Benchmark suites - each module exposes cases() returning a list of Case objects."""
@@ -0,0 +1,65 @@
+"""
+Email template benchmarks - Notification rendering through the template registry
+
+Cases (ops/s is renders/sec):
+- render_to_string:  new_device_login via django.template.loader.render_to_string
+                     (the per-alert path send_security_alert used before the registry)
+- registry_render:   the same template through registry.render (compiled once,
+                     shared context, HTML + plain-text alternative)
+- registry_html:     registry render of the HTML body alone
+- html_to_text:      plain-text alternative for an already rendered body
+"""
+
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from accounts.models import User
+from notification.registry import html_to_text, registry
+
+from benchmarks.harness import Case
+
+TEMPLATE = 'new_device_login'
+
+
+def _context(user):
+    return {
+        'user': user,
+        'device_name': 'Bench Laptop',
+        'device_type': 'Desktop',
+        'browser': 'Firefox',
+        'os': 'Linux',
+        'location': 'Lahore, Pakistan',
+        'ip_address': '127.0.0.1',
+        'login_time': timezone.now(),
+    }
+
+
+def cases():
+    user, _ = User.objects.get_or_create(
+        username='bench_templates',
+        defaults={'email': 'bench_templates@bench.local', 'first_name': 'Bench'},
+    )
+    context = _context(user)
+    entry = registry.get(TEMPLATE)
+    registry.warm()
+    html = registry.render(TEMPLATE, context).html
+
+    def baseline(_):
+        render_to_string(entry.template_name, {**context, **registry.shared_context()})
+
+    def render(_):
+        registry.render(TEMPLATE, context)
+
+    def render_html(_):
+        registry.render_html(TEMPLATE, context)
+
+    def text(_):
+        html_to_text(html)
+
+    return [
+        Case('render_to_string', baseline),
+        Case('registry_render', render),
+        Case('registry_html', render_html),
+        Case('html_to_text', text),
+    ]
+
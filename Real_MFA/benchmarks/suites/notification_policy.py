@@ -0,0 +1,58 @@
+"""
+Notification policy benchmarks - May this alert be sent, and when?
+
+Cases:
+- preference_get:  the old per-alert check, NotificationPreference.objects.get()
+                   (covers one of the five policy tables)
+- evaluate:        NotificationPolicy.evaluate, cached (one KV read)
+- fanout_cold:     evaluate_many over FANOUT users with nothing cached
+                   (five queries for the batch, then cached)
+- fanout_warm:     evaluate_many over the same users, all cached
+"""
+
+from django.core.cache import cache
+
+from accounts.models import User
+from notification.models import NotificationPreference, QuietHours
+from notification.policy import NotificationPolicy
+
+from benchmarks.harness import Case
+
+# LocMemCache keeps 300 entries by default (two per cached policy)
+FANOUT = 100
+
+
+def cases():
+    users = []
+    for n in range(FANOUT):
+        user, _ = User.objects.get_or_create(
+            username=f'bench_policy_{n:03d}',
+            defaults={'email': f'bench_policy_{n:03d}@bench.local'},
+        )
+        users.append(user.pk)
+    NotificationPreference.objects.get_or_create(user_id=users[0])
+    QuietHours.objects.get_or_create(
+        user_id=users[0], day_of_week=0, start_time='22:00', end_time='07:00',
+    )
+
+    def preference_get(_):
+        try:
+            NotificationPreference.objects.get(user_id=users[0]).email_alerts
+        except NotificationPreference.DoesNotExist:
+            pass
+
+    def evaluate(_):
+        NotificationPolicy.evaluate(users[0], 'email', 'password_changed')
+
+    def cold_setup():
+        cache.clear()
+
+    def fanout(_):
+        NotificationPolicy.evaluate_many(users, 'email', 'new_device_login')
+
+    return [
+        Case('preference_get', preference_get),
+        Case('evaluate', evaluate),
+        Case('fanout_cold', fanout, setup=cold_setup, iterations=20),
+        Case('fanout_warm', fanout, iterations=50),
+    ]
@@ -0,0 +1,170 @@
+"""
+OTP / MFA flow benchmarks - Code paths that run on every login
+
+Cases:
+- generate_hash:  generate_otp_code + hash_otp
+- issue:          invalidate_user_otps + create_otp
+- verify:         DeviceVerificationSerializer (OTP check, device upsert, session + tokens)
+- resend:         ResendDeviceOTPSerializer (rate-limit keys, OTP, email dispatch)
+- resend_dedup:   double-submitted resend answered from the dispatch dedup window
+- totp_verify:    MFAVerifyLoginSerializer with a TOTP code (through session + tokens)
+- backup_consume: MFAVerifyLoginSerializer with a backup code (through session + tokens)
+
+Every login flow runs save() and setup removes the previous iteration's
+sessions, tokens and used backup codes, so each iteration logs in against
+the same state. The IP geolocation lookup (an ipinfo.io request) is replaced
+with a fixed result while a verify runs: the network round trip is not what
+is measured here.
+"""
+
+import itertools
+import json
+from hashlib import sha256
+from unittest import mock
+
+import pyotp
+from django.test import RequestFactory
+
+from accounts.auth_serializers import MFAVerifyLoginSerializer
+from accounts.models import User
+from accounts.redis_utils import redis_client
+from devices.models import Session
+from devices.serializers import DeviceVerificationSerializer
+from otp.challenges import MFAChallengeStore
+from otp.models import BackupCode, TOTPDevice
+from otp.serializers import ResendDeviceOTPSerializer
+from otp.utils import create_otp, generate_otp_code, hash_otp, invalidate_user_otps
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from benchmarks.harness import Case
+
+IP_ADDRESS = '127.0.0.1'
+FINGERPRINT = 'bench-fingerprint-0001'
+LOCATION = {
+    'ip': IP_ADDRESS, 'country': '', 'city': '', 'region': '',
+    'latitude': None, 'longitude': None, 'timezone': '', 'org': '',
+}
+
+# Entered around each call only, so nothing stays patched once the suite is done
+_offline_geolocation = mock.patch('devices.serializers.get_location_from_ip', return_value=LOCATION)
+
+
+def _make_user(username, mfa=False):
+    user, _ = User.objects.get_or_create(
+        username=username,
+        defaults={
+            'email': f'{username}@bench.local',
+            'email_verified': True,
+        },
+    )
+    if mfa and not hasattr(user, 'totp_device'):
+        TOTPDevice.objects.create(user=user, secret=pyotp.random_base32(), is_verified=True)
+        user.mfa_enabled = True
+        user.mfa_method = 'totp'
+        user.save(update_fields=['mfa_enabled', 'mfa_method'])
+    return user
+
+
+def _context():
+    return {'request': RequestFactory().post('/', REMOTE_ADDR=IP_ADDRESS)}
+
+
+def _pending_mfa_login(user):
+    """Mirror what LoginSerializer stores for an MFA-enabled user"""
+    pending_key = f"pending_mfa_login:{user.id}:{FINGERPRINT}"
+    challenge_id = MFAChallengeStore.issue(
+        user=user,
+        challenge_type='totp',
+        ip_address=IP_ADDRESS,
+        session_id=pending_key,
+    )
+    redis_client.setex(pending_key, 600, json.dumps({
+        'user_id': str(user.id),
+        'fingerprint_hash': FINGERPRINT,
+        'device_data': {'fingerprint_hash': FINGERPRINT},
+        'ip_address': IP_ADDRESS,
+        'location': {'ip': IP_ADDRESS},
+        'challenge_id': challenge_id,
+    }))
+
+
+def _reset_logins(user):
+    """Drop sessions and tokens from earlier iterations"""
+    Session.objects.filter(user=user).delete()
+    OutstandingToken.objects.filter(user=user).delete()
+
+
+def cases():
+    otp_user = _make_user('bench_otp')
+    mfa_user = _make_user('bench_mfa', mfa=True)
+    totp = pyotp.TOTP(mfa_user.totp_device.secret)
+    backup_codes = (f"B{n:03d}-{n:04d}" for n in itertools.count())
+
+    def issue(_):
+        invalidate_user_otps(otp_user, 'device_verification')
+        create_otp(otp_user, 'device_verification', ip_address=IP_ADDRESS)
+
+    def verify_setup():
+        _reset_logins(otp_user)
+        redis_client.setex(f"pending_device_data:{otp_user.id}:{FINGERPRINT}", 600, json.dumps({
+            'fingerprint_hash': FINGERPRINT,
+            'device_name': 'Bench Browser',
+            'device_type': 'desktop',
+            'browser': 'Firefox',
+            'os': 'Linux',
+        }))
+        otp, code = create_otp(otp_user, 'device_verification', ip_address=IP_ADDRESS)
+        redis_client.setex(f"pending_device_verification:{otp_user.id}:{FINGERPRINT}", 600, str(otp.id))
+        return {'user_id': str(otp_user.id), 'fingerprint_hash': FINGERPRINT, 'otp_code': code}
+
+    def verify(data):
+        with _offline_geolocation:
+            serializer = DeviceVerificationSerializer(data=data, context=_context())
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+    def resend_setup():
+        redis_client.delete(f"device_otp_cooldown:{otp_user.id}:{FINGERPRINT}")
+        redis_client.delete(f"device_otp_limit:{otp_user.id}:{FINGERPRINT}")
+        redis_client.delete(f"otp_dispatch:{otp_user.id}:{FINGERPRINT}:device_verification")
+        redis_client.setex(f"pending_device_verification:{otp_user.id}:{FINGERPRINT}", 600, "pending")
+        return {'user_id': str(otp_user.id), 'fingerprint_hash': FINGERPRINT}
+
+    def resend_dedup_setup():
+        # Double-submit: both requests pass validation before either sets the cooldown
+        redis_client.delete(f"device_otp_cooldown:{otp_user.id}:{FINGERPRINT}")
+        redis_client.setex(f"pending_device_verification:{otp_user.id}:{FINGERPRINT}", 600, "pending")
+        return {'user_id': str(otp_user.id), 'fingerprint_hash': FINGERPRINT}
+
+    def resend(data):
+        serializer = ResendDeviceOTPSerializer(data=data, context=_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    def totp_setup():
+        _reset_logins(mfa_user)
+        _pending_mfa_login(mfa_user)
+        return {'user_id': str(mfa_user.id), 'fingerprint_hash': FINGERPRINT, 'totp_code': totp.now()}
+
+    def backup_setup():
+        _reset_logins(mfa_user)
+        BackupCode.objects.filter(user=mfa_user, is_used=True).delete()
+        code = next(backup_codes)
+        BackupCode.objects.create(user=mfa_user, code_hash=sha256(code.upper().encode()).hexdigest())
+        _pending_mfa_login(mfa_user)
+        return {'user_id': str(mfa_user.id), 'fingerprint_hash': FINGERPRINT, 'backup_code': code}
+
+    def mfa_verify(data):
+        serializer = MFAVerifyLoginSerializer(data=data, context=_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    return [
+        Case('generate_hash', lambda _: hash_otp(generate_otp_code(6))),
+        Case('issue', issue),
+        Case('verify', verify, setup=verify_setup),
+        Case('resend', resend, setup=resend_setup),
+        Case('resend_dedup', resend, setup=resend_dedup_setup),
+        Case('totp_verify', mfa_verify, setup=totp_setup),
+        Case('backup_consume', mfa_verify, setup=backup_setup),
+    ]
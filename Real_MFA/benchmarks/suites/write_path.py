@@ -0,0 +1,129 @@
+"""
+Login write-path benchmarks - Insert/update throughput on OTP, BackupCode, Device and Session
+
+Every index on a table is maintained on each insert and on each update of
+an indexed column, so these cases track the write cost of the schema.
+Tables are pre-seeded so index maintenance runs against non-trivial trees.
+"""
+
+import itertools
+import os
+import uuid
+from datetime import timedelta
+
+from django.utils import timezone
+
+from accounts.models import User
+from devices.models import Device, Session
+from otp.models import OTP, BackupCode
+from otp.utils import hash_otp
+
+from benchmarks.harness import Case
+
+IP_ADDRESS = '127.0.0.1'
+SEED_USERS = 50
+SEED_ROWS = int(os.getenv('BENCH_SEED_ROWS', 2000))
+
+
+def _seed():
+    """Populate the login-path tables once; returns the seeded users"""
+    users = list(User.objects.filter(username__startswith='bench_write_').order_by('username'))
+    if users:
+        return users
+
+    User.objects.bulk_create([
+        User(username=f'bench_write_{n:03d}', email=f'bench_write_{n:03d}@bench.local')
+        for n in range(SEED_USERS)
+    ])
+    users = list(User.objects.filter(username__startswith='bench_write_').order_by('username'))
+
+    now = timezone.now()
+    per_user = max(1, SEED_ROWS // len(users))
+    OTP.objects.bulk_create([
+        OTP(
+            user=user, code_hash=hash_otp(f'{n:06d}'), purpose='device_verification',
+            target=user.email, is_used=n > 0, expires_at=now + timedelta(minutes=10),
+        )
+        for user in users for n in range(per_user)
+    ], batch_size=500)
+    BackupCode.objects.bulk_create([
+        BackupCode(user=user, code_hash=hash_otp(f'seed-{user.pk}-{n}'), is_used=n % 2 == 0)
+        for user in users for n in range(min(per_user, 10))
+    ], batch_size=500)
+    Device.objects.bulk_create([
+        Device(user=user, fingerprint_hash=f'seed-{user.pk}-{n}', ip_address=IP_ADDRESS)
+        for user in users for n in range(per_user)
+    ], batch_size=500)
+    Session.objects.bulk_create([
+        Session(
+            user=user, token_jti=uuid.uuid4().hex, fingerprint_hash=f'seed-{user.pk}-{n}',
+            ip_address=IP_ADDRESS, is_active=n % 3 != 0, expires_at=now + timedelta(days=7),
+        )
+        for user in users for n in range(per_user)
+    ], batch_size=500)
+    return users
+
+
+def cases():
+    users = _seed()
+    user_cycle = itertools.cycle(users)
+    counter = itertools.count()
+
+    def otp_insert(_):
+        user = next(user_cycle)
+        OTP.objects.create(
+            user=user, code_hash=hash_otp('123456'), purpose='device_verification',
+            target=user.email, ip_address=IP_ADDRESS,
+            expires_at=timezone.now() + timedelta(minutes=10),
+        )
+
+    def otp_consume_setup():
+        return OTP.objects.filter(user=next(user_cycle), purpose='device_verification', is_used=False).first()
+
+    def otp_consume(otp):
+        if otp is not None:
+            otp.mark_used()
+
+    def backup_consume_setup():
+        user = next(user_cycle)
+        return BackupCode.objects.create(user=user, code_hash=hash_otp(f'bench-{next(counter)}'))
+
+    def device_insert(_):
+        Device.objects.create(
+            user=next(user_cycle), fingerprint_hash=f'bench-device-{next(counter)}', ip_address=IP_ADDRESS,
+        )
+
+    def device_login_setup():
+        return Device.objects.filter(user=next(user_cycle)).first()
+
+    def device_login(device):
+        device.total_logins += 1
+        device.last_ip = IP_ADDRESS
+        device.save(update_fields=['total_logins', 'last_ip', 'last_used_at'])
+
+    def session_insert(_):
+        Session.objects.create(
+            user=next(user_cycle), token_jti=uuid.uuid4().hex, fingerprint_hash='bench-session',
+            ip_address=IP_ADDRESS, expires_at=timezone.now() + timedelta(days=7),
+        )
+
+    def session_revoke_setup():
+        return Session.objects.create(
+            user=next(user_cycle), token_jti=uuid.uuid4().hex, fingerprint_hash='bench-session',
+            ip_address=IP_ADDRESS, expires_at=timezone.now() + timedelta(days=7),
+        ).pk
+
+    def session_revoke(session_id):
+        Session.objects.filter(pk=session_id).update(
+            is_active=False, revoked_at=timezone.now(), revoked_reason='user_logout',
+        )
+
+    return [
+        Case('otp_insert', otp_insert),
+        Case('otp_consume', otp_consume, setup=otp_consume_setup),
+        Case('backup_consume', lambda code: code.mark_used(IP_ADDRESS), setup=backup_consume_setup),
+        Case('device_insert', device_insert),
+        Case('device_login_update', device_login, setup=device_login_setup),
+        Case('session_insert', session_insert),
+        Case('session_revoke', session_revoke, setup=session_revoke_setup),
+    ]
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Device, TrustedDevice, Session
+from .models import ArchivedSession, Device, TrustedDevice, Session
 
 
 @admin.register(Device)
@@ -120,10 +120,24 @@ class SessionAdmin(admin.ModelAdmin):
     actions = ['revoke_sessions']
     
     def revoke_sessions(self, request, queryset):
-        for session in queryset:
-            session.revoke(reason='admin_revoked')
-        self.message_user(request, f'{queryset.count()} session(s) revoked.')
+        revoked_count = Session.bulk_revoke(queryset, reason='admin_revoked')
+        self.message_user(request, f'{revoked_count} session(s) revoked.')
     revoke_sessions.short_description = 'Revoke selected sessions'
     
     def has_add_permission(self, request):
         return False
+
+
+@admin.register(ArchivedSession)
+class ArchivedSessionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'device_name', 'ip_address', 'revoked_reason', 'created_at', 'archived_at')
+    list_filter = ('revoked_reason', 'created_at')
+    search_fields = ('user__email', 'user__username', 'ip_address', 'token_jti')
+    ordering = ('-created_at',)
+    date_hierarchy = 'created_at'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,72 @@
+"""
+Session Archive - Hot/cold split for devices.Session
+
+The auth path only ever needs recent sessions, so rows inactive for longer
+than SESSION_ARCHIVE_AFTER_DAYS are moved in chunks to the append-only
+`sessions_archive` table:
+- revoked / logged-out sessions whose last activity is older than the cutoff
+- sessions still flagged active whose expiry is older than the cutoff
+
+Each chunk is copied and deleted in one transaction, so a row is always in
+exactly one of the two tables. session_history() reads across both for
+admin and audit views.
+"""
+
+import heapq
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ArchivedSession, Session
+
+
+def archive_cutoff(older_than_days=None):
+    days = older_than_days if older_than_days is not None else getattr(settings, 'SESSION_ARCHIVE_AFTER_DAYS', 30)
+    return timezone.now() - timezone.timedelta(days=days)
+
+
+def archivable_sessions(cutoff):
+    """Both branches are served by partial indexes on the hot table"""
+    return Session.objects.filter(
+        Q(is_active=False, last_activity__lt=cutoff) | Q(is_active=True, expires_at__lt=cutoff)
+    )
+
+
+def archive_sessions(older_than_days=None, chunk_size=None, max_chunks=None):
+    """Move archivable sessions to sessions_archive; returns the number moved"""
+    cutoff = archive_cutoff(older_than_days)
+    chunk_size = int(chunk_size or getattr(settings, 'SESSION_ARCHIVE_CHUNK_SIZE', 1000))
+
+    moved = chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        with transaction.atomic():
+            sessions = list(
+                archivable_sessions(cutoff).select_for_update(skip_locked=True).order_by()[:chunk_size]
+            )
+            if not sessions:
+                break
+            ArchivedSession.objects.bulk_create(
+                [ArchivedSession.from_session(session) for session in sessions],
+                ignore_conflicts=True,
+            )
+            Session.objects.filter(pk__in=[session.pk for session in sessions]).delete()
+
+        moved += len(sessions)
+        chunks += 1
+        if len(sessions) < chunk_size:
+            break
+    return moved
+
+
+def session_history(user, limit=50):
+    """
+    Most recent sessions for a user across the hot and archived tables.
+    Two indexed queries, merged by created_at; archived rows come back as
+    ArchivedSession instances with the same attributes as Session.
+    """
+    hot = Session.objects.filter(user=user).order_by('-created_at')[:limit]
+    cold = ArchivedSession.objects.filter(user=user).order_by('-created_at')[:limit]
+    merged = heapq.merge(hot, cold, key=lambda session: session.created_at, reverse=True)
+    return [session for session, _ in zip(merged, range(limit))]
@@ -0,0 +1,107 @@
+"""
+Device Decision Cache - Login-path device lookup keyed by (user, fingerprint)
+
+Holds what the login path needs to decide between the trusted / verified /
+new-device scenarios (id, verified, trusted, trust expiry, compromised) plus
+the display fields copied onto the session, so repeat logins from a known
+device skip the device SELECT. A miss for an unknown fingerprint is cached
+too, until the device row is created.
+
+Entries are dropped on commit whenever a decision field changes:
+- post_save with any of DECISION_FIELDS (mark_verified, mark_trusted,
+  revoke_trust, mark_compromised, soft_delete / restore, create)
+- post_delete
+- device_trust_changed (bulk UPDATEs that bypass post_save, including
+  devices the risk engine flags as compromised)
+
+Cached devices are built with Model.from_db() and only the cached fields
+loaded, so an accidental save() writes those fields only.
+"""
+
+import json
+import uuid
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from accounts.redis_utils import redis_client
+from .models import Device
+
+CACHE_TTL_SECONDS = 3600
+
+# Changing any of these must invalidate the entry
+DECISION_FIELDS = frozenset({
+    'fingerprint_hash', 'device_name', 'device_type', 'browser', 'os',
+    'is_verified', 'is_trusted', 'trust_expires_at', 'is_compromised', 'is_deleted',
+})
+
+# Loaded from the cache; the last three only seed risk scoring and may lag
+_CACHED_FIELDS = (
+    'id', 'user_id', 'fingerprint_hash', 'device_name', 'device_type', 'browser', 'os',
+    'is_verified', 'is_trusted', 'trust_expires_at', 'is_compromised',
+    'risk_score', 'last_risk_assessment', 'last_used_at',
+)
+_DATETIME_FIELDS = ('trust_expires_at', 'last_risk_assessment', 'last_used_at')
+_MISSING = {'missing': True}
+
+
+def _key(user_id, fingerprint_hash):
+    return f"device_decision:{user_id}:{fingerprint_hash}"
+
+
+def _serialize(device):
+    data = {field: getattr(device, field) for field in _CACHED_FIELDS}
+    data['id'] = str(data['id'])
+    data['user_id'] = str(data['user_id'])
+    for field in _DATETIME_FIELDS:
+        data[field] = data[field].isoformat() if data[field] else None
+    return json.dumps(data)
+
+
+def _deserialize(raw):
+    data = json.loads(raw)
+    if data.get('missing'):
+        return None
+    data['id'] = uuid.UUID(data['id'])
+    data['user_id'] = uuid.UUID(data['user_id'])
+    for field in _DATETIME_FIELDS:
+        data[field] = parse_datetime(data[field]) if data[field] else None
+    # from_db() expects values in concrete field order
+    names = [field.attname for field in Device._meta.concrete_fields if field.attname in data]
+    return Device.from_db('default', names, [data[name] for name in names])
+
+
+class DeviceDecisionCache:
+    """Cached (user, fingerprint) -> device decision record"""
+
+    @staticmethod
+    def get(user_id, fingerprint_hash):
+        """Return the user's non-deleted device for this fingerprint, or None"""
+        key = _key(user_id, fingerprint_hash)
+        raw = redis_client.get(key)
+        if raw:
+            return _deserialize(raw)
+
+        device = Device.objects.filter(
+            user_id=user_id,
+            fingerprint_hash=fingerprint_hash,
+            is_deleted=False
+        ).only(*_CACHED_FIELDS).first()
+        redis_client.setex(key, CACHE_TTL_SECONDS, _serialize(device) if device else json.dumps(_MISSING))
+        return device
+
+    @staticmethod
+    def invalidate(user_id, fingerprint_hash):
+        """Drop an entry once the current transaction commits"""
+        key = _key(user_id, fingerprint_hash)
+        transaction.on_commit(lambda: redis_client.delete(key))
+
+    @classmethod
+    def invalidate_devices(cls, device_ids):
+        """Drop entries for devices changed by a bulk UPDATE"""
+        if not device_ids:
+            return
+        for user_id, fingerprint_hash in Device.objects.filter(pk__in=device_ids).values_list(
+            'user_id', 'fingerprint_hash'
+        ):
+            cls.invalidate(user_id, fingerprint_hash)
@@ -0,0 +1,192 @@
+"""
+Concurrent Session Limits - Per-user active-session cap
+
+Active sessions are tracked in a per-user sorted set scored by expiry:
+- active_sessions:{user_id}  ZSET session_id -> expires_at (unix seconds)
+
+At every login ZREMRANGEBYSCORE drops expired members and ZCARD counts the
+rest (O(log N)); SQL is only consulted when the count reaches the limit, to
+drop members that were revoked since they were added. Over the limit the
+MAX_CONCURRENT_SESSIONS_POLICY applies:
+- 'reject'        the login is refused
+- 'evict_oldest'  the oldest sessions are revoked with Session.bulk_revoke
+                  (every session gets the same lifetime, so lowest expiry
+                  means oldest)
+
+reconcile() rebuilds the sets from the sessions table on a schedule. When
+Redis is not reachable (cache-backed KV in local dev) active sessions are
+counted on the (user, is_active) index instead.
+"""
+
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from accounts.redis_utils import redis_client
+from .models import Session
+
+KEY_PREFIX = "active_sessions:"
+
+
+def _key(user_id):
+    return f"{KEY_PREFIX}{user_id}"
+
+
+def _uses_redis():
+    """Sorted sets are required; the cache KV has none."""
+    return hasattr(redis_client, 'zadd')
+
+
+def _limit():
+    return int(getattr(settings, 'MAX_CONCURRENT_SESSIONS', 0))
+
+
+def _policy():
+    return getattr(settings, 'MAX_CONCURRENT_SESSIONS_POLICY', 'evict_oldest')
+
+
+class ConcurrentSessionLimiter:
+    """Enforce MAX_CONCURRENT_SESSIONS at session creation"""
+
+    @staticmethod
+    def _active_ids(user):
+        """Active session ids for the user, oldest first"""
+        if not _uses_redis():
+            return [
+                str(session_id) for session_id in Session.objects.filter(
+                    user=user,
+                    is_active=True,
+                    expires_at__gt=timezone.now()
+                ).order_by('expires_at').values_list('id', flat=True)
+            ]
+
+        key = _key(user.id)
+        pipe = redis_client.pipeline()
+        pipe.zremrangebyscore(key, '-inf', time.time())
+        pipe.zcard(key)
+        _, count = pipe.execute()
+        if count < _limit():
+            return [None] * count
+
+        # At the limit: confirm members against the table before acting
+        members = redis_client.zrange(key, 0, -1)
+        active = set(
+            str(session_id) for session_id in Session.objects.filter(
+                pk__in=members,
+                is_active=True
+            ).values_list('id', flat=True)
+        )
+        stale = [member for member in members if member not in active]
+        if stale:
+            redis_client.zrem(key, *stale)
+        return [member for member in members if member in active]
+
+    @classmethod
+    def admit(cls, user, ip_address=None):
+        """
+        Make room for one more session.
+        Returns False if the login must be rejected under the 'reject' policy.
+        """
+        limit = _limit()
+        if limit <= 0:
+            return True
+
+        active_ids = cls._active_ids(user)
+        overflow = len(active_ids) - limit + 1
+        if overflow <= 0:
+            return True
+
+        if _policy() == 'reject':
+            cls._audit(user, ip_address, 'rejected', len(active_ids))
+            return False
+
+        evicted = active_ids[:overflow]
+        Session.bulk_revoke(Session.objects.filter(pk__in=evicted), reason='session_limit')
+        if _uses_redis():
+            redis_client.zrem(_key(user.id), *evicted)
+        cls._audit(user, ip_address, 'evicted_oldest', len(active_ids), evicted)
+        return True
+
+    @classmethod
+    def enforce(cls, user, ip_address=None):
+        """admit() for login paths: raise before any token is issued"""
+        if not cls.admit(user, ip_address):
+            raise ValidationError({
+                'error': 'Maximum number of active sessions reached. Log out of another device and try again.',
+                'code': 'session_limit_reached',
+            })
+
+    @staticmethod
+    def track(session):
+        """Register a newly created session"""
+        if _limit() <= 0 or not _uses_redis():
+            return
+        key = _key(session.user_id)
+        expires_at = session.expires_at.timestamp()
+        pipe = redis_client.pipeline()
+        pipe.zadd(key, {str(session.id): expires_at})
+        pipe.expireat(key, int(expires_at) + 1)
+        pipe.execute()
+
+    @staticmethod
+    def reconcile(batch_size=500):
+        """
+        Rebuild every user's set from active rows in the sessions table and
+        drop sets of users without active sessions.
+        """
+        if not _uses_redis():
+            return {'users': 0, 'removed': 0}
+
+        rows = Session.objects.filter(
+            is_active=True,
+            expires_at__gt=timezone.now()
+        ).order_by('user_id').values_list('user_id', 'id', 'expires_at')
+
+        active_users = set()
+        pending = {}
+
+        def write(batch):
+            pipe = redis_client.pipeline()
+            for user_id, members in batch.items():
+                key = _key(user_id)
+                pipe.delete(key)
+                pipe.zadd(key, members)
+                pipe.expireat(key, int(max(members.values())) + 1)
+            pipe.execute()
+
+        for user_id, session_id, expires_at in rows.iterator(chunk_size=2000):
+            user_id = str(user_id)
+            if user_id not in pending and len(pending) >= batch_size:
+                write(pending)
+                pending = {}
+            pending.setdefault(user_id, {})[str(session_id)] = expires_at.timestamp()
+            active_users.add(user_id)
+        if pending:
+            write(pending)
+
+        removed = 0
+        for key in redis_client.scan_iter(match=f"{KEY_PREFIX}*", count=1000):
+            if key[len(KEY_PREFIX):] not in active_users:
+                redis_client.delete(key)
+                removed += 1
+        return {'users': len(active_users), 'removed': removed}
+
+    @staticmethod
+    def _audit(user, ip_address, outcome, active_count, evicted=None):
+        from audits_logs.models import AuditLog
+
+        AuditLog.objects.create(
+            user=user,
+            event_type='concurrent_session_limit_exceeded',
+            severity='medium',
+            description=f"Concurrent session limit ({_limit()}) reached: {outcome.replace('_', ' ')}",
+            ip_address=ip_address,
+            metadata={
+                'policy': _policy(),
+                'limit': _limit(),
+                'active_sessions': active_count,
+                'evicted_session_ids': evicted or [],
+            },
+        )
@@ -0,0 +1,28 @@
+"""
+Move long-inactive sessions to the sessions_archive table
+
+Usage:
+    python manage.py archive_sessions [--days 30] [--chunk-size 1000] [--dry-run]
+"""
+
+from django.core.management.base import BaseCommand
+
+from devices.archive import archivable_sessions, archive_cutoff, archive_sessions
+
+
+class Command(BaseCommand):
+    help = 'Archive sessions revoked or expired for longer than SESSION_ARCHIVE_AFTER_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Override SESSION_ARCHIVE_AFTER_DAYS')
+        parser.add_argument('--chunk-size', type=int, help='Sessions moved per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only count archivable sessions')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = archivable_sessions(archive_cutoff(options['days'])).count()
+            self.stdout.write(f'{count} session(s) would be archived.')
+            return
+
+        moved = archive_sessions(older_than_days=options['days'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} session(s).'))
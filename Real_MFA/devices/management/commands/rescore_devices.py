@@ -0,0 +1,99 @@
+"""
+Re-score every device from session history
+
+Replays sessions per user in chronological order through the same scoring
+function the live engine uses, writes the results with bulk_update and seeds
+the per-user KV aggregates so live scoring continues from the replayed state.
+ASN and failed-OTP signals are not stored on sessions and are not replayed.
+
+Usage:
+    python manage.py rescore_devices [--batch-size 500] [--dry-run]
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.models import User
+from devices.models import Device, Session
+from devices.risk import DeviceRiskEngine, decayed_score, mark_compromised, new_profile, score_event
+
+
+class Command(BaseCommand):
+    help = 'Recompute Device.risk_score from historical sessions in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Users per chunk')
+        parser.add_argument('--dry-run', action='store_true', help='Compute scores without writing them')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        threshold = getattr(settings, 'DEVICE_RISK_COMPROMISE_THRESHOLD', 90)
+
+        users = User.objects.filter(devices__isnull=False).distinct().order_by('id').values_list('id', flat=True)
+        last_user_id = None
+        scored = compromised = 0
+
+        while True:
+            chunk = users.filter(id__gt=last_user_id) if last_user_id else users
+            user_ids = list(chunk[:batch_size])
+            if not user_ids:
+                break
+            last_user_id = user_ids[-1]
+
+            devices = {
+                (device.user_id, device.fingerprint_hash): device
+                for device in Device.objects.filter(user_id__in=user_ids).only('id', 'user_id', 'fingerprint_hash')
+            }
+            state = {}      # device_id -> (score, ts)
+            profiles = {}   # user_id -> profile
+
+            sessions = Session.objects.filter(user_id__in=user_ids).order_by('user_id', 'created_at').values_list(
+                'user_id', 'fingerprint_hash', 'ip_address', 'country', 'created_at'
+            )
+            for user_id, fingerprint_hash, ip_address, country, created_at in sessions.iterator(chunk_size=2000):
+                device = devices.get((user_id, fingerprint_hash))
+                if device is None:
+                    continue
+                profile = profiles.setdefault(user_id, new_profile())
+                device_id = str(device.id)
+                prior_score, prior_ts = state.get(device_id, (0, None))
+                now = created_at.timestamp()
+                state[device_id] = (
+                    score_event(profile, device_id, prior_score, prior_ts, now, ip=ip_address, country=country),
+                    now,
+                )
+
+            now = time.time()
+            assessed_at = timezone.now()
+            to_update = []
+            flagged = []
+            for device in devices.values():
+                score, ts = state.get(str(device.id), (0, None))
+                device.risk_score = decayed_score(score, ts, now)
+                device.last_risk_assessment = assessed_at
+                to_update.append(device)
+                if device.risk_score >= threshold:
+                    flagged.append(device.id)
+
+            scored += len(to_update)
+            compromised += len(flagged)
+            if dry_run:
+                continue
+
+            Device.objects.bulk_update(to_update, ['risk_score', 'last_risk_assessment'], batch_size=batch_size)
+            if flagged:
+                mark_compromised(flagged, source='rescore_devices')
+            device_ids_by_user = {}
+            for (user_id, _), device in devices.items():
+                device_ids_by_user.setdefault(user_id, []).append(str(device.id))
+            for user_id, profile in profiles.items():
+                DeviceRiskEngine.seed(user_id, profile, device_ids_by_user.get(user_id, []))
+
+        prefix = '[dry run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Re-scored {scored} devices; {compromised} at or above the compromise threshold.'
+        ))
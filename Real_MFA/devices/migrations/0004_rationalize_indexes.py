@@ -0,0 +1,82 @@
+# Generated by Django 5.2.11 on 2026-10-19 03:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0003_add_fingerprint_hash_to_session'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='device',
+            name='devices_fingerp_09968a_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='device',
+            name='devices_last_us_09d796_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='device',
+            name='devices_is_comp_642b15_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='device',
+            name='devices_risk_sc_cdcbd4_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='session',
+            name='sessions_token_j_d793f8_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='session',
+            name='sessions_expires_bbb852_idx',
+        ),
+        migrations.AlterField(
+            model_name='device',
+            name='fingerprint_hash',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='device',
+            name='is_compromised',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='device',
+            name='is_trusted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='device',
+            name='is_verified',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='session',
+            name='expires_at',
+            field=models.DateTimeField(),
+        ),
+        migrations.AlterField(
+            model_name='session',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='session',
+            name='token_jti',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(condition=models.Q(('is_compromised', True)), fields=['is_compromised'], name='devices_compromised_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['expires_at'], name='sessions_active_expiry_idx'),
+        ),
+    ]
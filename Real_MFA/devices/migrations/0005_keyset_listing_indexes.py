@@ -0,0 +1,27 @@
+# Generated by Django 5.2.11 on 2026-10-19 03:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0004_rationalize_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='session',
+            name='sessions_user_id_85103c_idx',
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['user', 'is_deleted', '-last_used_at', 'id'], name='devices_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['user', 'is_active', '-last_activity', 'id'], name='sessions_user_activity_idx'),
+        ),
+    ]
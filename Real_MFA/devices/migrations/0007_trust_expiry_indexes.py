@@ -0,0 +1,32 @@
+# Generated by Django 5.2.11 on 2026-10-19 03:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0006_session_coordinates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='trusteddevice',
+            name='trusted_dev_expires_cd22b8_idx',
+        ),
+        migrations.AlterField(
+            model_name='trusteddevice',
+            name='expires_at',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(condition=models.Q(('is_trusted', True)), fields=['trust_expires_at'], name='devices_trust_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trusteddevice',
+            index=models.Index(condition=models.Q(('is_trusted', True)), fields=['expires_at'], name='trusted_devices_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-19 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0008_archived_session'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='session',
+            name='revoked_reason',
+            field=models.CharField(blank=True, choices=[('user_logout', 'User Logout'), ('user_revoked', 'User Revoked'), ('password_changed', 'Password Changed'), ('password_reset', 'Password Reset'), ('admin_revoked', 'Admin Revoked'), ('security_concern', 'Security Concern'), ('session_expired', 'Session Expired'), ('session_limit', 'Concurrent Session Limit')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0009_session_limit_revoked_reason'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='device',
+            name='last_used_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
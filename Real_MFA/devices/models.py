@@ -62,7 +62,7 @@ class Device(TimeStampedModel, SoftDeleteModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='devices')
     
     # Device Identification
-    fingerprint_hash = models.CharField(max_length=255, db_index=True)
+    fingerprint_hash = models.CharField(max_length=255)
     device_name = models.CharField(max_length=255, blank=True)
     device_type = models.CharField(max_length=20, choices=DEVICE_TYPE_CHOICES, default='unknown')
     
@@ -83,18 +83,18 @@ class Device(TimeStampedModel, SoftDeleteModel):
     longitude = models.FloatField(null=True, blank=True)
     
     # Trust & Verification
-    is_verified = models.BooleanField(default=False, db_index=True)
-    is_trusted = models.BooleanField(default=False, db_index=True)
+    is_verified = models.BooleanField(default=False)
+    is_trusted = models.BooleanField(default=False)
     verified_at = models.DateTimeField(null=True, blank=True)
     trust_expires_at = models.DateTimeField(null=True, blank=True)
     
     # Activity Tracking
-    last_used_at = models.DateTimeField(auto_now=True, db_index=True)
+    last_used_at = models.DateTimeField(auto_now=True)
     first_used_at = models.DateTimeField(auto_now_add=True)
     total_logins = models.PositiveIntegerField(default=0)
     
     # Anomaly & Risk Detection
-    is_compromised = models.BooleanField(default=False, db_index=True)
+    is_compromised = models.BooleanField(default=False)
     risk_score = models.PositiveIntegerField(default=0)  # 0-100
     last_risk_assessment = models.DateTimeField(null=True, blank=True)
     
@@ -113,10 +113,22 @@ class Device(TimeStampedModel, SoftDeleteModel):
         indexes = [
             models.Index(fields=['user', 'is_trusted', 'is_deleted']),
             models.Index(fields=['user', 'is_verified']),
-            models.Index(fields=['fingerprint_hash']),
-            models.Index(fields=['last_used_at']),
-            models.Index(fields=['is_compromised']),
-            models.Index(fields=['risk_score']),
+            # Keyset pagination of the device list: (-last_used_at, id)
+            models.Index(
+                fields=['user', 'is_deleted', '-last_used_at', 'id'],
+                name='devices_user_recent_idx',
+            ),
+            # Trust-expiry sweep only reads currently trusted rows
+            models.Index(
+                fields=['trust_expires_at'],
+                condition=models.Q(is_trusted=True),
+                name='devices_trust_expiry_idx',
+            ),
+            models.Index(
+                fields=['is_compromised'],
+                condition=models.Q(is_compromised=True),
+                name='devices_compromised_idx',
+            ),
         ]
     
     def __str__(self):
@@ -162,6 +174,16 @@ class Device(TimeStampedModel, SoftDeleteModel):
             return False
         return True
     
+    def has_active_trust(self):
+        """
+        Read-only trust check for the login path.
+        is_trusted is kept current by the expire_device_trust sweep; the expiry
+        comparison only covers the window between sweeps and never writes.
+        """
+        if not self.is_trusted or self.is_compromised:
+            return False
+        return self.trust_expires_at is None or timezone.now() < self.trust_expires_at
+    
     def is_trust_expired(self):
         """Check if device trust has expired"""
         if not self.is_trusted:
@@ -192,7 +214,7 @@ class TrustedDevice(TimeStampedModel, SoftDeleteModel):
     # Status
     is_trusted = models.BooleanField(default=True)
     trusted_at = models.DateTimeField(auto_now_add=True)
-    expires_at = models.DateTimeField(db_index=True)
+    expires_at = models.DateTimeField()
     
     # Activity
     last_verified_at = models.DateTimeField(null=True, blank=True)
@@ -209,7 +231,11 @@ class TrustedDevice(TimeStampedModel, SoftDeleteModel):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['user', 'is_trusted']),
-            models.Index(fields=['expires_at']),
+            models.Index(
+                fields=['expires_at'],
+                condition=models.Q(is_trusted=True),
+                name='trusted_devices_expiry_idx',
+            ),
         ]
     
     def __str__(self):
@@ -230,7 +256,7 @@ class Session(TimeStampedModel, SoftDeleteModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sessions')
     
     # Session Token Reference (JWT jti)
-    token_jti = models.CharField(max_length=255, unique=True, db_index=True)
+    token_jti = models.CharField(max_length=255, unique=True)
     
     # Device fingerprint - used to identify which device this session belongs to
     fingerprint_hash = models.CharField(max_length=255, db_index=True, blank=True)
@@ -248,10 +274,12 @@ class Session(TimeStampedModel, SoftDeleteModel):
     # Location (optional)
     country = models.CharField(max_length=100, blank=True)
     city = models.CharField(max_length=100, blank=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
     
     # Status
-    is_active = models.BooleanField(default=True, db_index=True)
-    expires_at = models.DateTimeField(db_index=True)
+    is_active = models.BooleanField(default=True)
+    expires_at = models.DateTimeField()
     last_activity = models.DateTimeField(auto_now=True)
     
     # Revocation
@@ -266,6 +294,7 @@ class Session(TimeStampedModel, SoftDeleteModel):
             ('admin_revoked', 'Admin Revoked'),
             ('security_concern', 'Security Concern'),
             ('session_expired', 'Session Expired'),
+            ('session_limit', 'Concurrent Session Limit'),
         ],
         blank=True
     )
@@ -276,9 +305,30 @@ class Session(TimeStampedModel, SoftDeleteModel):
         verbose_name_plural = 'Sessions'
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['user', 'is_active']),
-            models.Index(fields=['token_jti']),
-            models.Index(fields=['expires_at']),
+            # Keyset pagination of the session list: (-last_activity, id).
+            # Also serves plain (user, is_active) lookups as a prefix.
+            models.Index(
+                fields=['user', 'is_active', '-last_activity', 'id'],
+                name='sessions_user_activity_idx',
+            ),
+            # Expiry sweeps and active-session counts only touch active rows
+            models.Index(
+                fields=['expires_at'],
+                condition=models.Q(is_active=True),
+                name='sessions_active_expiry_idx',
+            ),
+            # Archival sweep: inactive rows by age
+            models.Index(
+                fields=['last_activity'],
+                condition=models.Q(is_active=False),
+                name='sessions_inactive_idx',
+            ),
+            # Per-user login points in time order for impossible-travel checks
+            models.Index(
+                fields=['user', 'created_at'],
+                condition=models.Q(latitude__isnull=False),
+                name='sessions_geo_history_idx',
+            ),
         ]
     
     def __str__(self):
@@ -301,28 +351,110 @@ class Session(TimeStampedModel, SoftDeleteModel):
             pass
     
     @classmethod
-    def revoke_all_for_user(cls, user, reason='user_revoked', exclude_session_id=None):
-        """Revoke all active sessions for a user"""
+    def bulk_revoke(cls, sessions, reason='user_revoked'):
+        """
+        Revoke a queryset of sessions and blacklist their tokens
+        Constant query count regardless of size: one SELECT resolving the
+        outstanding tokens, one UPDATE and one bulk INSERT, in one transaction
+        """
+        from django.db import transaction
         from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
         
-        sessions = cls.objects.filter(user=user, is_active=True)
-        if exclude_session_id:
-            sessions = sessions.exclude(id=exclude_session_id)
+        active_sessions = sessions.filter(is_active=True)
         
-        revoked_count = 0
-        for session in sessions:
-            session.is_active = False
-            session.revoked_at = timezone.now()
-            session.revoked_reason = reason
-            session.save(update_fields=['is_active', 'revoked_at', 'revoked_reason'])
+        with transaction.atomic():
+            outstanding_ids = list(
+                OutstandingToken.objects.filter(
+                    jti__in=active_sessions.values('token_jti')
+                ).values_list('id', flat=True)
+            )
             
-            # Blacklist the token
-            try:
-                outstanding_token = OutstandingToken.objects.get(jti=session.token_jti)
-                BlacklistedToken.objects.get_or_create(token=outstanding_token)
-            except OutstandingToken.DoesNotExist:
-                pass
+            revoked_count = active_sessions.update(
+                is_active=False,
+                revoked_at=timezone.now(),
+                revoked_reason=reason
+            )
             
-            revoked_count += 1
+            if outstanding_ids:
+                BlacklistedToken.objects.bulk_create(
+                    [BlacklistedToken(token_id=token_id) for token_id in outstanding_ids],
+                    ignore_conflicts=True
+                )
         
         return revoked_count
+    
+    @classmethod
+    def revoke_all_for_user(cls, user, reason='user_revoked', exclude_session_id=None):
+        """Revoke all active sessions for a user"""
+        sessions = cls.objects.filter(user=user)
+        if exclude_session_id:
+            sessions = sessions.exclude(id=exclude_session_id)
+        
+        return cls.bulk_revoke(sessions, reason=reason)
+
+
+# ---------------------------
+# Archived Session Model
+# ---------------------------
+class ArchivedSession(models.Model):
+    """
+    Append-only cold storage for sessions inactive longer than
+    SESSION_ARCHIVE_AFTER_DAYS. Rows are copied from `sessions` with their
+    original ids and timestamps and never updated afterwards.
+    """
+    
+    # Columns copied from Session (everything except soft-delete flags)
+    ARCHIVED_FIELDS = [
+        'id', 'user_id', 'token_jti', 'fingerprint_hash', 'ip_address', 'user_agent',
+        'device_name', 'device_type', 'browser', 'os', 'country', 'city',
+        'latitude', 'longitude', 'is_active', 'expires_at', 'last_activity',
+        'revoked_at', 'revoked_reason', 'created_at', 'updated_at',
+    ]
+    
+    id = models.UUIDField(primary_key=True, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_sessions')
+    token_jti = models.CharField(max_length=255, db_index=True)
+    fingerprint_hash = models.CharField(max_length=255, blank=True)
+    
+    ip_address = models.GenericIPAddressField()
+    user_agent = models.TextField(blank=True)
+    device_name = models.CharField(max_length=255, blank=True)
+    device_type = models.CharField(max_length=50, blank=True)
+    browser = models.CharField(max_length=100, blank=True)
+    os = models.CharField(max_length=100, blank=True)
+    
+    country = models.CharField(max_length=100, blank=True)
+    city = models.CharField(max_length=100, blank=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    
+    is_active = models.BooleanField(default=False)
+    expires_at = models.DateTimeField()
+    last_activity = models.DateTimeField()
+    revoked_at = models.DateTimeField(null=True, blank=True)
+    revoked_reason = models.CharField(max_length=50, blank=True)
+    
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'sessions_archive'
+        verbose_name = 'Archived Session'
+        verbose_name_plural = 'Archived Sessions'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='sessions_archive_user_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Archived session for {self.user_id} - {self.device_name or 'Unknown Device'}"
+    
+    @classmethod
+    def from_session(cls, session):
+        """Copy a hot session; sessions that simply ran out are closed as expired"""
+        archived = cls(**{field: getattr(session, field) for field in cls.ARCHIVED_FIELDS})
+        if archived.is_active:
+            archived.is_active = False
+            archived.revoked_reason = 'session_expired'
+        return archived
@@ -0,0 +1,87 @@
+"""
+Keyset Pagination - Cursor pagination over (timestamp DESC, id ASC)
+
+Each page is a single range scan on a (user, flag, -timestamp, id) index:
+the cursor carries the last row's (timestamp, id) and the next page starts
+strictly after it, so rows inserted meanwhile never shift or repeat a page.
+
+Paging is opt-in: without ?cursor= or ?page_size= the whole list is
+returned, as before pagination existed.
+
+The timestamps used here (Device.last_used_at, Session.last_activity) are
+updated as the rows are used. They only move forward, so a row bumped while
+a client is paging moves ahead of the cursor: it is not repeated, but a row
+not yet served is skipped by that walk. Lists are short and re-read on every
+visit, so this is accepted in exchange for most-recent-first ordering.
+"""
+
+import base64
+import json
+import uuid
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+
+class KeysetPagination:
+    """Paginate a queryset by a timestamp field with id as tie-breaker"""
+
+    page_size = 100
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def __init__(self, timestamp_field):
+        self.timestamp_field = timestamp_field
+        self.next_cursor = None
+
+    def encode_cursor(self, obj):
+        position = {
+            't': getattr(obj, self.timestamp_field).isoformat(),
+            'id': str(obj.pk),
+        }
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            timestamp = parse_datetime(position['t'])
+            if timestamp is None:
+                raise ValueError('bad timestamp')
+            return timestamp, uuid.UUID(str(position['id']))
+        except (ValueError, KeyError, TypeError):
+            raise ValidationError({'cursor': 'Invalid cursor.'})
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def paginate_queryset(self, queryset, request):
+        """
+        Return the rows of the requested page and set self.next_cursor.
+        Without cursor / page_size every row is returned and next_cursor is None.
+        """
+        field = self.timestamp_field
+        queryset = queryset.order_by(f'-{field}', 'id')
+        if not self.is_requested(request):
+            return list(queryset)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            timestamp, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(**{f'{field}__lt': timestamp}) | Q(**{field: timestamp, 'id__gt': pk})
+            )
+
+        page_size = self.get_page_size(request)
+        rows = list(queryset[:page_size + 1])
+        self.next_cursor = self.encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+        return rows[:page_size]
@@ -0,0 +1,349 @@
+"""
+Device Risk Engine - Incremental risk scoring on login and verify events
+
+Every event adjusts a device's score in O(1) from per-user rolling aggregates
+kept in the KV store; no login history is scanned. Scores decay towards 0
+with a half-life, so old signals fade without a sweep.
+
+Key layout:
+- device_risk_profile:{user_id}  JSON aggregates: recent IPs / ASNs / countries
+                                 (most recent first, capped), last country,
+                                 decayed failed-OTP counter, per-device last seen
+- device_risk_score:{device_id}  JSON {score, ts} not yet written to the row
+- device_risk:dirty              LIST of device ids waiting for the batched write
+- device_risk:flush_lock         held by the beat task while it flushes a batch
+
+Scores reach `devices.risk_score` through flush() (beat task, bulk_update).
+When Redis is not reachable (cache-backed KV in local dev) there are no lists,
+so each score is written to its row directly. A score at or above
+DEVICE_RISK_COMPROMISE_THRESHOLD flags the device (mark_compromised).
+"""
+
+import json
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+
+from accounts.redis_utils import redis_client
+from .models import Device
+from .signals import device_trust_changed
+
+DIRTY_QUEUE_KEY = "device_risk:dirty"
+FLUSH_LOCK_KEY = "device_risk:flush_lock"
+
+PROFILE_TTL_SECONDS = 90 * 24 * 3600
+MAX_RECENT = 10          # IPs / ASNs / countries remembered per user
+MAX_DEVICES_SEEN = 20    # per-device last-seen entries kept per user
+
+# Signal weights (score is clamped to 0-100)
+WEIGHT_NEW_IP = 3          # dynamic IPs are common; ASN / country carry the signal
+WEIGHT_NEW_ASN = 15
+WEIGHT_NEW_COUNTRY = 25
+WEIGHT_COUNTRY_CHANGE = 10
+WEIGHT_FAILED_OTP = 8
+WEIGHT_DORMANT_30_DAYS = 10
+WEIGHT_DORMANT_90_DAYS = 20
+CREDIT_VERIFIED = 15
+
+FAILED_OTP_HALF_LIFE_SECONDS = 3600
+
+
+def _profile_key(user_id):
+    return f"device_risk_profile:{user_id}"
+
+
+def _score_key(device_id):
+    return f"device_risk_score:{device_id}"
+
+
+def _uses_redis():
+    """The batched write needs a list; the cache KV has none."""
+    return hasattr(redis_client, 'rpush')
+
+
+def _from_ts(value):
+    return datetime.fromtimestamp(float(value), tz=dt_timezone.utc) if value else None
+
+
+def _decay(value, elapsed_seconds, half_life_seconds):
+    if value <= 0 or elapsed_seconds <= 0:
+        return value
+    return value * 0.5 ** (elapsed_seconds / half_life_seconds)
+
+
+def _half_life_seconds():
+    return getattr(settings, 'DEVICE_RISK_HALF_LIFE_HOURS', 24) * 3600
+
+
+def decayed_score(score, scored_at, now):
+    """Score as it stands at `now` after decaying since `scored_at`"""
+    return max(0, int(round(_decay(score, now - (scored_at or now), _half_life_seconds()))))
+
+
+def asn_from_org(org):
+    """ipinfo 'org' looks like 'AS15169 Google LLC'; keep the AS number"""
+    token = (org or '').split(' ', 1)[0]
+    return token if token.upper().startswith('AS') else ''
+
+
+def new_profile():
+    return {'ips': [], 'asns': [], 'countries': [], 'last_country': '',
+            'failed_otp': 0.0, 'failed_otp_ts': 0, 'devices': {}}
+
+
+def _remember(values, value):
+    """Move value to the front of an MRU list; returns True if it was unseen"""
+    if not value:
+        return False
+    seen = value in values
+    if seen:
+        values.remove(value)
+    values.insert(0, value)
+    del values[MAX_RECENT:]
+    return not seen
+
+
+def failed_otp_count(profile, now):
+    return _decay(profile.get('failed_otp', 0.0), now - profile.get('failed_otp_ts', now),
+                  FAILED_OTP_HALF_LIFE_SECONDS)
+
+
+def score_event(profile, device_id, prior_score, prior_ts, now, ip='', asn='', country='',
+                verified=False, last_used_ts=None):
+    """
+    Apply one login/verify event to a profile and return the new score.
+
+    Pure function over the profile dict (mutated in place), shared by the
+    online engine and the bulk re-score command.
+    """
+    score = _decay(prior_score, now - (prior_ts or now), _half_life_seconds())
+    has_history = bool(profile['ips'])
+
+    # Novelty is only meaningful once the user has a baseline
+    if _remember(profile['ips'], ip) and has_history:
+        score += WEIGHT_NEW_IP
+    if _remember(profile['asns'], asn) and has_history:
+        score += WEIGHT_NEW_ASN
+    if country:
+        if _remember(profile['countries'], country) and has_history:
+            score += WEIGHT_NEW_COUNTRY
+        elif profile['last_country'] and profile['last_country'] != country:
+            score += WEIGHT_COUNTRY_CHANGE
+        profile['last_country'] = country
+
+    last_seen = profile['devices'].get(device_id, last_used_ts)
+    if last_seen:
+        idle_days = (now - last_seen) / 86400
+        if idle_days >= 90:
+            score += WEIGHT_DORMANT_90_DAYS
+        elif idle_days >= 30:
+            score += WEIGHT_DORMANT_30_DAYS
+    profile['devices'][device_id] = now
+    if len(profile['devices']) > MAX_DEVICES_SEEN:
+        oldest = min(profile['devices'], key=profile['devices'].get)
+        del profile['devices'][oldest]
+
+    score += WEIGHT_FAILED_OTP * failed_otp_count(profile, now)
+    if verified:
+        score -= CREDIT_VERIFIED
+        profile['failed_otp'] = 0.0
+
+    return max(0, min(100, int(round(score))))
+
+
+def mark_compromised(device_ids, source):
+    """
+    Flag devices whose score reached the compromise threshold.
+
+    Drops their trust, writes one DeviceAuditLog row per device and sends
+    device_trust_changed on commit (which clears cached login decisions).
+    Devices already flagged are left alone. Returns the number flagged.
+    """
+    from audits_logs.models import DeviceAuditLog
+
+    threshold = getattr(settings, 'DEVICE_RISK_COMPROMISE_THRESHOLD', 90)
+    with transaction.atomic():
+        devices = list(
+            Device.objects.select_for_update()
+            .filter(pk__in=device_ids, is_compromised=False)
+            .only('id', 'user_id', 'fingerprint_hash', 'device_name', 'device_type', 'browser', 'os',
+                  'ip_address', 'last_ip', 'country', 'city', 'is_trusted', 'risk_score')
+        )
+        if not devices:
+            return 0
+
+        flagged_ids = [device.id for device in devices]
+        Device.objects.filter(pk__in=flagged_ids).update(is_compromised=True, is_trusted=False, can_skip_mfa=False)
+        DeviceAuditLog.objects.bulk_create([
+            DeviceAuditLog(
+                user_id=device.user_id,
+                device_id=device.id,
+                action='device_compromise_suspected',
+                description=f"Risk score {device.risk_score} reached the compromise threshold ({threshold})",
+                ip_address=device.last_ip or device.ip_address,
+                device_fingerprint=device.fingerprint_hash,
+                device_name=device.device_name,
+                device_type=device.device_type,
+                browser=device.browser,
+                os=device.os,
+                country=device.country,
+                city=device.city,
+                was_trusted=device.is_trusted,
+                now_trusted=False,
+                metadata={'risk_score': device.risk_score, 'threshold': threshold, 'source': source},
+            )
+            for device in devices
+        ])
+
+        user_ids = list({device.user_id for device in devices})
+        transaction.on_commit(lambda: device_trust_changed.send(
+            sender=Device, device_ids=flagged_ids, user_ids=user_ids, reason='compromised'
+        ))
+    return len(devices)
+
+
+class DeviceRiskEngine:
+    """Score devices incrementally and batch the writes to the devices table"""
+
+    @staticmethod
+    def _load_profile(user_id):
+        raw = redis_client.get(_profile_key(user_id))
+        return json.loads(raw) if raw else new_profile()
+
+    @staticmethod
+    def _save_profile(user_id, profile):
+        redis_client.setex(_profile_key(user_id), PROFILE_TTL_SECONDS, json.dumps(profile))
+
+    @staticmethod
+    def _current_score(device):
+        """Latest score (buffered or persisted) and when it was computed"""
+        raw = redis_client.get(_score_key(device.id))
+        if raw:
+            data = json.loads(raw)
+            return data['score'], data['ts']
+        assessed = device.last_risk_assessment.timestamp() if device.last_risk_assessment else None
+        return device.risk_score, assessed
+
+    @staticmethod
+    def _store_score(device, score, now):
+        threshold = getattr(settings, 'DEVICE_RISK_COMPROMISE_THRESHOLD', 90)
+        device.risk_score = score
+        device.last_risk_assessment = _from_ts(now)
+
+        # The score key is the source of truth for the next event either way
+        redis_client.setex(_score_key(device.id), PROFILE_TTL_SECONDS, json.dumps({'score': score, 'ts': now}))
+        if _uses_redis():
+            redis_client.rpush(DIRTY_QUEUE_KEY, str(device.id))
+            return
+
+        Device.objects.filter(pk=device.pk).update(
+            risk_score=score, last_risk_assessment=device.last_risk_assessment,
+        )
+        if score >= threshold:
+            mark_compromised([device.pk], source='risk_engine')
+
+    @classmethod
+    def _record(cls, device, location, verified):
+        location = location or {}
+        now = time.time()
+        profile = cls._load_profile(device.user_id)
+        prior_score, prior_ts = cls._current_score(device)
+
+        score = score_event(
+            profile,
+            str(device.id),
+            prior_score,
+            prior_ts,
+            now,
+            ip=location.get('ip', ''),
+            asn=asn_from_org(location.get('org')),
+            country=location.get('country', ''),
+            verified=verified,
+            last_used_ts=device.last_used_at.timestamp() if device.last_used_at else None,
+        )
+        cls._save_profile(device.user_id, profile)
+        cls._store_score(device, score, now)
+        return score
+
+    @classmethod
+    def record_login(cls, device, location):
+        """Password login on a known device"""
+        return cls._record(device, location, verified=False)
+
+    @classmethod
+    def record_verified(cls, device, location):
+        """Login completed a second factor (device OTP, TOTP or backup code)"""
+        return cls._record(device, location, verified=True)
+
+    @classmethod
+    def record_failed_otp(cls, user_id):
+        """
+        Count a failed OTP/TOTP attempt against the user.
+        The device may not exist yet, so the count lands on the profile and
+        is charged to whichever device completes the next event.
+        """
+        now = time.time()
+        profile = cls._load_profile(user_id)
+        profile['failed_otp'] = failed_otp_count(profile, now) + 1
+        profile['failed_otp_ts'] = now
+        cls._save_profile(user_id, profile)
+
+    @staticmethod
+    def flush(batch_size=None):
+        """
+        Write buffered scores to the devices table with one bulk_update.
+
+        Ids leave the dirty list only after the write committed, so a failed
+        write is retried by the next run.
+        """
+        if not _uses_redis():
+            return 0
+
+        batch_size = int(batch_size or getattr(settings, 'DEVICE_RISK_FLUSH_BATCH_SIZE', 500))
+        threshold = getattr(settings, 'DEVICE_RISK_COMPROMISE_THRESHOLD', 90)
+
+        # One flusher at a time: the trim below assumes nobody else read the head
+        lock_token = uuid.uuid4().hex
+        if not redis_client.set(FLUSH_LOCK_KEY, lock_token, ex=60, nx=True):
+            return 0
+        try:
+            queued = redis_client.lrange(DIRTY_QUEUE_KEY, 0, batch_size - 1)
+            if not queued:
+                return 0
+            device_ids = list(dict.fromkeys(queued))
+
+            pipe = redis_client.pipeline()
+            for device_id in device_ids:
+                pipe.get(_score_key(device_id))
+            raw_scores = pipe.execute()
+
+            devices = []
+            compromised = []
+            for device_id, raw in zip(device_ids, raw_scores):
+                if not raw:
+                    continue
+                data = json.loads(raw)
+                devices.append(Device(id=device_id, risk_score=data['score'],
+                                      last_risk_assessment=_from_ts(data['ts'])))
+                if data['score'] >= threshold:
+                    compromised.append(device_id)
+
+            with transaction.atomic():
+                Device.objects.bulk_update(devices, ['risk_score', 'last_risk_assessment'], batch_size=batch_size)
+                if compromised:
+                    mark_compromised(compromised, source='risk_engine')
+            redis_client.ltrim(DIRTY_QUEUE_KEY, len(queued), -1)
+            return len(devices)
+        finally:
+            if redis_client.get(FLUSH_LOCK_KEY) == lock_token:
+                redis_client.delete(FLUSH_LOCK_KEY)
+
+    @staticmethod
+    def seed(user_id, profile, device_ids):
+        """Replace a user's aggregates after a bulk re-score and drop stale buffered scores"""
+        DeviceRiskEngine._save_profile(user_id, profile)
+        for device_id in device_ids:
+            redis_client.delete(_score_key(device_id))
@@ -11,16 +11,85 @@ from accounts.redis_utils import redis_client
 from accounts.validators import get_location_from_ip
 from otp.models import OTP
 from otp.utils import hash_otp, get_client_ip
+from .limits import ConcurrentSessionLimiter
 from .models import Device, Session
+from .risk import DeviceRiskEngine
+from .travel import ImpossibleTravelDetector
+from .upsert import upsert_device
+
+
+def resolve_current_device(request):
+    """
+    Work out which fingerprint(s) identify the requesting device.
+    Runs at most two queries per request, no matter how many devices are listed.
+    
+    Method 1: X-Device-Fingerprint header (if matches a device)
+    Method 2: Current session's fingerprint (from authentication)
+    Method 3: Most recent active session's fingerprint (fallback)
+    """
+    header_fingerprint = request.META.get('HTTP_X_DEVICE_FINGERPRINT')
+    current_session = getattr(request, 'current_session', None)
+    
+    def most_recent_session():
+        try:
+            return Session.objects.filter(
+                user=request.user,
+                is_active=True
+            ).order_by('-last_activity').first()
+        except Exception:
+            return None
+    
+    fingerprints = set()
+    header_matches_any_device = None
+    fallback_session = None
+    
+    if header_fingerprint:
+        fingerprints.add(header_fingerprint)
+    if current_session:
+        fingerprints.add(current_session.fingerprint_hash)
+    
+    if not header_fingerprint and not current_session:
+        fallback_session = most_recent_session()
+    elif header_fingerprint:
+        # Header that matches no device: fall back to session-based detection
+        try:
+            header_matches_any_device = Device.objects.filter(
+                user=request.user,
+                fingerprint_hash=header_fingerprint,
+                is_deleted=False
+            ).exists()
+        except Exception:
+            header_matches_any_device = False
+        
+        if not header_matches_any_device and not current_session:
+            fallback_session = most_recent_session()
+    
+    if fallback_session:
+        fingerprints.add(fallback_session.fingerprint_hash)
+    fingerprints.discard('')
+    
+    return {
+        'fingerprints': frozenset(fingerprints),
+        'header_fingerprint': header_fingerprint,
+        'header_matches_any_device': header_matches_any_device,
+        'session_fingerprint': (current_session or fallback_session).fingerprint_hash
+        if (current_session or fallback_session) else None,
+    }
 
 
 class DeviceListSerializer(serializers.ModelSerializer):
     """
     Serializer for listing user devices
+    
+    Context:
+    - current_device: result of resolve_current_device(request); computed
+      once and cached in the context when not supplied
+    - include_debug: add per-row debug_info (off by default)
     """
     is_current = serializers.SerializerMethodField()
     trust_status = serializers.SerializerMethodField()
-    user_id = serializers.UUIDField(source='user.id', read_only=True)
+    debug_info = serializers.SerializerMethodField()
+    user_id = serializers.UUIDField(read_only=True)
     ip_address = serializers.CharField(read_only=True)
     last_ip = serializers.CharField(read_only=True)
 
@@ -52,97 +121,47 @@ class DeviceListSerializer(serializers.ModelSerializer):
             'created_at',
             'user_id',
             'fingerprint_hash',
+            'debug_info',
         ]
         read_only_fields = fields
 
-    def get_debug_info(self, obj):
-        """Temporary debug info to diagnose is_current issue"""
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.context.get('include_debug'):
+            fields.pop('debug_info', None)
+        return fields
+
+    def _current_device(self):
+        """Request-scoped current device resolution shared by every row"""
         request = self.context.get('request')
-        if not request:
+        if not request or not request.user.is_authenticated:
+            return None
+        if 'current_device' not in self.context:
+            self.context['current_device'] = resolve_current_device(request)
+        return self.context['current_device']
+
+    def get_debug_info(self, obj):
+        """Debug info to diagnose is_current detection"""
+        current = self._current_device()
+        if current is None:
             return {'error': 'no_request'}
         
-        # Check header fingerprint
-        header_fingerprint = request.META.get('HTTP_X_DEVICE_FINGERPRINT')
-        
-        # Get most recent session
-        try:
-            most_recent = Session.objects.filter(
-                user=request.user,
-                is_active=True
-            ).order_by('-last_activity').first()
-        except Exception:
-            most_recent = None
-        
+        header_fingerprint = current['header_fingerprint']
         return {
             'header_fingerprint': header_fingerprint,
             'device_fingerprint': obj.fingerprint_hash,
             'header_match': header_fingerprint == obj.fingerprint_hash if header_fingerprint else None,
-            'most_recent_session_fingerprint': most_recent.fingerprint_hash if most_recent else None,
-            'session_match': most_recent.fingerprint_hash == obj.fingerprint_hash if most_recent else False
+            'header_matches_any_device': current['header_matches_any_device'],
+            'session_fingerprint': current['session_fingerprint'],
+            'session_match': current['session_fingerprint'] == obj.fingerprint_hash
         }
 
     def get_is_current(self, obj):
-        """
-        Check if this device is the current device
-        by matching fingerprint_hash from request header or current session.
-        
-        Method 1: X-Device-Fingerprint header (if matches a device)
-        Method 2: Current session's fingerprint (from authentication)
-        Method 3: Most recent active session's fingerprint (fallback)
-        """
-        request = self.context.get('request')
-        if not request or not request.user.is_authenticated:
+        """Check if this device is the current device (see resolve_current_device)"""
+        current = self._current_device()
+        if current is None:
             return False
-        
-        # Method 1: Check X-Device-Fingerprint header
-        header_fingerprint = request.META.get('HTTP_X_DEVICE_FINGERPRINT')
-        if header_fingerprint and header_fingerprint == obj.fingerprint_hash:
-            return True
-        
-        # Method 2: Check current session (set by SessionValidatedJWTAuthentication)
-        current_session = getattr(request, 'current_session', None)
-        if current_session and current_session.fingerprint_hash == obj.fingerprint_hash:
-            return True
-        
-        # Method 3: If no header and no current_session, 
-        # fall back to most recent active session
-        if not header_fingerprint and not current_session:
-            try:
-                most_recent_session = Session.objects.filter(
-                    user=request.user,
-                    is_active=True
-                ).order_by('-last_activity').first()
-                
-                if most_recent_session:
-                    return obj.fingerprint_hash == most_recent_session.fingerprint_hash
-            except Exception:
-                pass
-        
-        # Method 4: If header provided but doesn't match any device, 
-        # fall back to session-based detection
-        if header_fingerprint:
-            try:
-                header_matches_any_device = Device.objects.filter(
-                    user=request.user,
-                    fingerprint_hash=header_fingerprint,
-                    is_deleted=False
-                ).exists()
-            except Exception:
-                header_matches_any_device = False
-            
-            if not header_matches_any_device:
-                try:
-                    session = current_session or Session.objects.filter(
-                        user=request.user,
-                        is_active=True
-                    ).order_by('-last_activity').first()
-                except Exception:
-                    session = None
-                
-                if session:
-                    return obj.fingerprint_hash == session.fingerprint_hash
-        
-        return False
+        return obj.fingerprint_hash in current['fingerprints']
 
     def get_trust_status(self, obj):
         """
@@ -270,6 +289,7 @@ class DeviceVerificationSerializer(serializers.Serializer):
         # Verify OTP code
         if otp.code_hash != hash_otp(otp_code):
             otp.increment_attempts()
+            DeviceRiskEngine.record_failed_otp(user.id)
             remaining = otp.max_attempts - otp.attempts
             raise serializers.ValidationError({
                 "error": f"Invalid OTP code. {remaining} attempts remaining."
@@ -306,66 +326,36 @@ class DeviceVerificationSerializer(serializers.Serializer):
         # Get location data from IP
         location_data = get_location_from_ip(ip_address)
         
-        # Check if device exists (including soft-deleted ones)
-        try:
-            device = Device.objects.get(
-                user=user,
-                fingerprint_hash=device_data['fingerprint_hash']
-            )
-            # If found, restore if soft-deleted and update
-            if device.is_deleted:
-                device.restore()
-            
-            # Update device fields
-            device.device_name = device_data.get('device_name', '')
-            device.device_type = device_data.get('device_type', 'unknown')
-            device.browser = device_data.get('browser', '')
-            device.os = device_data.get('os', '')
-            device.ip_address = location_data['ip']
-            device.country = location_data['country']
-            device.city = location_data['city']
-            device.latitude = location_data['latitude']
-            device.longitude = location_data['longitude']
-            device.is_verified = True
-            device.verified_at = timezone.now()
-            device.save()
-            created = False
-            
-        except Device.DoesNotExist:
-            # Create new device
-            device = Device.objects.create(
-                user=user,
-                fingerprint_hash=device_data['fingerprint_hash'],
-                device_name=device_data.get('device_name', ''),
-                device_type=device_data.get('device_type', 'unknown'),
-                browser=device_data.get('browser', ''),
-                os=device_data.get('os', ''),
-                ip_address=location_data['ip'],
-                country=location_data['country'],
-                city=location_data['city'],
-                latitude=location_data['latitude'],
-                longitude=location_data['longitude'],
-                is_verified=True,
-                verified_at=timezone.now(),
-                is_deleted=False
+        ConcurrentSessionLimiter.enforce(user, location_data['ip'])
+        
+        # Register the device, or restore / refresh it (including soft-deleted
+        # ones), and count the login in one statement
+        now = timezone.now()
+        values = {
+            'device_name': device_data.get('device_name', ''),
+            'device_type': device_data.get('device_type', 'unknown'),
+            'browser': device_data.get('browser', ''),
+            'os': device_data.get('os', ''),
+            'ip_address': location_data['ip'],
+            'country': location_data['country'],
+            'city': location_data['city'],
+            'latitude': location_data['latitude'],
+            'longitude': location_data['longitude'],
+            'is_verified': True,
+            'verified_at': now,
+            'is_deleted': False,
+            'deleted_at': None,
+        }
+        if trust_device:
+            values.update(
+                is_trusted=True,
+                trust_expires_at=now + timezone.timedelta(days=trust_days),
+                can_skip_mfa=True,
             )
-            created = True
+            values['mfa_skip_until'] = values['trust_expires_at']
         
-        # Refresh from DB to ensure we have the latest state
-        device.refresh_from_db()
-        
-        # Update device trust and login count
-        device.total_logins += 1
-        
-        if trust_device:
-            # Mark as trusted and update login count in single operation
-            device.is_trusted = True
-            device.trust_expires_at = timezone.now() + timezone.timedelta(days=trust_days)
-            device.can_skip_mfa = True
-            device.mfa_skip_until = device.trust_expires_at
-            device.save(update_fields=['is_trusted', 'trust_expires_at', 'can_skip_mfa', 'mfa_skip_until', 'total_logins'])
-        else:
-            device.save(update_fields=['total_logins'])
+        device, created = upsert_device(user, device_data['fingerprint_hash'], values, list(values))
+        DeviceRiskEngine.record_verified(device, location_data)
         
         # Update user login info
         user.last_login_ip = location_data['ip']
@@ -388,7 +378,7 @@ class DeviceVerificationSerializer(serializers.Serializer):
         request = self.context.get('request')
         user_agent = request.META.get('HTTP_USER_AGENT', '') if request else ''
         
-        Session.objects.create(
+        session = Session.objects.create(
             user=user,
             token_jti=str(refresh.access_token.payload.get('jti')),
             fingerprint_hash=device.fingerprint_hash,
@@ -400,8 +390,12 @@ class DeviceVerificationSerializer(serializers.Serializer):
             os=device.os,
             country=location_data['country'],
             city=location_data['city'],
+            latitude=location_data['latitude'],
+            longitude=location_data['longitude'],
             expires_at=timezone.now() + timezone.timedelta(days=7)
         )
+        ConcurrentSessionLimiter.track(session)
+        ImpossibleTravelDetector.check_session(session)
         
         return {
             'status': 'success',
@@ -2,13 +2,18 @@
 Devices Signals - Send notifications for device-related events
 """
 
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from .cache import DECISION_FIELDS, DeviceDecisionCache
 from .models import Device
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Sent after trust is dropped with a queryset UPDATE (no post_save fires).
+# kwargs: device_ids, user_ids, reason ('expired' / 'admin_revoked' / 'compromised')
+device_trust_changed = Signal()
+
 
 @receiver(post_save, sender=Device)
 def notify_new_device_login(sender, instance, created, **kwargs):
@@ -17,7 +22,7 @@ def notify_new_device_login(sender, instance, created, **kwargs):
         from notification.utils import notify_new_device_login
         try:
             notify_new_device_login(instance.user, instance)
-            logger.info(f"New device login notification sent to {instance.user.email}")
+            logger.info(f"New device login notification queued for {instance.user.email}")
         except Exception as e:
             logger.error(f"Failed to send new device notification: {e}")
 
@@ -31,8 +36,38 @@ def notify_device_verified(sender, instance, created, **kwargs):
             from notification.utils import notify_device_verified
             try:
                 notify_device_verified(instance.user, instance)
-                logger.info(f"Device verified notification sent to {instance.user.email}")
+                logger.info(f"Device verified notification queued for {instance.user.email}")
                 # Mark as notified to prevent duplicate notifications
                 instance._verification_notified = True
             except Exception as e:
                 logger.error(f"Failed to send device verified notification: {e}")
+
+
+@receiver(pre_save, sender=Device)
+def remember_cached_fingerprint(sender, instance, update_fields=None, **kwargs):
+    """Note the stored fingerprint when a save may change it (its entry goes too)"""
+    if instance._state.adding or (update_fields is not None and 'fingerprint_hash' not in update_fields):
+        return
+    instance._previous_fingerprint_hash = (
+        Device.objects.filter(pk=instance.pk).values_list('fingerprint_hash', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Device)
+def invalidate_device_decision(sender, instance, created, update_fields=None, **kwargs):
+    """Drop the cached login decision when a decision field was written"""
+    if created or update_fields is None or DECISION_FIELDS.intersection(update_fields):
+        DeviceDecisionCache.invalidate(instance.user_id, instance.fingerprint_hash)
+    previous = instance.__dict__.pop('_previous_fingerprint_hash', None)
+    if previous and previous != instance.fingerprint_hash:
+        DeviceDecisionCache.invalidate(instance.user_id, previous)
+
+
+@receiver(post_delete, sender=Device)
+def invalidate_deleted_device_decision(sender, instance, **kwargs):
+    DeviceDecisionCache.invalidate(instance.user_id, instance.fingerprint_hash)
+
+
+@receiver(device_trust_changed)
+def invalidate_bulk_trust_change(sender, device_ids, **kwargs):
+    DeviceDecisionCache.invalidate_devices(device_ids)
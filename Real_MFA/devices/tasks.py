@@ -0,0 +1,120 @@
+"""Celery tasks for device risk scoring, trust expiry, session archival and session limits."""
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .archive import archive_sessions
+from .limits import ConcurrentSessionLimiter
+from .models import Device, TrustedDevice
+from .risk import DeviceRiskEngine
+from .signals import device_trust_changed
+
+
+@shared_task(bind=True)
+def flush_device_risk_scores(self):
+    """Write buffered risk scores to the devices table in one batch"""
+    return {'flushed': DeviceRiskEngine.flush()}
+
+
+def _expire_device_batch(now, batch_size):
+    """
+    Drop trust on one batch of expired devices.
+    One SELECT on the partial expiry index, one UPDATE, one audit bulk insert.
+    """
+    from audits_logs.models import DeviceAuditLog
+
+    with transaction.atomic():
+        devices = list(
+            Device.objects.select_for_update(skip_locked=True)
+            .filter(is_trusted=True, trust_expires_at__lte=now)
+            .order_by('trust_expires_at')
+            .only('id', 'user_id', 'fingerprint_hash', 'device_name', 'device_type', 'browser', 'os',
+                  'ip_address', 'last_ip', 'country', 'city', 'trust_expires_at')[:batch_size]
+        )
+        if not devices:
+            return 0
+
+        device_ids = [device.id for device in devices]
+        Device.objects.filter(pk__in=device_ids).update(
+            is_trusted=False,
+            can_skip_mfa=False,
+            trust_expires_at=None,
+            mfa_skip_until=None,
+        )
+        TrustedDevice.objects.filter(device_id__in=device_ids, is_trusted=True).update(
+            is_trusted=False,
+            revoked_at=now,
+            revocation_reason='expired',
+        )
+
+        DeviceAuditLog.objects.bulk_create([
+            DeviceAuditLog(
+                user_id=device.user_id,
+                device_id=device.id,
+                action='device_trust_expired',
+                description=f"Device trust expired at {device.trust_expires_at.isoformat()}",
+                ip_address=device.last_ip or device.ip_address,
+                device_fingerprint=device.fingerprint_hash,
+                device_name=device.device_name,
+                device_type=device.device_type,
+                browser=device.browser,
+                os=device.os,
+                country=device.country,
+                city=device.city,
+                was_trusted=True,
+                now_trusted=False,
+                metadata={'trust_expires_at': device.trust_expires_at.isoformat(), 'source': 'expiry_sweep'},
+            )
+            for device in devices
+        ])
+
+        user_ids = list({device.user_id for device in devices})
+        transaction.on_commit(lambda: device_trust_changed.send(
+            sender=Device, device_ids=device_ids, user_ids=user_ids, reason='expired'
+        ))
+    return len(devices)
+
+
+@shared_task(bind=True)
+def expire_device_trust(self):
+    """
+    Flip expired device trust in bulk and sync TrustedDevice records.
+
+    Devices are processed in batches until none are due; TrustedDevice rows
+    whose own expires_at passed (without a matching device) are closed in a
+    single UPDATE on their partial expiry index.
+    """
+    now = timezone.now()
+    batch_size = getattr(settings, 'DEVICE_TRUST_EXPIRY_BATCH_SIZE', 1000)
+
+    devices_expired = 0
+    while True:
+        expired = _expire_device_batch(now, batch_size)
+        devices_expired += expired
+        if expired < batch_size:
+            break
+
+    trust_records_expired = TrustedDevice.objects.filter(is_trusted=True, expires_at__lte=now).update(
+        is_trusted=False,
+        revoked_at=now,
+        revocation_reason='expired',
+    )
+
+    return {
+        'devices_expired': devices_expired,
+        'trust_records_expired': trust_records_expired,
+    }
+
+
+@shared_task(bind=True)
+def archive_inactive_sessions(self):
+    """Move sessions inactive past SESSION_ARCHIVE_AFTER_DAYS to sessions_archive"""
+    return {'archived': archive_sessions()}
+
+
+@shared_task(bind=True)
+def reconcile_active_sessions(self):
+    """Rebuild the per-user active-session sets from the sessions table"""
+    return ConcurrentSessionLimiter.reconcile()
@@ -1,3 +1,670 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+import base64
+import json
+import unittest
+import uuid
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin import site
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from accounts.models import User
+from audits_logs.models import DeviceAuditLog
+from . import risk, travel
+from .archive import archive_sessions, session_history
+from .cache import DeviceDecisionCache
+from .limits import ConcurrentSessionLimiter
+from .models import ArchivedSession, Device, Session, TrustedDevice
+from .risk import DeviceRiskEngine, new_profile, score_event
+from .signals import device_trust_changed
+from .tasks import expire_device_trust
+from .travel import ImpossibleTravelDetector, haversine_km, haversine_km_array
+from .upsert import upsert_device
+
+try:
+    import fakeredis
+except ImportError:  # pragma: no cover
+    fakeredis = None
+
+# Redis stand-in for the cache-backed KV store
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class DeviceIndexTests(TestCase):
+    def _indexed_columns(self, table):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        return [
+            info['columns'] for info in constraints.values()
+            if info['index'] and not info['primary_key'] and not info['unique']
+        ]
+
+    def test_last_used_at_has_no_standalone_index(self):
+        # Covered by devices_user_recent_idx (user, is_deleted, -last_used_at, id)
+        self.assertNotIn(['last_used_at'], self._indexed_columns(Device._meta.db_table))
+
+    def test_fingerprint_lookup_uses_the_unique_constraint(self):
+        self.assertNotIn(['fingerprint_hash'], self._indexed_columns(Device._meta.db_table))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ConcurrentSessionLimitTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='bob', email='bob@example.com', email_verified=True)
+        now = timezone.now()
+        self.sessions = [
+            Session.objects.create(
+                user=self.user,
+                token_jti=uuid.uuid4().hex,
+                ip_address='10.0.0.1',
+                expires_at=now + timedelta(days=1, minutes=minute),
+            )
+            for minute in range(12)
+        ]
+
+    def _active(self):
+        return Session.objects.filter(user=self.user, is_active=True).count()
+
+    def test_limit_is_disabled_by_default(self):
+        self.assertEqual(settings.MAX_CONCURRENT_SESSIONS, 0)
+        self.assertTrue(ConcurrentSessionLimiter.admit(self.user))
+        self.assertEqual(self._active(), 12)
+
+    @override_settings(MAX_CONCURRENT_SESSIONS=10, MAX_CONCURRENT_SESSIONS_POLICY='evict_oldest')
+    def test_evict_oldest_makes_room_for_one_session(self):
+        self.assertTrue(ConcurrentSessionLimiter.admit(self.user))
+        self.assertEqual(self._active(), 9)
+        evicted = Session.objects.filter(user=self.user, is_active=False).order_by('expires_at')
+        self.assertEqual(list(evicted), self.sessions[:3])
+        self.assertEqual({session.revoked_reason for session in evicted}, {'session_limit'})
+
+    @override_settings(MAX_CONCURRENT_SESSIONS=10, MAX_CONCURRENT_SESSIONS_POLICY='reject')
+    def test_reject_policy_refuses_the_login(self):
+        with self.assertRaises(ValidationError):
+            ConcurrentSessionLimiter.enforce(self.user)
+        self.assertEqual(self._active(), 12)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SessionListPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='erin', email='erin@example.com', email_verified=True)
+        Session.objects.bulk_create([
+            Session(
+                user=self.user,
+                token_jti=uuid.uuid4().hex,
+                ip_address='10.0.0.1',
+                expires_at=timezone.now() + timedelta(days=1),
+            )
+            for _ in range(120)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _get(self, **params):
+        return self.client.get('/api/devices/sessions/', params)
+
+    def test_unpaginated_by_default(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 120)
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_pages_cover_every_session_once(self):
+        seen = []
+        response = self._get(page_size=50)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(session['id'] for session in response.data['sessions'])
+            if not response.data['next_cursor']:
+                break
+            response = self._get(page_size=50, cursor=response.data['next_cursor'])
+        self.assertEqual(len(seen), 120)
+        self.assertEqual(len(set(seen)), 120)
+
+    def test_tampered_cursor_is_rejected(self):
+        cursor = self._get(page_size=10).data['next_cursor']
+        position = json.loads(base64.urlsafe_b64decode(cursor))
+        position['id'] = 'not-a-uuid'
+        tampered = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+        for bad in (tampered, 'garbage', base64.urlsafe_b64encode(b'[1, 2]').decode()):
+            response = self._get(cursor=bad)
+            self.assertEqual(response.status_code, 400, bad)
+            self.assertIn('cursor', response.data)
+
+
+class ScoreEventTests(TestCase):
+    now = 1_700_000_000
+
+    def _score(self, profile, prior=0, prior_ts=None, device_id='d1', **event):
+        return score_event(profile, device_id, prior, prior_ts, self.now, **event)
+
+    def test_first_login_sets_the_baseline(self):
+        profile = new_profile()
+        self.assertEqual(self._score(profile, ip='10.0.0.1', asn='AS1', country='FR'), 0)
+        self.assertEqual(profile['ips'], ['10.0.0.1'])
+        self.assertEqual(profile['last_country'], 'FR')
+
+    def test_novelty_adds_its_weights(self):
+        profile = new_profile()
+        self._score(profile, ip='10.0.0.1', asn='AS1', country='FR')
+        score = self._score(profile, ip='10.0.0.2', asn='AS2', country='DE')
+        self.assertEqual(score, risk.WEIGHT_NEW_IP + risk.WEIGHT_NEW_ASN + risk.WEIGHT_NEW_COUNTRY)
+        # Back to a known country is a change, not a new country
+        score = self._score(profile, prior=0, ip='10.0.0.2', asn='AS2', country='FR')
+        self.assertEqual(score, risk.WEIGHT_COUNTRY_CHANGE)
+
+    def test_dormant_device(self):
+        profile = new_profile()
+        score = self._score(profile, last_used_ts=self.now - 91 * 86400)
+        self.assertEqual(score, risk.WEIGHT_DORMANT_90_DAYS)
+        self.assertEqual(profile['devices']['d1'], self.now)
+
+    @override_settings(DEVICE_RISK_HALF_LIFE_HOURS=1)
+    def test_score_decays_and_verification_credits(self):
+        self.assertEqual(self._score(new_profile(), prior=40, prior_ts=self.now - 3600), 20)
+        profile = new_profile()
+        profile.update(failed_otp=2.0, failed_otp_ts=self.now)
+        self.assertEqual(self._score(profile, prior=30, prior_ts=self.now, verified=True),
+                         30 + 2 * risk.WEIGHT_FAILED_OTP - risk.CREDIT_VERIFIED)
+        self.assertEqual(profile['failed_otp'], 0.0)
+        self.assertEqual(self._score(new_profile(), prior=5, prior_ts=self.now, verified=True), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, DEVICE_RISK_COMPROMISE_THRESHOLD=20)
+class DeviceRiskEngineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='rita', email='rita@example.com', email_verified=True)
+        self.device = Device.objects.create(
+            user=self.user, fingerprint_hash='risk-fp', ip_address='10.0.0.1',
+            is_verified=True, is_trusted=True, can_skip_mfa=True,
+        )
+
+    def _login_from(self, country):
+        return DeviceRiskEngine.record_login(self.device, {'ip': f'10.0.{len(country)}.1', 'country': country})
+
+    def _audits(self):
+        return DeviceAuditLog.objects.filter(device_id=self.device.id, action='device_compromise_suspected')
+
+    def test_direct_write_flags_the_device_once(self):
+        self._login_from('FR')
+        with self.captureOnCommitCallbacks(execute=True):
+            score = self._login_from('Germany')
+        self.assertGreaterEqual(score, 20)
+
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.risk_score, score)
+        self.assertTrue(self.device.is_compromised)
+        self.assertFalse(self.device.is_trusted)
+        self.assertFalse(self.device.can_skip_mfa)
+        [audit] = self._audits()
+        self.assertTrue(audit.was_trusted)
+        self.assertFalse(audit.now_trusted)
+        self.assertEqual(audit.metadata['source'], 'risk_engine')
+
+        self._login_from('Spain')
+        self.assertEqual(self._audits().count(), 1)
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_flush_keeps_the_queue_until_the_write_commits(self):
+        with mock.patch('devices.risk.redis_client', fakeredis.FakeStrictRedis(decode_responses=True)) as kv:
+            self._login_from('FR')
+            score = self._login_from('Germany')
+            self.assertEqual(kv.llen(risk.DIRTY_QUEUE_KEY), 2)
+            self.device.refresh_from_db()
+            self.assertFalse(self.device.is_compromised)
+
+            with mock.patch.object(Device.objects, 'bulk_update', side_effect=DatabaseError('down')):
+                with self.assertRaises(DatabaseError):
+                    DeviceRiskEngine.flush()
+            self.assertEqual(kv.llen(risk.DIRTY_QUEUE_KEY), 2)
+            self.assertFalse(kv.exists(risk.FLUSH_LOCK_KEY))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(DeviceRiskEngine.flush(), 1)
+            self.assertEqual(kv.llen(risk.DIRTY_QUEUE_KEY), 0)
+
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.risk_score, score)
+        self.assertTrue(self.device.is_compromised)
+        self.assertFalse(self.device.is_trusted)
+        self.assertEqual(self._audits().count(), 1)
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_flush_skips_while_another_run_holds_the_lock(self):
+        with mock.patch('devices.risk.redis_client', fakeredis.FakeStrictRedis(decode_responses=True)) as kv:
+            self._login_from('FR')
+            kv.set(risk.FLUSH_LOCK_KEY, 'other-worker')
+            self.assertEqual(DeviceRiskEngine.flush(), 0)
+            self.assertEqual(kv.llen(risk.DIRTY_QUEUE_KEY), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, DEVICE_RISK_COMPROMISE_THRESHOLD=20)
+class RescoreDevicesCommandTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='ravi', email='ravi@example.com', email_verified=True)
+        self.device = Device.objects.create(
+            user=self.user, fingerprint_hash='rescore-fp', ip_address='10.0.0.1', is_trusted=True,
+        )
+        now = timezone.now()
+        for minutes, ip_address, country in ((10, '10.0.0.1', 'FR'), (5, '10.9.0.1', 'Germany')):
+            session = Session.objects.create(
+                user=self.user, token_jti=uuid.uuid4().hex,
+                fingerprint_hash='rescore-fp', ip_address=ip_address, country=country,
+                expires_at=now + timedelta(days=1),
+            )
+            Session.objects.filter(pk=session.pk).update(created_at=now - timedelta(minutes=minutes))
+
+    def _run(self, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rescore_devices', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_writes_nothing(self):
+        output = self._run('--dry-run')
+        self.assertIn('[dry run] Re-scored 1 devices; 1 at or above', output)
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.risk_score, 0)
+        self.assertFalse(self.device.is_compromised)
+
+    def test_replayed_history_scores_and_flags_the_device(self):
+        self._run()
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.risk_score, risk.WEIGHT_NEW_IP + risk.WEIGHT_NEW_COUNTRY)
+        self.assertTrue(self.device.is_compromised)
+        self.assertFalse(self.device.is_trusted)
+        [audit] = DeviceAuditLog.objects.filter(device_id=self.device.id, action='device_compromise_suspected')
+        self.assertEqual(audit.metadata['source'], 'rescore_devices')
+
+        # A second run finds the device already flagged
+        self._run()
+        self.assertEqual(DeviceAuditLog.objects.filter(device_id=self.device.id).count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class UpsertDeviceTests(TestCase):
+    single_statement = True
+
+    def setUp(self):
+        self.user = User.objects.create(username='uma', email='uma@example.com', email_verified=True)
+        if not self.single_statement:
+            patcher = mock.patch('devices.upsert._supports_single_statement', return_value=False)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _upsert(self, **values):
+        values = {'ip_address': '10.0.0.1', 'is_verified': True, 'is_deleted': False, 'deleted_at': None, **values}
+        return upsert_device(self.user, 'upsert-fp', values, list(values))
+
+    def test_creates_the_device(self):
+        device, created = self._upsert(country='FR')
+        self.assertTrue(created)
+        self.assertEqual(device.total_logins, 1)
+        self.assertEqual(Device.objects.get(pk=device.pk).country, 'FR')
+
+    def test_updates_the_existing_row(self):
+        first, _ = self._upsert(country='FR', browser='Firefox')
+        device, created = self._upsert(country='DE', ip_address='10.0.0.2')
+        self.assertFalse(created)
+        self.assertEqual(device.pk, first.pk)
+        self.assertEqual(device.created_at, first.created_at)
+
+        stored = Device.objects.get(pk=first.pk)
+        self.assertEqual(stored.total_logins, 2)
+        self.assertEqual((stored.country, stored.ip_address), ('DE', '10.0.0.2'))
+        self.assertEqual(stored.browser, 'Firefox')  # not among this call's update fields
+
+    def test_restores_a_soft_deleted_device(self):
+        first, _ = self._upsert()
+        Device.objects.filter(pk=first.pk).update(is_deleted=True, deleted_at=timezone.now())
+        device, created = self._upsert()
+        self.assertFalse(created)
+        stored = Device.objects.get(pk=first.pk)
+        self.assertFalse(stored.is_deleted)
+        self.assertIsNone(stored.deleted_at)
+        self.assertEqual(Device.objects.filter(user=self.user).count(), 1)
+
+
+class UpsertDeviceFallbackTests(UpsertDeviceTests):
+    """UPDATE-then-INSERT path used by backends without ON CONFLICT ... RETURNING"""
+    single_statement = False
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class DeviceDecisionCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='cara', email='cara@example.com', email_verified=True)
+        self.device = Device.objects.create(
+            user=self.user, fingerprint_hash='cache-fp', ip_address='10.0.0.1', is_verified=True,
+            is_trusted=True, trust_expires_at=timezone.now() + timedelta(days=1),
+        )
+
+    def _get(self, fingerprint_hash='cache-fp'):
+        return DeviceDecisionCache.get(self.user.id, fingerprint_hash)
+
+    def _assert_cached(self, fingerprint_hash='cache-fp'):
+        """Load the entry, then check the next lookup is served from the cache"""
+        self._get(fingerprint_hash)
+        with self.assertNumQueries(0):
+            return self._get(fingerprint_hash)
+
+    def _assert_reloaded(self, fingerprint_hash='cache-fp'):
+        with self.assertNumQueries(1):
+            return self._get(fingerprint_hash)
+
+    def test_hit_returns_the_cached_device(self):
+        cached = self._assert_cached()
+        self.assertEqual(cached.pk, self.device.pk)
+        self.assertTrue(cached.is_trusted)
+        self.assertEqual(cached.trust_expires_at, self.device.trust_expires_at)
+
+    def test_unknown_fingerprint_is_cached_until_the_device_exists(self):
+        self.assertIsNone(self._assert_cached('new-fp'))
+        with self.captureOnCommitCallbacks(execute=True):
+            device = Device.objects.create(user=self.user, fingerprint_hash='new-fp', ip_address='10.0.0.1')
+        self.assertEqual(self._assert_reloaded('new-fp').pk, device.pk)
+
+    def test_trust_expiry_invalidates(self):
+        self._assert_cached()
+        Device.objects.filter(pk=self.device.pk).update(trust_expires_at=timezone.now() - timedelta(minutes=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(expire_device_trust()['devices_expired'], 1)
+        self.assertFalse(self._assert_reloaded().is_trusted)
+
+    def test_compromise_invalidates(self):
+        self._assert_cached()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.mark_compromised()
+        self.assertTrue(self._assert_reloaded().is_compromised)
+
+    def test_delete_invalidates(self):
+        self._assert_cached()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.soft_delete()
+        self.assertIsNone(self._assert_reloaded())
+
+        self._assert_cached()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.delete()
+        self.assertIsNone(self._assert_reloaded())
+
+    def test_fingerprint_change_invalidates_both_fingerprints(self):
+        self._assert_cached()
+        self.assertIsNone(self._assert_cached('renamed-fp'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.fingerprint_hash = 'renamed-fp'
+            self.device.save(update_fields=['fingerprint_hash'])
+        self.assertIsNone(self._assert_reloaded())
+        self.assertEqual(self._assert_reloaded('renamed-fp').pk, self.device.pk)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SessionRevocationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='sven', email='sven@example.com', email_verified=True)
+
+    def _sessions(self, count, user=None):
+        user = user or self.user
+        return [
+            Session.objects.create(
+                user=user, token_jti=RefreshToken.for_user(user)['jti'], ip_address='10.0.0.1',
+                expires_at=timezone.now() + timedelta(days=7),
+            )
+            for _ in range(count)
+        ]
+
+    def _blacklisted_jtis(self):
+        return set(BlacklistedToken.objects.values_list('token__jti', flat=True))
+
+    def test_revoke_all_blacklists_every_outstanding_token(self):
+        current, *others = self._sessions(4)
+        other_user = User.objects.create(username='tess', email='tess@example.com', email_verified=True)
+        [unrelated] = self._sessions(1, user=other_user)
+        # Already revoked on its own: the bulk insert must skip its blacklist row
+        others[0].revoke()
+
+        revoked = Session.revoke_all_for_user(self.user, reason='password_changed', exclude_session_id=current.id)
+
+        self.assertEqual(revoked, 2)
+        self.assertEqual(self._blacklisted_jtis(), {session.token_jti for session in others})
+        self.assertEqual(
+            set(Session.objects.filter(revoked_reason='password_changed').values_list('id', flat=True)),
+            {session.id for session in others[1:]},
+        )
+        current.refresh_from_db()
+        unrelated.refresh_from_db()
+        self.assertTrue(current.is_active)
+        self.assertTrue(unrelated.is_active)
+
+    def test_second_revoke_is_a_no_op(self):
+        self._sessions(3)
+        self.assertEqual(Session.revoke_all_for_user(self.user), 3)
+        blacklisted = self._blacklisted_jtis()
+        self.assertEqual(Session.revoke_all_for_user(self.user), 0)
+        self.assertEqual(self._blacklisted_jtis(), blacklisted)
+        self.assertEqual(BlacklistedToken.objects.count(), 3)
+
+    def test_query_count_does_not_grow_with_the_sessions(self):
+        other_user = User.objects.create(username='ulf', email='ulf@example.com', email_verified=True)
+        self._sessions(2)
+        self._sessions(8, user=other_user)
+
+        with self.assertNumQueries(5) as few:
+            Session.revoke_all_for_user(self.user)
+        with self.assertNumQueries(len(few.captured_queries)):
+            Session.revoke_all_for_user(other_user)
+
+    def test_admin_action_revokes_the_selection(self):
+        sessions = self._sessions(3)
+        admin = site._registry[Session]
+        with mock.patch.object(admin, 'message_user') as message_user:
+            admin.revoke_sessions(None, Session.objects.filter(pk__in=[s.pk for s in sessions[:2]]))
+
+        message_user.assert_called_once_with(None, '2 session(s) revoked.')
+        self.assertEqual(self._blacklisted_jtis(), {session.token_jti for session in sessions[:2]})
+        self.assertEqual(Session.objects.filter(revoked_reason='admin_revoked').count(), 2)
+        self.assertTrue(Session.objects.get(pk=sessions[2].pk).is_active)
+
+
+PARIS = (48.8566, 2.3522)
+LONDON = (51.5074, -0.1278)  # ~344 km from Paris
+NEW_YORK = (40.7128, -74.0060)
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE, IMPOSSIBLE_TRAVEL_MAX_SPEED_KMH=1000, IMPOSSIBLE_TRAVEL_MIN_DISTANCE_KM=500,
+)
+class ImpossibleTravelTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='tara', email='tara@example.com', email_verified=True)
+        self.device = Device.objects.create(user=self.user, fingerprint_hash='travel-fp', ip_address='10.0.0.1')
+        self.start = timezone.now() - timedelta(days=1)
+
+    def _login(self, minutes, point, user=None, fingerprint_hash='travel-fp'):
+        latitude, longitude = point or (None, None)
+        session = Session.objects.create(
+            user=user or self.user, token_jti=uuid.uuid4().hex, fingerprint_hash=fingerprint_hash,
+            ip_address='10.0.0.1', latitude=latitude, longitude=longitude,
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+        Session.objects.filter(pk=session.pk).update(created_at=self.start + timedelta(minutes=minutes))
+        session.refresh_from_db()
+        return session
+
+    def _anomalies(self):
+        return DeviceAuditLog.objects.filter(action='device_location_anomaly')
+
+    def test_vectorized_distance_matches_the_scalar_one(self):
+        if not travel.is_available():
+            self.skipTest('numpy is not installed')
+        import numpy as np
+        pairs = [(PARIS, LONDON), (PARIS, NEW_YORK), (LONDON, LONDON), ((0.0, 179.9), (0.0, -179.9))]
+        vectorized = haversine_km_array(*(np.array(values) for values in zip(*(a + b for a, b in pairs))))
+        for (a, b), distance in zip(pairs, vectorized):
+            self.assertAlmostEqual(distance, haversine_km(*a, *b), places=6)
+        self.assertAlmostEqual(vectorized[0], 344, delta=2)
+        self.assertEqual(vectorized[2], 0)
+
+    def test_scan_applies_both_thresholds(self):
+        if not travel.is_available():
+            self.skipTest('numpy is not installed')
+        self._login(0, PARIS)
+        self._login(30, LONDON)         # fast but under the minimum distance
+        self._login(60, NEW_YORK)       # ~5570 km in 30 min: flagged
+        self._login(60 * 12, PARIS)     # ~5840 km in 11 h: under the speed limit
+        self._login(60 * 13, None)      # no coordinates: not a point at all
+        other = User.objects.create(username='uwe', email='uwe@example.com', email_verified=True)
+        Device.objects.create(user=other, fingerprint_hash='travel-fp', ip_address='10.0.0.1')
+        self._login(60 * 12 + 1, NEW_YORK, user=other)  # never paired with another user's login
+
+        self.assertEqual(ImpossibleTravelDetector.scan(chunk_size=2), {'scanned': 5, 'flagged': 1})
+        [anomaly] = self._anomalies()
+        self.assertGreater(anomaly.metadata['speed_kmh'], 1000)
+        self.assertEqual(anomaly.metadata['detected_by'], 'batch')
+
+        # Already flagged sessions are skipped on a rescan
+        self.assertEqual(ImpossibleTravelDetector.scan()['flagged'], 0)
+
+    def test_check_session_compares_with_the_previous_point(self):
+        self._login(0, PARIS)
+        self.assertEqual(ImpossibleTravelDetector.check_session(self._login(10, None)), 0)
+        self.assertEqual(ImpossibleTravelDetector.check_session(self._login(20, NEW_YORK)), 1)
+        self.assertEqual(self._anomalies().get().metadata['detected_by'], 'login')
+
+    def test_anomaly_without_a_device_is_logged(self):
+        self._login(0, PARIS, fingerprint_hash='gone-fp')
+        with self.assertLogs('devices.travel', 'WARNING') as logs:
+            flagged = ImpossibleTravelDetector.check_session(self._login(20, NEW_YORK, fingerprint_hash='gone-fp'))
+        self.assertEqual(flagged, 0)
+        self.assertFalse(self._anomalies().exists())
+        self.assertIn('no device row', logs.output[0])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, DEVICE_TRUST_EXPIRY_BATCH_SIZE=1)
+class DeviceTrustExpiryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='vera', email='vera@example.com', email_verified=True)
+        now = timezone.now()
+        self.expired = [self._trusted(f'expired-{n}', now - timedelta(hours=n + 1)) for n in range(2)]
+        self.current = self._trusted('current', now + timedelta(days=1))
+        self.signals = []
+        device_trust_changed.connect(self._on_trust_changed)
+        self.addCleanup(device_trust_changed.disconnect, self._on_trust_changed)
+
+    def _on_trust_changed(self, sender, **kwargs):
+        self.signals.append(kwargs)
+
+    def _trusted(self, fingerprint_hash, expires_at):
+        device = Device.objects.create(
+            user=self.user, fingerprint_hash=fingerprint_hash, ip_address='10.0.0.1', last_ip='10.0.0.2',
+            is_verified=True, is_trusted=True, can_skip_mfa=True,
+            trust_expires_at=expires_at, mfa_skip_until=expires_at,
+        )
+        TrustedDevice.objects.create(user=self.user, device=device, expires_at=expires_at + timedelta(days=1))
+        return device
+
+    def _expire(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return expire_device_trust()
+
+    def test_expired_trust_is_flipped_audited_and_signalled_once(self):
+        self.assertEqual(self._expire(), {'devices_expired': 2, 'trust_records_expired': 0})
+
+        for device in self.expired:
+            device.refresh_from_db()
+            self.assertFalse(device.is_trusted)
+            self.assertFalse(device.can_skip_mfa)
+            self.assertIsNone(device.trust_expires_at)
+            self.assertIsNone(device.mfa_skip_until)
+            record = device.trust_records.get()
+            self.assertFalse(record.is_trusted)
+            self.assertEqual(record.revocation_reason, 'expired')
+        self.current.refresh_from_db()
+        self.assertTrue(self.current.is_trusted)
+        self.assertTrue(self.current.trust_records.get().is_trusted)
+
+        audits = DeviceAuditLog.objects.filter(action='device_trust_expired')
+        self.assertEqual(sorted(audits.values_list('device_id', flat=True)), sorted(d.id for d in self.expired))
+        self.assertEqual({audit.ip_address for audit in audits}, {'10.0.0.2'})
+        self.assertTrue(all(audit.was_trusted and not audit.now_trusted for audit in audits))
+
+        # One signal per batch (batch size 1), each naming its device
+        self.assertEqual(sorted(pk for signal in self.signals for pk in signal['device_ids']),
+                         sorted(d.id for d in self.expired))
+        self.assertEqual({signal['reason'] for signal in self.signals}, {'expired'})
+
+        # Nothing left to expire: no second audit row or signal
+        self.assertEqual(self._expire()['devices_expired'], 0)
+        self.assertEqual(audits.count(), 2)
+        self.assertEqual(len(self.signals), 2)
+
+    def test_trust_records_past_their_own_expiry_are_closed(self):
+        TrustedDevice.objects.filter(device=self.current).update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self._expire(), {'devices_expired': 2, 'trust_records_expired': 1})
+        self.assertFalse(self.current.trust_records.get().is_trusted)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, SESSION_ARCHIVE_AFTER_DAYS=30)
+class SessionArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='wade', email='wade@example.com', email_verified=True)
+        self.logged_out = self._session(days_ago=40, is_active=False, revoked_reason='user_logout', city='Lyon')
+        self.ran_out = self._session(days_ago=45, is_active=True, expires_in_days=-35)
+        self.recent_logout = self._session(days_ago=5, is_active=False, revoked_reason='user_logout')
+        self.active = self._session(days_ago=1, is_active=True, expires_in_days=6)
+
+    def _session(self, days_ago, is_active, expires_in_days=1, **fields):
+        when = timezone.now() - timedelta(days=days_ago)
+        session = Session.objects.create(
+            user=self.user, token_jti=uuid.uuid4().hex, ip_address='10.0.0.1', is_active=is_active,
+            expires_at=timezone.now() + timedelta(days=expires_in_days), **fields,
+        )
+        # created_at / last_activity are auto fields; set them with an UPDATE
+        Session.objects.filter(pk=session.pk).update(created_at=when, last_activity=when)
+        session.refresh_from_db()
+        return session
+
+    def test_old_sessions_move_to_the_archive(self):
+        self.assertEqual(archive_sessions(chunk_size=1), 2)
+
+        self.assertEqual(
+            set(Session.objects.values_list('id', flat=True)), {self.recent_logout.id, self.active.id},
+        )
+        logged_out = ArchivedSession.objects.get(pk=self.logged_out.pk)
+        for field in ('user_id', 'token_jti', 'city', 'revoked_reason', 'created_at', 'last_activity'):
+            self.assertEqual(getattr(logged_out, field), getattr(self.logged_out, field), field)
+        ran_out = ArchivedSession.objects.get(pk=self.ran_out.pk)
+        self.assertFalse(ran_out.is_active)
+        self.assertEqual(ran_out.revoked_reason, 'session_expired')
+
+        self.assertEqual(archive_sessions(), 0)
+        self.assertEqual(ArchivedSession.objects.count(), 2)
+
+    def test_failed_copy_leaves_the_session_in_place(self):
+        with mock.patch.object(ArchivedSession.objects, 'bulk_create', side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError):
+                archive_sessions()
+        self.assertEqual(Session.objects.count(), 4)
+        self.assertFalse(ArchivedSession.objects.exists())
+
+    def test_history_reads_both_tables_newest_first(self):
+        archive_sessions()
+        history = session_history(self.user)
+        self.assertEqual(
+            [session.id for session in history],
+            [self.active.id, self.recent_logout.id, self.logged_out.id, self.ran_out.id],
+        )
+        self.assertIsInstance(history[-1], ArchivedSession)
+        self.assertEqual([session.id for session in session_history(self.user, limit=3)],
+                         [self.active.id, self.recent_logout.id, self.logged_out.id])
@@ -0,0 +1,230 @@
+"""
+Impossible Travel - Flag consecutive logins too far apart for the time between them
+
+Batch mode streams sessions with coordinates in (user, created_at) order and
+evaluates each chunk in one vectorized NumPy pass: haversine distance and
+implied speed between every pair of consecutive logins of the same user.
+The last point of a chunk is carried into the next, so pairs spanning a
+chunk boundary are not missed.
+
+On-login mode compares a new session with the user's previous point only,
+using plain math (no NumPy needed on the request path).
+
+Findings are written as 'device_location_anomaly' DeviceAuditLog rows. Those
+need a device, so a finding whose session has no device row (the device was
+hard-deleted) is logged as a warning instead.
+"""
+
+import logging
+import math
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Device, Session
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover
+    np = None
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Pairs closer together in time than this are treated as this far apart,
+# so two logins in the same second do not divide by zero
+_MIN_INTERVAL_HOURS = 1 / 3600
+
+_POINT_FIELDS = (
+    'id', 'user_id', 'created_at', 'latitude', 'longitude',
+    'fingerprint_hash', 'ip_address', 'country', 'city',
+)
+
+
+def _as_point(row):
+    return dict(zip(_POINT_FIELDS, row))
+
+
+def is_available():
+    """Batch detection requires the optional numpy package"""
+    return np is not None
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in km"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def haversine_km_array(lat1, lon1, lat2, lon2):
+    """Vectorized haversine over NumPy arrays of degrees"""
+    lat1, lon1, lat2, lon2 = (np.radians(values) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _thresholds():
+    return (
+        float(getattr(settings, 'IMPOSSIBLE_TRAVEL_MAX_SPEED_KMH', 1000)),
+        float(getattr(settings, 'IMPOSSIBLE_TRAVEL_MIN_DISTANCE_KM', 500)),
+    )
+
+
+class ImpossibleTravelDetector:
+    """Detect impossible travel between consecutive logins"""
+
+    @staticmethod
+    def check_session(session):
+        """
+        Compare a just-created session with the user's previous login point.
+        Returns the number of anomalies recorded (0 or 1).
+        """
+        if not getattr(settings, 'IMPOSSIBLE_TRAVEL_CHECK_ON_LOGIN', True):
+            return 0
+        if session.latitude is None or session.longitude is None:
+            return 0
+
+        previous = Session.objects.filter(
+            user_id=session.user_id,
+            latitude__isnull=False,
+            created_at__lt=session.created_at,
+        ).exclude(pk=session.pk).order_by('-created_at').values(*_POINT_FIELDS).first()
+        if previous is None:
+            return 0
+
+        max_speed, min_distance = _thresholds()
+        distance = haversine_km(previous['latitude'], previous['longitude'], session.latitude, session.longitude)
+        hours = max((session.created_at - previous['created_at']).total_seconds() / 3600, _MIN_INTERVAL_HOURS)
+        speed = distance / hours
+        if distance < min_distance or speed <= max_speed:
+            return 0
+
+        current = {field: getattr(session, field) for field in _POINT_FIELDS}
+        return ImpossibleTravelDetector._record([(previous, current, distance, speed)], source='login')
+
+    @staticmethod
+    def scan(since=None, chunk_size=100000):
+        """
+        Scan session history for impossible travel.
+        Returns {'scanned': rows read, 'flagged': anomalies recorded}.
+        """
+        if np is None:
+            raise RuntimeError('numpy is required for batch impossible-travel detection.')
+
+        sessions = Session.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        if since is not None:
+            sessions = sessions.filter(created_at__gte=since)
+        rows = sessions.order_by('user_id', 'created_at').values_list(*_POINT_FIELDS)
+
+        scanned = flagged = 0
+        carry = None
+        chunk = []
+        for row in rows.iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                flagged += ImpossibleTravelDetector._scan_chunk(chunk, carry)
+                scanned += len(chunk)
+                carry = chunk[-1]
+                chunk = []
+        if chunk:
+            flagged += ImpossibleTravelDetector._scan_chunk(chunk, carry)
+            scanned += len(chunk)
+
+        return {'scanned': scanned, 'flagged': flagged}
+
+    @staticmethod
+    def _scan_chunk(chunk, carry):
+        points = [carry] + chunk if carry is not None else chunk
+        if len(points) < 2:
+            return 0
+
+        max_speed, min_distance = _thresholds()
+        users = np.array([str(row[1]) for row in points], dtype=object)
+        times = np.array([row[2].timestamp() for row in points], dtype=np.float64)
+        lat = np.array([row[3] for row in points], dtype=np.float64)
+        lon = np.array([row[4] for row in points], dtype=np.float64)
+
+        same_user = users[1:] == users[:-1]
+        distance = haversine_km_array(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        hours = np.maximum((times[1:] - times[:-1]) / 3600, _MIN_INTERVAL_HOURS)
+        speed = distance / hours
+
+        hits = np.flatnonzero(same_user & (distance >= min_distance) & (speed > max_speed))
+        if not hits.size:
+            return 0
+
+        anomalies = [
+            (_as_point(points[i]), _as_point(points[i + 1]), float(distance[i]), float(speed[i]))
+            for i in hits
+        ]
+        return ImpossibleTravelDetector._record(anomalies, source='batch')
+
+    @staticmethod
+    def _record(anomalies, source):
+        """Bulk-insert audit rows, skipping sessions that were already flagged"""
+        from audits_logs.models import DeviceAuditLog
+
+        session_ids = [str(current['id']) for _, current, _, _ in anomalies]
+        already_flagged = set(
+            DeviceAuditLog.objects.filter(
+                action='device_location_anomaly',
+                metadata__session_id__in=session_ids,
+            ).values_list('metadata__session_id', flat=True)
+        )
+
+        devices = {
+            (device.user_id, device.fingerprint_hash): device
+            for device in Device.objects.filter(
+                user_id__in={current['user_id'] for _, current, _, _ in anomalies},
+                fingerprint_hash__in={current['fingerprint_hash'] for _, current, _, _ in anomalies},
+            )
+        }
+
+        logs = []
+        for previous, current, distance, speed in anomalies:
+            if str(current['id']) in already_flagged:
+                continue
+            minutes = (current['created_at'] - previous['created_at']).total_seconds() / 60
+            device = devices.get((current['user_id'], current['fingerprint_hash']))
+            if device is None:
+                logger.warning(
+                    "Impossible travel not audited (no device row): user %s session %s, "
+                    "%.0f km in %.0f min (%.0f km/h)",
+                    current['user_id'], current['id'], distance, minutes, speed,
+                )
+                continue
+            logs.append(DeviceAuditLog(
+                user_id=current['user_id'],
+                device=device,
+                action='device_location_anomaly',
+                description=(
+                    f"Impossible travel: {distance:.0f} km in {minutes:.0f} min "
+                    f"({speed:.0f} km/h) from {previous['city'] or previous['country'] or 'unknown'} "
+                    f"to {current['city'] or current['country'] or 'unknown'}"
+                ),
+                ip_address=current['ip_address'],
+                device_fingerprint=device.fingerprint_hash,
+                device_name=device.device_name,
+                device_type=device.device_type,
+                browser=device.browser,
+                os=device.os,
+                country=current['country'] or '',
+                city=current['city'] or '',
+                previous_country=previous['country'] or '',
+                previous_city=previous['city'] or '',
+                was_trusted=device.is_trusted,
+                now_trusted=device.is_trusted,
+                metadata={
+                    'session_id': str(current['id']),
+                    'previous_session_id': str(previous['id']),
+                    'distance_km': round(distance, 1),
+                    'speed_kmh': round(speed, 1),
+                    'detected_by': source,
+                    'detected_at': timezone.now().isoformat(),
+                },
+            ))
+
+        DeviceAuditLog.objects.bulk_create(logs)
+        return len(logs)
@@ -0,0 +1,121 @@
+"""
+Device Upsert - Insert or update a user's device in one statement
+
+Verification and MFA login either register a new device or refresh the
+existing (user, fingerprint_hash) row. On PostgreSQL and SQLite >= 3.35 this
+is a single statement:
+
+    INSERT INTO devices (...) VALUES (...)
+    ON CONFLICT (user_id, fingerprint_hash) DO UPDATE
+        SET <update fields> = EXCLUDED.<field>, total_logins = devices.total_logins + 1
+    RETURNING <all columns>
+
+Other backends fall back to an UPDATE with F('total_logins') + 1 followed by an
+INSERT when no row matched.
+
+A queryset-level write fires no model signals, so post_save is sent once
+afterwards: the new-device / device-verified notifications and the decision
+cache invalidation keep working unchanged.
+"""
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from .models import Device
+
+# Written on every upsert, in addition to the caller's update fields
+_ALWAYS_UPDATED = ('updated_at', 'last_used_at')
+
+
+def _supports_single_statement():
+    features = connection.features
+    return features.supports_update_conflicts_with_target and features.can_return_columns_from_insert
+
+
+def _convert_row(fields, row):
+    """Apply backend and field converters, as the ORM does for a SELECT"""
+    values = []
+    for field, value in zip(fields, row):
+        column = field.get_col(Device._meta.db_table)
+        for converter in connection.ops.get_db_converters(column) + column.get_db_converters(connection):
+            value = converter(value, column, connection)
+        values.append(value)
+    return values
+
+
+def _upsert_returning(device, update_fields):
+    qn = connection.ops.quote_name
+    table = qn(Device._meta.db_table)
+    fields = Device._meta.concrete_fields
+
+    columns = ', '.join(qn(field.column) for field in fields)
+    params = [field.get_db_prep_save(field.pre_save(device, add=True), connection) for field in fields]
+    assignments = [
+        f"{qn(Device._meta.get_field(name).column)} = EXCLUDED.{qn(Device._meta.get_field(name).column)}"
+        for name in update_fields
+    ]
+    total_logins = qn('total_logins')
+    assignments.append(f"{total_logins} = {table}.{total_logins} + 1")
+
+    sql = (
+        f"INSERT INTO {table} ({columns}) VALUES ({', '.join(['%s'] * len(fields))}) "
+        f"ON CONFLICT ({qn('user_id')}, {qn('fingerprint_hash')}) DO UPDATE SET {', '.join(assignments)} "
+        f"RETURNING {columns}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+
+    names = [field.attname for field in fields]
+    result = Device.from_db(connection.alias, names, _convert_row(fields, row))
+    # created_at is never updated, so it only matches on a fresh insert
+    return result, result.created_at == device.created_at
+
+
+def _upsert_fallback(device, update_fields):
+    now = timezone.now()
+    values = {name: getattr(device, name) for name in update_fields}
+    values.update(updated_at=now, last_used_at=now, total_logins=F('total_logins') + 1)
+    existing = Device.objects.filter(user_id=device.user_id, fingerprint_hash=device.fingerprint_hash)
+
+    with transaction.atomic():
+        if not existing.update(**values):
+            try:
+                with transaction.atomic():
+                    # bulk_create sends no post_save; upsert_device does
+                    Device.objects.bulk_create([device])
+                return device, True
+            except IntegrityError:
+                # Lost a race with a concurrent insert of the same device
+                existing.update(**values)
+        return existing.get(), False
+
+
+def upsert_device(user, fingerprint_hash, values, update_fields):
+    """
+    Register a device or refresh the existing row and count a login.
+
+    values: field values for the new row; the existing row only receives
+    `update_fields` (plus updated_at / last_used_at) from them.
+    Returns (device, created).
+    """
+    update_fields = tuple(dict.fromkeys(tuple(update_fields) + _ALWAYS_UPDATED))
+    device = Device(user=user, fingerprint_hash=fingerprint_hash, total_logins=1, **values)
+
+    if _supports_single_statement():
+        device, created = _upsert_returning(device, update_fields)
+    else:
+        device, created = _upsert_fallback(device, update_fields)
+    device.user = user
+
+    post_save.send(
+        sender=Device,
+        instance=device,
+        created=created,
+        update_fields=None if created else frozenset(update_fields + ('total_logins',)),
+        raw=False,
+        using=connection.alias,
+    )
+    return device, created
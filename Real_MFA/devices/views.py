@@ -4,19 +4,22 @@ Device Views - Device verification and management
 
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 import logging
 
 from .models import Device, Session
+from .pagination import KeysetPagination
 from .serializers import (
     DeviceVerificationSerializer,
     DeviceListSerializer,
     DeviceRevokeSerializer,
     SessionListSerializer,
     SessionRevokeSerializer,
-    RevokeAllSessionsSerializer
+    RevokeAllSessionsSerializer,
+    resolve_current_device
 )
 
 logger = logging.getLogger(__name__)
@@ -78,6 +81,9 @@ class DeviceListView(APIView):
     List all user devices
     
     GET /api/devices/
+    GET /api/devices/?debug=1   (adds per-device debug_info)
+    GET /api/devices/?cursor=<next_cursor>&page_size=50   (paged; without
+        cursor / page_size every device is returned)
     
     Response (200):
     {
@@ -98,28 +104,38 @@ class DeviceListView(APIView):
                 ...
             },
             ...
-        ]
+        ],
+        "next_cursor": "eyJ0Ijo..."   (null on the last page)
     }
     """
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
         try:
-            devices = Device.objects.filter(
-                user=request.user,
-                is_deleted=False
-            ).order_by('-last_used_at')
+            paginator = KeysetPagination('last_used_at')
+            devices = paginator.paginate_queryset(
+                Device.objects.filter(user=request.user, is_deleted=False),
+                request,
+            )
 
             serializer = DeviceListSerializer(
                 devices,
                 many=True,
-                context={'request': request}
+                context={
+                    'request': request,
+                    'current_device': resolve_current_device(request),
+                    'include_debug': request.query_params.get('debug') in ('1', 'true'),
+                }
             )
+            data = serializer.data
 
             return Response({
-                'count': devices.count(),
-                'devices': serializer.data
+                'count': len(data),
+                'devices': data,
+                'next_cursor': paginator.next_cursor,
             }, status=status.HTTP_200_OK)
+        except ValidationError:
+            raise
         except Exception as exc:
             logger.error("Failed to fetch devices for user %s: %s", request.user.id, exc, exc_info=True)
             return Response({
@@ -167,6 +183,8 @@ class SessionListView(APIView):
     List all active sessions for the user
     
     GET /api/devices/sessions/
+    GET /api/devices/sessions/?cursor=<next_cursor>&page_size=50   (paged;
+        without cursor / page_size every session is returned)
     
     Response (200):
     {
@@ -186,28 +204,34 @@ class SessionListView(APIView):
                 "expires_at": "2024-01-22T08:00:00Z"
             },
             ...
-        ]
+        ],
+        "next_cursor": "eyJ0Ijo..."   (null on the last page)
     }
     """
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
         try:
-            sessions = Session.objects.filter(
-                user=request.user,
-                is_active=True
-            ).order_by('-last_activity')
+            paginator = KeysetPagination('last_activity')
+            sessions = paginator.paginate_queryset(
+                Session.objects.filter(user=request.user, is_active=True),
+                request,
+            )
 
             serializer = SessionListSerializer(
                 sessions,
                 many=True,
                 context={'request': request}
             )
+            data = serializer.data
 
             return Response({
-                'count': sessions.count(),
-                'sessions': serializer.data
+                'count': len(data),
+                'sessions': data,
+                'next_cursor': paginator.next_cursor,
             }, status=status.HTTP_200_OK)
+        except ValidationError:
+            raise
         except Exception as exc:
             logger.error("Failed to fetch sessions for user %s: %s", request.user.id, exc, exc_info=True)
             return Response({
@@ -2,7 +2,7 @@ from django.contrib import admin
 from .models import (
     EmailNotification, SMSNotification, NotificationPreference, 
     DetailedNotificationPreference, QuietHours, NotificationBlocklist,
-    NotificationConsent, NotificationLog, MFANotification
+    NotificationConsent, NotificationLog, MFANotification, NotificationOutbox
 )
 
 
@@ -11,7 +11,7 @@ class EmailNotificationAdmin(admin.ModelAdmin):
     list_display = ('user', 'to_email', 'subject', 'email_type', 'status', 'sent_at')
     list_filter = ('email_type', 'status', 'created_at')
     search_fields = ('user__email', 'user__username', 'to_email', 'subject')
-    readonly_fields = ('id', 'created_at', 'updated_at')
+    readonly_fields = ('id', 'body', 'created_at', 'updated_at')
     ordering = ('-created_at',)
     date_hierarchy = 'created_at'
     
@@ -48,9 +48,14 @@ class EmailNotificationAdmin(admin.ModelAdmin):
     mark_as_sent.short_description = 'Mark selected as sent'
     
     def retry_failed(self, request, queryset):
-        updated = queryset.filter(status='failed').update(status='pending', error_message='')
+        from django.utils import timezone
+        # Due now with a fresh retry budget and no stale lease, so the next drain picks them up
+        updated = queryset.filter(status__in=['failed', 'dead']).update(
+            status='pending', error_message='', retry_count=0,
+            next_retry_at=timezone.now(), lease_owner='',
+        )
         self.message_user(request, f'{updated} notification(s) queued for retry.')
-    retry_failed.short_description = 'Retry failed notifications'
+    retry_failed.short_description = 'Retry failed and dead-lettered notifications'
 
 
 @admin.register(SMSNotification)
@@ -220,7 +225,7 @@ class NotificationLogAdmin(admin.ModelAdmin):
     list_display = ('user', 'channel', 'subject', 'delivered', 'created_at')
     list_filter = ('channel', 'delivered', 'created_at')
     search_fields = ('user__email', 'user__username', 'recipient', 'subject')
-    readonly_fields = ('id', 'created_at', 'updated_at')
+    readonly_fields = ('id', 'message', 'created_at', 'updated_at')
     ordering = ('-created_at',)
     date_hierarchy = 'created_at'
     
@@ -284,3 +289,28 @@ class MFANotificationAdmin(admin.ModelAdmin):
     
     def has_add_permission(self, request):
         return False
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ('user', 'alert_type', 'status', 'attempts', 'created_at', 'processed_at')
+    list_filter = ('status', 'alert_type')
+    search_fields = ('user__email', 'user__username', 'alert_type')
+    readonly_fields = ('id', 'created_at', 'updated_at', 'claimed_at', 'processed_at')
+    ordering = ('-created_at',)
+    date_hierarchy = 'created_at'
+    
+    fieldsets = (
+        ('Alert', {
+            'fields': ('id', 'user', 'alert_type', 'context')
+        }),
+        ('Processing', {
+            'fields': ('status', 'attempts', 'claimed_at', 'processed_at', 'error_message')
+        }),
+        ('Timestamps', {
+            'fields': ('created_at', 'updated_at')
+        }),
+    )
+    
+    def has_add_permission(self, request):
+        return False
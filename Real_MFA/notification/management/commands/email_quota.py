@@ -0,0 +1,37 @@
+"""
+Show the cluster-wide email send quota per provider and lane
+
+Usage:
+    python manage.py email_quota [--json]
+"""
+
+import json
+
+from django.core.management.base import BaseCommand
+
+from Real_MFA.email_quota import send_quota
+
+
+class Command(BaseCommand):
+    help = 'Show provider send rates, tokens left and what each priority lane can take now'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Print the raw status as JSON')
+
+    def handle(self, *args, **options):
+        status = send_quota.status()
+        if options['json']:
+            self.stdout.write(json.dumps(status, indent=2))
+            return
+        if not status:
+            self.stdout.write('No provider send limits configured (EMAIL_SEND_RATE_LIMITS).')
+            return
+
+        for provider, quota in status.items():
+            scope = 'cluster-wide' if quota['shared'] else 'per process (no Redis)'
+            self.stdout.write(
+                f"{provider}: {quota['tokens']:g}/{quota['capacity']:g} tokens, "
+                f"{quota['rate_per_second']:g}/s, {scope}"
+            )
+            for lane, info in quota['lanes'].items():
+                self.stdout.write(f"  {lane:<6} reserve {info['reserve']:g}, available now {info['available']}")
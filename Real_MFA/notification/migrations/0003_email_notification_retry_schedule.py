@@ -0,0 +1,47 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:16
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def schedule_existing_rows(apps, schema_editor):
+    """Queued rows are due from creation; exhausted failures become dead letters."""
+    EmailNotification = apps.get_model('notification', 'EmailNotification')
+    EmailNotification.objects.filter(status__in=['pending', 'failed']).update(next_retry_at=F('created_at'))
+    EmailNotification.objects.filter(status='failed', retry_count__gte=F('max_retries')).update(status='dead')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification', '0002_email_notification_drain_lease'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='emailnotification',
+            name='email_notif_drain_idx',
+        ),
+        migrations.RemoveField(
+            model_name='emailnotification',
+            name='lease_expires_at',
+        ),
+        migrations.AddField(
+            model_name='emailnotification',
+            name='next_retry_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='emailnotification',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'), ('dead', 'Dead Letter'), ('bounced', 'Bounced')], db_index=True, default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='emailnotification',
+            index=models.Index(fields=['status', 'next_retry_at'], name='email_notif_retry_idx'),
+        ),
+        migrations.RunPython(schedule_existing_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,121 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:32
+
+import hashlib
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def _body(NotificationBody, text):
+    # Same encoding as NotificationBody.build (compression always considered here)
+    raw = (text or '').encode('utf-8')
+    content, compressed = raw, False
+    if len(raw) >= 256:
+        packed = zlib.compress(raw, 6)
+        if len(packed) < len(raw):
+            content, compressed = packed, True
+    return NotificationBody(digest=hashlib.sha256(raw).hexdigest(), content=content, compressed=compressed, size=len(raw))
+
+
+def _move_texts(apps, model_name, text_field, fk_name):
+    NotificationBody = apps.get_model('notification', 'NotificationBody')
+    Model = apps.get_model('notification', model_name)
+    rows = Model.objects.order_by('pk').only('pk', text_field)
+    last_pk = None
+    while True:
+        batch = list((rows.filter(pk__gt=last_pk) if last_pk else rows)[:BATCH_SIZE])
+        if not batch:
+            return
+        bodies = {}
+        for row in batch:
+            body = _body(NotificationBody, getattr(row, text_field))
+            bodies.setdefault(body.digest, body)
+            setattr(row, f'{fk_name}_id', body.digest)
+        NotificationBody.objects.bulk_create(bodies.values(), ignore_conflicts=True)
+        Model.objects.bulk_update(batch, [fk_name])
+        last_pk = batch[-1].pk
+
+
+def _restore_texts(apps, model_name, text_field, fk_name):
+    Model = apps.get_model('notification', model_name)
+    rows = Model.objects.select_related(fk_name).order_by('pk')
+    last_pk = None
+    while True:
+        batch = list((rows.filter(pk__gt=last_pk) if last_pk else rows)[:BATCH_SIZE])
+        if not batch:
+            return
+        for row in batch:
+            body = getattr(row, fk_name)
+            raw = bytes(body.content) if body else b''
+            setattr(row, text_field, (zlib.decompress(raw) if body and body.compressed else raw).decode('utf-8'))
+        Model.objects.bulk_update(batch, [text_field])
+        last_pk = batch[-1].pk
+
+
+def store_bodies(apps, schema_editor):
+    """Move every body / log message into notification_bodies, one row per unique text."""
+    _move_texts(apps, 'EmailNotification', 'body', 'body_content')
+    _move_texts(apps, 'NotificationLog', 'message', 'message_content')
+
+
+def restore_bodies(apps, schema_editor):
+    _restore_texts(apps, 'EmailNotification', 'body', 'body_content')
+    _restore_texts(apps, 'NotificationLog', 'message', 'message_content')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification', '0004_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationBody',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('content', models.BinaryField()),
+                ('compressed', models.BooleanField(default=False)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Notification Body',
+                'verbose_name_plural': 'Notification Bodies',
+                'db_table': 'notification_bodies',
+            },
+        ),
+        migrations.AddField(
+            model_name='emailnotification',
+            name='body_content',
+            field=models.ForeignKey(blank=True, db_column='body_digest', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='email_notifications', to='notification.notificationbody'),
+        ),
+        migrations.AddField(
+            model_name='notificationlog',
+            name='message_content',
+            field=models.ForeignKey(blank=True, db_column='message_digest', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='notification_logs', to='notification.notificationbody'),
+        ),
+        migrations.RunPython(store_bodies, restore_bodies),
+        # Defaults only matter when unapplying: the columns come back non-null on filled tables
+        migrations.AlterField(
+            model_name='emailnotification',
+            name='body',
+            field=models.TextField(default=''),
+        ),
+        migrations.AlterField(
+            model_name='notificationlog',
+            name='message',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='emailnotification',
+            name='body',
+        ),
+        migrations.RemoveField(
+            model_name='notificationlog',
+            name='message',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification', '0005_notification_body_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationoutbox',
+            name='hold_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.11 on 2026-10-19 05:23
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification', '0006_notification_outbox_hold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationbody',
+            name='last_referenced_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
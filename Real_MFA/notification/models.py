@@ -3,18 +3,143 @@
 # Email and SMS notification tracking and management
 # ============================================================================
 
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
+from django.utils.functional import cached_property
+import hashlib
 import uuid
+import zlib
 
 # Import User model from accounts app
 from accounts.models import TimeStampedModel
 
 
+# ---------------------------
+# Notification Body Model
+# ---------------------------
+class NotificationBody(models.Model):
+    """
+    Rendered notification content, stored once per unique text.
+
+    The primary key is the SHA-256 of the text, so identical bodies (the same
+    alert rendered for the same values, and the email / log copy of one alert)
+    share a row. Content is zlib-compressed when that is smaller and
+    NOTIFICATION_BODY_COMPRESSION is on. Content never changes once stored;
+    storing the same text again only refreshes last_referenced_at, which
+    purge_orphan_notification_bodies checks before removing unreferenced rows.
+    """
+    
+    digest = models.CharField(max_length=64, primary_key=True)
+    content = models.BinaryField()
+    compressed = models.BooleanField(default=False)
+    size = models.PositiveIntegerField(default=0)  # uncompressed bytes
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_referenced_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        db_table = 'notification_bodies'
+        verbose_name = 'Notification Body'
+        verbose_name_plural = 'Notification Bodies'
+    
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.size} bytes)"
+    
+    @cached_property
+    def text(self):
+        raw = bytes(self.content)
+        return (zlib.decompress(raw) if self.compressed else raw).decode('utf-8')
+    
+    @classmethod
+    def build(cls, text):
+        """Unsaved row for `text`; the digest is its primary key"""
+        raw = (text or '').encode('utf-8')
+        content, compressed = raw, False
+        if getattr(settings, 'NOTIFICATION_BODY_COMPRESSION', True) and len(raw) >= 256:
+            packed = zlib.compress(raw, 6)
+            if len(packed) < len(raw):
+                content, compressed = packed, True
+        return cls(digest=hashlib.sha256(raw).hexdigest(), content=content, compressed=compressed, size=len(raw))
+    
+    @classmethod
+    def store_many(cls, texts):
+        """
+        Insert any of `texts` not stored yet and mark the rest as referenced
+        (one statement); returns their digests in order.
+        """
+        bodies = [cls.build(text) for text in texts]
+        unique = list({body.digest: body for body in bodies}.values())
+        if unique:
+            # A reused body must look fresh to the purge until its notification row lands
+            cls.objects.bulk_create(
+                unique, update_conflicts=True, unique_fields=['digest'], update_fields=['last_referenced_at'],
+            )
+        return [body.digest for body in bodies]
+    
+    @classmethod
+    def store(cls, text):
+        return cls.store_many([text])[0]
+
+
+def _stored_text(fk_name):
+    """
+    Text attribute backed by a NotificationBody foreign key.
+
+    Assigning (or passing it to the constructor / create()) keeps the text on
+    the instance until save() or bulk_create() stores it; reading uses the
+    related row (select_related it when reading many).
+    """
+    cache_name = f'_{fk_name}_text'
+    
+    def getter(self):
+        text = self.__dict__.get(cache_name)
+        if text is None:
+            body = getattr(self, fk_name)
+            text = body.text if body is not None else ''
+        return text
+    
+    def setter(self, value):
+        self.__dict__[cache_name] = value or ''
+        self.__dict__.setdefault('_pending_texts', set()).add(fk_name)
+    
+    return property(getter, setter)
+
+
+class StoredTextQuerySet(models.QuerySet):
+    """bulk_create() stores pending texts first (save() is not called for it)"""
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        self.model.store_texts(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class StoredTextMixin:
+    """Shared save path for models whose text lives in NotificationBody"""
+    
+    # {attribute name: foreign key name}
+    STORED_TEXT_FIELDS = {}
+    
+    @classmethod
+    def store_texts(cls, objs):
+        for fk_name in cls.STORED_TEXT_FIELDS.values():
+            cache_name = f'_{fk_name}_text'
+            pending = [obj for obj in objs if fk_name in obj.__dict__.get('_pending_texts', ())]
+            for obj, digest in zip(pending, NotificationBody.store_many(obj.__dict__[cache_name] for obj in pending)):
+                setattr(obj, f'{fk_name}_id', digest)
+                obj.__dict__['_pending_texts'].discard(fk_name)
+    
+    def save(self, *args, update_fields=None, **kwargs):
+        self.store_texts([self])
+        if update_fields is not None:
+            update_fields = [self.STORED_TEXT_FIELDS.get(name, name) for name in update_fields]
+        super().save(*args, update_fields=update_fields, **kwargs)
+
+
 # ---------------------------
 # Email Notification Model
 # ---------------------------
-class EmailNotification(TimeStampedModel):
+class EmailNotification(StoredTextMixin, TimeStampedModel):
     """
     Track email notifications sent to users
     Supports: OTP emails, password reset, account alerts, etc.
@@ -24,6 +149,7 @@ class EmailNotification(TimeStampedModel):
         ('pending', 'Pending'),
         ('sent', 'Sent'),
         ('failed', 'Failed'),
+        ('dead', 'Dead Letter'),  # failed permanently or ran out of retries
         ('bounced', 'Bounced'),
     ]
     
@@ -48,8 +174,11 @@ class EmailNotification(TimeStampedModel):
     email_type = models.CharField(max_length=50, choices=EMAIL_TYPE_CHOICES, db_index=True)
     template_name = models.CharField(max_length=100)
     
-    # Email Content
-    body = models.TextField()
+    # Email Content (stored once per unique text; read and assign through `body`)
+    body_content = models.ForeignKey(
+        NotificationBody, on_delete=models.PROTECT, db_column='body_digest',
+        null=True, blank=True, related_name='email_notifications',
+    )
     
     # Status
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
@@ -64,11 +193,22 @@ class EmailNotification(TimeStampedModel):
     error_message = models.TextField(blank=True)
     retry_count = models.PositiveIntegerField(default=0)
     max_retries = models.PositiveIntegerField(default=3)
+    # When the drain may (re)send a pending / failed row; pushed out by
+    # backoff after a failure and by the lease while a worker sends it
+    next_retry_at = models.DateTimeField(default=timezone.now)
     
     # Provider Details
     provider = models.CharField(max_length=50, blank=True)  # e.g., SendGrid, AWS SES
     provider_message_id = models.CharField(max_length=255, blank=True, unique=True)
     
+    # Drain lease: the worker holding it is sending this row
+    lease_owner = models.CharField(max_length=64, blank=True)
+    
+    body = _stored_text('body_content')
+    STORED_TEXT_FIELDS = {'body': 'body_content'}
+    
+    objects = StoredTextQuerySet.as_manager()
+    
     class Meta:
         db_table = 'email_notifications'
         verbose_name = 'Email Notification'
@@ -78,6 +218,8 @@ class EmailNotification(TimeStampedModel):
             models.Index(fields=['user', 'status']),
             models.Index(fields=['email_type', 'status']),
             models.Index(fields=['-created_at']),
+            # Drain: range scan over due pending / failed rows
+            models.Index(fields=['status', 'next_retry_at'], name='email_notif_retry_idx'),
         ]
     
     def __str__(self):
@@ -495,7 +637,7 @@ class NotificationConsent(TimeStampedModel):
 # ============================================================================
 # END OF FILE
 # ============================================================================
-class NotificationLog(TimeStampedModel):
+class NotificationLog(StoredTextMixin, TimeStampedModel):
     """
     Audit trail for all notifications
     Track notification delivery history
@@ -514,7 +656,11 @@ class NotificationLog(TimeStampedModel):
     # Notification Details
     channel = models.CharField(max_length=20, choices=CHANNEL_CHOICES, db_index=True)
     subject = models.CharField(max_length=255)
-    message = models.TextField()
+    # Stored once per unique text (shared with the EmailNotification copy); use `message`
+    message_content = models.ForeignKey(
+        NotificationBody, on_delete=models.PROTECT, db_column='message_digest',
+        null=True, blank=True, related_name='notification_logs',
+    )
     
     # Recipient
     recipient = models.CharField(max_length=255)  # Email or phone number
@@ -525,6 +671,11 @@ class NotificationLog(TimeStampedModel):
     # Metadata
     metadata = models.JSONField(default=dict, blank=True)
     
+    message = _stored_text('message_content')
+    STORED_TEXT_FIELDS = {'message': 'message_content'}
+    
+    objects = StoredTextQuerySet.as_manager()
+    
     class Meta:
         db_table = 'notification_logs'
         verbose_name = 'Notification Log'
@@ -662,6 +813,59 @@ class MFANotification(TimeStampedModel):
         self.save(update_fields=['is_verified', 'verified_at'])
 
 
+
+# ---------------------------
+# Notification Outbox Model
+# ---------------------------
+class NotificationOutbox(TimeStampedModel):
+    """
+    Security alert intents written in the caller's transaction.
+
+    The row is published to the deliver_notification_outbox task on commit;
+    the consumer renders and sends the alert, so request latency does not
+    depend on the email provider. Rows whose publish was lost (broker down,
+    worker crash) are re-dispatched by sweep_notification_outbox.
+    Held rows (hold_until set) are merged per user by deliver_notification_digest.
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('delivered', 'Delivered'),  # handed to send_security_alert
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey('accounts.User', on_delete=models.CASCADE, related_name='notification_outbox')
+    
+    # Alert intent: a notification.registry name plus its JSON-serialized context
+    alert_type = models.CharField(max_length=50)
+    context = models.JSONField(default=dict, blank=True)
+    
+    # Low-severity alerts are held until the user's digest window closes (null = send now)
+    hold_until = models.DateTimeField(null=True, blank=True)
+    
+    # Processing
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    error_message = models.TextField(blank=True)
+    
+    class Meta:
+        db_table = 'notification_outbox'
+        verbose_name = 'Notification Outbox Entry'
+        verbose_name_plural = 'Notification Outbox'
+        ordering = ['created_at']
+        indexes = [
+            # Sweep: stale pending / processing rows, oldest first
+            models.Index(fields=['status', 'created_at'], name='notif_outbox_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.alert_type} for {self.user_id} - {self.status}"
+
+
 # ============================================================================
 # END OF FILE
 # ============================================================================
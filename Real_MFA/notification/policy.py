@@ -0,0 +1,298 @@
+"""
+Notification Policy - Compiled per-user delivery rules, one cache lookup per decision
+
+Whether (and when) a notification may go out depends on five tables:
+NotificationPreference (channel on/off per category, legacy quiet window),
+DetailedNotificationPreference (per-type channel switches, priority, delay,
+quiet-hours opt-out), QuietHours, NotificationBlocklist and
+NotificationConsent. NotificationPolicy compiles them into one small JSON
+document per user:
+
+    {
+      "ch":      {"email": {"alerts": true, "otp": true, "marketing": false, "blocked": false}, ...},
+      "types":   {"password_changed": {"email": true, ..., "quiet": true, "delay": 0, "high": false}},
+      "quiet":   [[day (-1 = every day), start_minute, end_minute, critical_only, tz], ...],
+      "consent": {"marketing": false, ...}   # explicit rows only
+    }
+
+evaluate() answers "may this be sent, and when" from that document alone;
+evaluate_many() does the same for a fan-out with one MGET and, for users not
+cached yet, five queries for the whole batch.
+
+Entries are dropped on commit whenever one of the source rows (or the
+user's email / profile timezone and phone) changes; see notification.signals.
+Daily frequency caps (max_per_day) need counters, not policy, and are not
+part of the compiled document.
+"""
+
+import json
+from collections import defaultdict, namedtuple
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import User
+from accounts.redis_utils import redis_client
+from .models import (
+    DetailedNotificationPreference, NotificationBlocklist, NotificationConsent,
+    NotificationPreference, QuietHours,
+)
+
+CACHE_TTL_SECONDS = 3600
+
+CHANNELS = ('email', 'sms', 'in_app', 'push')
+
+# registry alert name -> DetailedNotificationPreference.notification_type
+ALERT_NOTIFICATION_TYPES = {
+    'new_device_login': 'device_added',
+    'device_verified': 'device_verified',
+    'mfa_enabled': 'mfa_enabled',
+    'mfa_disabled': 'mfa_disabled',
+    'password_changed': 'password_changed',
+    'profile_changed': 'security_alert',
+    'account_digest': 'security_alert',
+    'suspicious_login': 'unusual_activity',
+}
+
+# Categories that only go out with an explicit opt-in
+_OPT_IN_CONSENTS = frozenset({'marketing', 'newsletter', 'promotions', 'product_updates'})
+# Category -> consent type checked for it
+_CATEGORY_CONSENT = {'alerts': 'security', 'marketing': 'marketing'}
+
+PolicyDecision = namedtuple('PolicyDecision', ['allowed', 'send_at', 'reason'])
+
+
+def _key(user_id):
+    return f"notification_policy:{user_id}"
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _zone(name):
+    try:
+        return ZoneInfo(name or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo('UTC')
+
+
+def _domain(address):
+    return address.rsplit('@', 1)[-1].lower() if address and '@' in address else ''
+
+
+def _channel_blocks(blocks, user_email, phone_number):
+    """Fold active blocklist rows into a blocked flag per channel"""
+    from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', '').lower()
+    sms_sender = getattr(settings, 'TWILIO_PHONE_NUMBER', '')
+    blocked = {channel: False for channel in CHANNELS}
+    for block_type, value in blocks:
+        value = value.strip()
+        if block_type == 'email' and value.lower() in (from_email, (user_email or '').lower()):
+            blocked['email'] = True
+        elif block_type == 'domain' and value.lower().lstrip('@') == _domain(from_email):
+            blocked['email'] = True
+        elif block_type == 'phone' and value and value in (phone_number, sms_sender):
+            blocked['sms'] = True
+        elif block_type == 'sender_id' and value and value == sms_sender:
+            blocked['sms'] = True
+    return blocked
+
+
+def _compile(user, preference, detailed, quiet_hours, blocks, consents):
+    preference = preference or NotificationPreference(user=user)  # model defaults
+    profile = getattr(user, 'profile', None)
+    profile_tz = getattr(profile, 'timezone', 'UTC')
+    blocked = _channel_blocks(blocks, user.email, getattr(profile, 'phone_number', ''))
+
+    channels = {
+        'email': {'alerts': preference.email_alerts, 'otp': preference.email_otp,
+                  'marketing': preference.email_marketing},
+        'sms': {'alerts': preference.sms_alerts, 'otp': preference.sms_otp, 'marketing': False},
+        'in_app': {'alerts': True, 'otp': True, 'marketing': True},
+        'push': {'alerts': preference.push_enabled, 'otp': preference.push_enabled,
+                 'marketing': preference.push_enabled},
+    }
+    for channel, flags in channels.items():
+        flags['blocked'] = blocked[channel]
+
+    types = {
+        row.notification_type: {
+            'email': row.email_enabled,
+            'sms': row.sms_enabled,
+            'in_app': row.in_app_enabled,
+            'push': row.push_enabled,
+            'quiet': row.respect_quiet_hours,
+            'delay': row.delay_minutes,
+            'high': row.priority == 'high',
+        }
+        for row in detailed
+    }
+
+    quiet = [
+        [row.day_of_week, _minutes(row.start_time), _minutes(row.end_time), row.allow_critical_only, row.timezone]
+        for row in quiet_hours
+    ]
+    if preference.quiet_hours_enabled and preference.quiet_start and preference.quiet_end:
+        quiet.append([-1, _minutes(preference.quiet_start), _minutes(preference.quiet_end), True, profile_tz])
+
+    return {
+        'ch': channels,
+        'types': types,
+        'quiet': quiet,
+        'consent': {row.consent_type: row.is_consented for row in consents},
+    }
+
+
+def _quiet_until(quiet, now, critical):
+    """End of the quiet window `now` falls in, or None when sending is allowed now"""
+    until = None
+    for day, start, end, critical_only, tz in quiet:
+        if critical and critical_only:
+            continue
+        local = now.astimezone(_zone(tz))
+        minute = local.hour * 60 + local.minute
+        today = local.weekday()
+        if start <= end:
+            inside = start <= minute < end and day in (-1, today)
+            end_day = local.date()
+        elif minute >= start:  # window crosses midnight, we are before it
+            inside = day in (-1, today)
+            end_day = local.date() + timedelta(days=1)
+        else:  # after midnight, window started yesterday
+            inside = minute < end and day in (-1, (today - 1) % 7)
+            end_day = local.date()
+        if inside:
+            window_end = datetime.combine(end_day, time(end // 60, end % 60), tzinfo=local.tzinfo)
+            until = window_end if until is None else max(until, window_end)
+    return until
+
+
+def _decide(policy, channel, notification_type, category, critical, now):
+    flags = policy['ch'].get(channel)
+    if flags is None:
+        return PolicyDecision(False, None, 'unknown_channel')
+    if flags['blocked']:
+        return PolicyDecision(False, None, 'blocked')
+    if not flags.get(category, True):
+        return PolicyDecision(False, None, 'channel_disabled')
+
+    consent_type = _CATEGORY_CONSENT.get(category)
+    consent = policy['consent'].get(consent_type)
+    if consent is False or (consent is None and consent_type in _OPT_IN_CONSENTS):
+        return PolicyDecision(False, None, 'no_consent')
+
+    rule = policy['types'].get(notification_type)
+    if rule is not None and not rule.get(channel, False):
+        return PolicyDecision(False, None, 'type_disabled')
+
+    # OTPs are interactive: never delayed or held for quiet hours
+    if category == 'otp':
+        return PolicyDecision(True, None, 'allowed')
+
+    send_at = None
+    if rule is not None and rule['delay']:
+        send_at = now + timedelta(minutes=rule['delay'])
+    if rule is None or rule['quiet']:
+        critical = critical or (rule is not None and rule['high'])
+        until = _quiet_until(policy['quiet'], send_at or now, critical)
+        if until is not None:
+            return PolicyDecision(True, until, 'quiet_hours')
+    return PolicyDecision(True, send_at, 'delayed' if send_at else 'allowed')
+
+
+class NotificationPolicy:
+    """Cached per-user notification policy"""
+
+    @staticmethod
+    def compile_many(user_ids):
+        """Build policies from the five source tables: five queries for the whole batch"""
+        user_ids = list(user_ids)
+        users = User.objects.filter(pk__in=user_ids).select_related('profile').only(
+            'id', 'email', 'profile__timezone', 'profile__phone_number',
+        )
+        preferences = {row.user_id: row for row in NotificationPreference.objects.filter(user_id__in=user_ids)}
+        detailed, quiet_hours, blocks, consents = (defaultdict(list) for _ in range(4))
+        for row in DetailedNotificationPreference.objects.filter(user_id__in=user_ids):
+            detailed[row.user_id].append(row)
+        for row in QuietHours.objects.filter(user_id__in=user_ids, is_enabled=True):
+            quiet_hours[row.user_id].append(row)
+        for user_id, block_type, value in NotificationBlocklist.objects.filter(
+            user_id__in=user_ids, is_active=True
+        ).values_list('user_id', 'block_type', 'blocked_value'):
+            blocks[user_id].append((block_type, value))
+        for row in NotificationConsent.objects.filter(user_id__in=user_ids).only(
+            'user_id', 'consent_type', 'is_consented',
+        ):
+            consents[row.user_id].append(row)
+
+        return {
+            str(user.pk): _compile(
+                user, preferences.get(user.pk), detailed[user.pk], quiet_hours[user.pk],
+                blocks[user.pk], consents[user.pk],
+            )
+            for user in users
+        }
+
+    @classmethod
+    def get_many(cls, user_ids):
+        """{str(user_id): policy}; one MGET, misses compiled together and cached"""
+        keys = [str(user_id) for user_id in user_ids]
+        if hasattr(redis_client, 'mget'):
+            raws = redis_client.mget([_key(user_id) for user_id in keys])
+        else:
+            raws = [redis_client.get(_key(user_id)) for user_id in keys]
+
+        policies = {}
+        missing = []
+        for user_id, raw in zip(keys, raws):
+            if raw:
+                policies[user_id] = json.loads(raw)
+            else:
+                missing.append(user_id)
+        if missing:
+            compiled = cls.compile_many(missing)
+            for user_id, policy in compiled.items():
+                redis_client.setex(_key(user_id), CACHE_TTL_SECONDS, json.dumps(policy))
+            policies.update(compiled)
+        return policies
+
+    @classmethod
+    def get(cls, user_id):
+        return cls.get_many([user_id]).get(str(user_id))
+
+    @classmethod
+    def evaluate(cls, user_id, channel, notification_type, category='alerts', critical=False, now=None):
+        """
+        May this notification go out on `channel`, and when?
+
+        notification_type: a DetailedNotificationPreference type or a registry
+        alert name (mapped through ALERT_NOTIFICATION_TYPES).
+        category: 'alerts', 'otp' or 'marketing' (NotificationPreference switches).
+        Returns PolicyDecision(allowed, send_at, reason); send_at None means now.
+        """
+        policy = cls.get(user_id)
+        if policy is None:
+            return PolicyDecision(False, None, 'unknown_user')
+        notification_type = ALERT_NOTIFICATION_TYPES.get(notification_type, notification_type)
+        return _decide(policy, channel, notification_type, category, critical, now or timezone.now())
+
+    @classmethod
+    def evaluate_many(cls, user_ids, channel, notification_type, category='alerts', critical=False, now=None):
+        """evaluate() for a fan-out: {str(user_id): PolicyDecision}"""
+        now = now or timezone.now()
+        notification_type = ALERT_NOTIFICATION_TYPES.get(notification_type, notification_type)
+        policies = cls.get_many(user_ids)
+        return {
+            user_id: _decide(policy, channel, notification_type, category, critical, now)
+            for user_id, policy in policies.items()
+        }
+
+    @staticmethod
+    def invalidate(user_id):
+        """Drop a user's compiled policy once the current transaction commits"""
+        key = _key(user_id)
+        transaction.on_commit(lambda: redis_client.delete(key))
@@ -0,0 +1,216 @@
+"""
+Notification Template Registry - Compiled email templates with shared context
+
+Every notification email is a registered template:
+
+    registry.register('new_device_login', 'notification/email/new_device_login.html',
+                      subject='🔐 New Device Login Detected', email_type='security_alert')
+
+    email = registry.render('new_device_login', {'user': user, 'device_name': ...})
+    send_app_email(subject=email.subject, message=email.text, html_message=email.html, ...)
+
+Templates are compiled once per process on first use (or all at once with
+warm()), and rendered directly against the compiled template with a context
+whose bottom layer is the shared site context (site_name, site_url,
+support_email), built once from settings. The plain-text alternative is
+generated from the rendered HTML.
+"""
+
+import re
+import threading
+from dataclasses import dataclass
+from html import unescape
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template import Context, engines
+
+
+@dataclass(frozen=True)
+class NotificationTemplate:
+    name: str
+    template_name: str
+    subject: str
+    email_type: str
+
+    @property
+    def critical(self):
+        """Security alerts are critical: critical-only quiet hours do not hold them"""
+        return self.email_type == 'security_alert'
+
+
+@dataclass(frozen=True)
+class RenderedEmail:
+    subject: str
+    html: str
+    text: str
+    template_name: str
+    email_type: str
+
+
+# Elements whose content is not part of the readable text
+_HIDDEN = re.compile(r'<(head|style|script|title)\b.*?</\1\s*>|<!--.*?-->|<!DOCTYPE[^>]*>', re.I | re.S)
+# One token per tag (closing slash, name, attributes) or per run of text
+_TOKENS = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9]*)([^>]*)>|([^<]+)')
+_HREF = re.compile(r"""href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.I)
+_WHITESPACE = re.compile(r'\s+')
+_BLANK_LINES = re.compile(r'\n{3,}')
+
+_PARAGRAPH = frozenset({'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'table', 'hr', 'blockquote'})
+_LINE = frozenset({'br', 'div', 'tr'})
+
+
+def html_to_text(html):
+    """
+    Plain-text alternative for an HTML email body; plain input is returned unchanged.
+
+    Paragraph-level elements become blank lines, <br>/<div>/<tr> line breaks,
+    list items "- " bullets, and links keep their URL after the link text.
+    """
+    if not html or '<' not in html:
+        return html or ''
+
+    out = []
+    href = None
+    link_start = 0
+    for match in _TOKENS.finditer(_HIDDEN.sub('', html)):
+        closing, tag, attrs, data = match.groups()
+        at_line_start = not out or out[-1].endswith('\n')
+        if data is not None:
+            # Indentation between tags is not text
+            if not (at_line_start and data.isspace()):
+                out.append(unescape(_WHITESPACE.sub(' ', data)))
+            continue
+        tag = tag.lower()
+        if tag in _PARAGRAPH:
+            out.append('\n\n')
+        elif tag in _LINE:
+            if not at_line_start or tag == 'br':
+                out.append('\n')
+        elif tag == 'li' and not closing:
+            out.append('\n- ')
+        elif tag in ('td', 'th') and closing:
+            out.append(' ')
+        elif tag == 'a':
+            if not closing:
+                found = _HREF.search(attrs)
+                href = next((group for group in found.groups() if group is not None), '') if found else ''
+                link_start = len(out)
+            elif href is not None:
+                label = ''.join(out[link_start:]).strip()
+                if href and href != label and not href.startswith('#'):
+                    out.append(f' ({unescape(href)})')
+                href = None
+
+    lines = (line.strip() for line in ''.join(out).split('\n'))
+    return _BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()
+
+
+class TemplateRegistry:
+    """Named notification templates, compiled once per process"""
+
+    def __init__(self):
+        self._templates = {}
+        self._compiled = {}
+        self._shared = None
+        self._lock = threading.Lock()
+
+    def register(self, name, template_name, subject, email_type):
+        self._templates[name] = NotificationTemplate(name, template_name, subject, email_type)
+        self._compiled.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self._templates
+
+    def get(self, name):
+        return self._templates[name]
+
+    def names(self):
+        return list(self._templates)
+
+    def shared_context(self):
+        """Site-wide values every template may use, built once from settings"""
+        if self._shared is None:
+            self._shared = {
+                'site_name': getattr(settings, 'SITE_NAME', 'Real MFA'),
+                'site_url': getattr(settings, 'FRONTEND_URL', '').rstrip('/'),
+                'support_email': getattr(settings, 'SUPPORT_EMAIL', '') or getattr(settings, 'DEFAULT_FROM_EMAIL', ''),
+            }
+        return self._shared
+
+    def compiled(self, name):
+        """The compiled django.template.base.Template for a registered name"""
+        template = self._compiled.get(name)
+        if template is None:
+            with self._lock:
+                template = self._compiled.get(name)
+                if template is None:
+                    backend_template = engines['django'].get_template(self._templates[name].template_name)
+                    template = self._compiled[name] = backend_template.template
+        return template
+
+    def warm(self):
+        """Compile every registered template up front (e.g. when a worker process starts)"""
+        for name in self._templates:
+            self.compiled(name)
+
+    def reset(self):
+        self._compiled.clear()
+        self._shared = None
+
+    def render_html(self, name, context=None):
+        """Render a registered template's HTML body"""
+        template = self.compiled(name)
+        # Shared values are the bottom layer; per-message values shadow them
+        ctx = Context(self.shared_context(), autoescape=True)
+        with ctx.push(context or {}):
+            return template.render(ctx)
+
+    def render(self, name, context=None):
+        """Render a registered template; returns subject, HTML and plain-text bodies"""
+        entry = self._templates[name]
+        html = self.render_html(name, context)
+        return RenderedEmail(
+            subject=entry.subject,
+            html=html,
+            text=html_to_text(html),
+            template_name=entry.template_name,
+            email_type=entry.email_type,
+        )
+
+
+registry = TemplateRegistry()
+
+
+@receiver(setting_changed)
+def _reset_registry(setting, **kwargs):
+    if setting in ('TEMPLATES', 'SITE_NAME', 'FRONTEND_URL', 'SUPPORT_EMAIL', 'DEFAULT_FROM_EMAIL'):
+        registry.reset()
+
+
+# Security and account alerts (send_security_alert)
+registry.register('new_device_login', 'notification/email/new_device_login.html',
+                  subject='🔐 New Device Login Detected', email_type='security_alert')
+registry.register('mfa_enabled', 'notification/email/mfa_enabled.html',
+                  subject='✅ Two-Factor Authentication Enabled', email_type='security_alert')
+registry.register('mfa_disabled', 'notification/email/mfa_disabled.html',
+                  subject='⚠️ Two-Factor Authentication Disabled', email_type='security_alert')
+registry.register('password_changed', 'notification/email/password_changed.html',
+                  subject='🔑 Password Changed Successfully', email_type='security_alert')
+registry.register('profile_changed', 'notification/email/profile_changed.html',
+                  subject='👤 Profile Information Updated', email_type='account_alert')
+registry.register('suspicious_login', 'notification/email/suspicious_login.html',
+                  subject='🚨 Suspicious Login Attempt', email_type='security_alert')
+registry.register('device_verified', 'notification/email/device_verified.html',
+                  subject='✓ New Device Verified', email_type='security_alert')
+registry.register('account_digest', 'notification/email/account_digest.html',
+                  subject='📋 Recent Account Activity', email_type='account_alert')
+
+# Transactional emails (Real_MFA.celery_tasks)
+registry.register('email_verification', 'notification/email/email_verification.html',
+                  subject='Verify Your Email - Real MFA', email_type='email_verification')
+registry.register('password_reset_otp', 'notification/email/password_reset_otp.html',
+                  subject='Password Reset Code - Real MFA', email_type='password_reset')
+registry.register('device_verification_otp', 'notification/email/device_verification_otp.html',
+                  subject='Device Verification Code - Real MFA', email_type='device_verification')
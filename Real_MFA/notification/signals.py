@@ -0,0 +1,45 @@
+"""
+Notification Signals - Keep compiled notification policies in sync with their sources
+"""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.models import Profile, User
+from .models import (
+    DetailedNotificationPreference, NotificationBlocklist, NotificationConsent,
+    NotificationPreference, QuietHours,
+)
+from .policy import NotificationPolicy
+
+# Rows compiled into NotificationPolicy
+POLICY_SOURCES = (
+    NotificationPreference, DetailedNotificationPreference, QuietHours,
+    NotificationBlocklist, NotificationConsent,
+)
+
+# User / Profile fields the compiled policy depends on
+_USER_FIELDS = frozenset({'email'})
+_PROFILE_FIELDS = frozenset({'timezone', 'phone_number'})
+
+
+def invalidate_policy(sender, instance, **kwargs):
+    """Drop the compiled policy when any of its source rows changes"""
+    NotificationPolicy.invalidate(instance.user_id)
+
+
+for model in POLICY_SOURCES:
+    post_save.connect(invalidate_policy, sender=model, dispatch_uid=f'notification_policy_save_{model.__name__}')
+    post_delete.connect(invalidate_policy, sender=model, dispatch_uid=f'notification_policy_delete_{model.__name__}')
+
+
+@receiver(post_save, sender=User)
+def invalidate_policy_on_user_change(sender, instance, created, update_fields=None, **kwargs):
+    if not created and (update_fields is None or _USER_FIELDS.intersection(update_fields)):
+        NotificationPolicy.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_policy_on_profile_change(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is None or _PROFILE_FIELDS.intersection(update_fields):
+        NotificationPolicy.invalidate(instance.user_id)
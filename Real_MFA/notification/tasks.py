@@ -1,81 +1,363 @@
 """Celery tasks for notification retry workflows."""
 
+import logging
+import math
+import random
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
 from celery import shared_task
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
 from django.utils import timezone
 
-from Real_MFA.email_provider import send_app_email
-from .models import EmailNotification
+from Real_MFA.email_provider import send_app_email_batch
+from .models import EmailNotification, NotificationBody, NotificationOutbox
+from .registry import html_to_text, registry
+from .utils import restore_context, send_security_alert
+
+logger = logging.getLogger(__name__)
+
+
+def _drainable(now):
+    """Pending and failed rows that are due (index range scan on status, next_retry_at)."""
+    return EmailNotification.objects.filter(status__in=["pending", "failed"], next_retry_at__lte=now)
+
+
+def retry_delay(attempt):
+    """
+    Backoff before retry number `attempt` (1-based): exponential from
+    NOTIFICATION_RETRY_BASE_SECONDS, capped at NOTIFICATION_RETRY_MAX_SECONDS,
+    with equal jitter so rows that failed together do not retry together.
+    """
+    base = float(getattr(settings, "NOTIFICATION_RETRY_BASE_SECONDS", 60))
+    cap = float(getattr(settings, "NOTIFICATION_RETRY_MAX_SECONDS", 6 * 3600))
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+
+def _claim_batch(owner, batch_size, lease_seconds):
+    """
+    Lease up to batch_size due rows to this worker, longest-waiting first.
+
+    The lease pushes next_retry_at out by lease_seconds, so a claimed row is
+    simply not due for anyone else; if a worker dies mid-send its rows come
+    due again when the lease runs out.
+    PostgreSQL locks the candidates with FOR UPDATE SKIP LOCKED, so workers
+    never wait on each other's batches. Elsewhere (SQLite) the conditional
+    lease UPDATE alone is the claim: a row already leased by another worker
+    no longer matches it.
+    """
+    while True:
+        now = timezone.now()
+        candidates = _drainable(now).order_by("next_retry_at")
+        lease = {"lease_owner": owner, "next_retry_at": now + timedelta(seconds=lease_seconds)}
+
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                ids = list(candidates.select_for_update(skip_locked=True).values_list("id", flat=True)[:batch_size])
+                EmailNotification.objects.filter(pk__in=ids).update(**lease)
+        else:
+            ids = list(candidates.values_list("id", flat=True)[:batch_size])
+            _drainable(now).filter(pk__in=ids).update(**lease)
+
+        if not ids:
+            return []
+        claimed = list(
+            EmailNotification.objects.filter(pk__in=ids, lease_owner=owner)
+            .select_related("body_content").order_by("next_retry_at")
+        )
+        if claimed:
+            return claimed
+        # Another worker leased every candidate first; look again
+
+
+def _chunks(notifications, threads):
+    """Split a claimed batch into per-request (Brevo) or per-thread (SMTP) chunks."""
+    groups = defaultdict(list)
+    for notification in notifications:
+        groups[notification.template_name].append(notification)
+
+    mode = str(getattr(settings, "EMAIL_DELIVERY_MODE", "smtp")).strip().lower()
+    for group in groups.values():
+        if mode == "brevo_api":
+            size = int(getattr(settings, "BREVO_BATCH_SIZE", 100))
+        else:
+            size = math.ceil(len(group) / threads)
+        for start in range(0, len(group), size):
+            yield group[start:start + size]
+
 
+def _send_chunk(notifications):
+    """Runs on a pool thread: network only, no database access."""
+    return send_app_email_batch([
+        {
+            "to": notification.to_email,
+            "subject": notification.subject,
+            "message": html_to_text(notification.body),
+            "html_message": notification.body,
+        }
+        for notification in notifications
+    ], lane="bulk")
 
-def _plain_text_from_body(body: str) -> str:
-    """Fallback plain-text body for API providers that also expect text content."""
-    if not body:
-        return ""
-    return body.replace("<br>", "\n").replace("<br/>", "\n").replace("<br />", "\n")
+
+# Fields record_send_failure changes
+FAILURE_FIELDS = ["status", "provider", "error_message", "lease_owner", "retry_count", "next_retry_at"]
+
+
+def record_send_failure(notification, result, now):
+    """
+    Apply a failed send result (see send_app_email_batch) to a row, unsaved.
+
+    The lease is released and the row rescheduled with retry_delay(), or
+    dead-lettered when the failure is permanent or max_retries is reached.
+    Rows the send quota throttled keep their status and retry count and
+    come due again shortly.
+    """
+    notification.provider = result.get("provider", notification.provider)
+    notification.error_message = result["error"]
+    notification.lease_owner = ""
+    if result.get("throttled"):
+        # Send quota exhausted: not an attempt, try again shortly
+        notification.next_retry_at = now + timedelta(seconds=random.uniform(1, 10))
+        return
+    notification.retry_count += 1
+    if result.get("permanent") or notification.retry_count >= notification.max_retries:
+        notification.status = "dead"
+    else:
+        notification.status = "failed"
+        notification.next_retry_at = now + retry_delay(notification.retry_count)
+
+
+def _apply_results(notifications, results):
+    """
+    Record outcomes and release the leases.
+
+    Sent rows share one UPDATE; only provider message ids differ per row.
+    Failed rows go through record_send_failure.
+    """
+    now = timezone.now()
+    sent = defaultdict(list)
+    message_ids = []
+    failed = []
+    for notification, result in zip(notifications, results):
+        provider = result.get("provider", notification.provider)
+        if "error" not in result:
+            sent[provider].append(notification.pk)
+            if result.get("message_id"):
+                notification.provider_message_id = result["message_id"]
+                message_ids.append(notification)
+            continue
+
+        record_send_failure(notification, result, now)
+        failed.append(notification)
+
+    with transaction.atomic():
+        for provider, ids in sent.items():
+            EmailNotification.objects.filter(pk__in=ids).update(
+                status="sent", sent_at=now, provider=provider, lease_owner="",
+            )
+        EmailNotification.objects.bulk_update(message_ids, ["provider_message_id"])
+        EmailNotification.objects.bulk_update(failed, FAILURE_FIELDS)
+
+    dead = sum(1 for notification in failed if notification.status == "dead")
+    return sum(len(ids) for ids in sent.values()), len(failed) - dead, dead
 
 
 @shared_task(bind=True)
 def send_pending_notifications(self):
     """
-    Retry unsent email notifications.
+    Drain due email notifications.
 
-    Processes:
+    Processes rows whose next_retry_at has passed:
     - status='pending'
-    - status='failed' with retry_count < max_retries
-    """
-    pending_qs = EmailNotification.objects.filter(status="pending")
-    retry_qs = EmailNotification.objects.filter(status="failed")
-
-    total_candidates = pending_qs.count()
-    total_candidates += sum(1 for item in retry_qs if item.is_retryable())
-
-    sent_count = 0
-    failed_count = 0
-
-    # Send all pending records first.
-    for notification in pending_qs.iterator():
-        try:
-            result = send_app_email(
-                subject=notification.subject,
-                message=_plain_text_from_body(notification.body),
-                recipient_list=[notification.to_email],
-                html_message=notification.body,
-                fail_silently=False,
-            )
-            notification.provider = result.get("provider", notification.provider)
-            notification.save(update_fields=["provider"])
-            notification.mark_sent(provider_message_id=result.get("message_id") or None)
-            sent_count += 1
-        except Exception as exc:
-            notification.increment_retry()
-            notification.mark_failed(str(exc))
-            failed_count += 1
-
-    # Retry failed records that are still retryable.
-    for notification in retry_qs.iterator():
-        if not notification.is_retryable():
-            continue
-        try:
-            result = send_app_email(
-                subject=notification.subject,
-                message=_plain_text_from_body(notification.body),
-                recipient_list=[notification.to_email],
-                html_message=notification.body,
-                fail_silently=False,
-            )
-            notification.provider = result.get("provider", notification.provider)
-            notification.save(update_fields=["provider"])
-            notification.mark_sent(provider_message_id=result.get("message_id") or None)
-            sent_count += 1
-        except Exception as exc:
-            notification.increment_retry()
-            notification.mark_failed(str(exc))
-            failed_count += 1
-
-    return {
+    - status='failed' (rescheduled with exponential backoff)
+
+    Batches are leased to this worker, so overlapping runs and several
+    workers drain the queue in parallel without sending a row twice.
+    Each batch is sent on a bounded thread pool; rows sharing a template go
+    through the Brevo batch endpoint together. Sends take permits on the
+    bulk lane of the provider send quota, behind OTPs and live alerts.
+    The run stops when nothing is due or after NOTIFICATION_DRAIN_MAX_SECONDS.
+    """
+    batch_size = int(getattr(settings, "NOTIFICATION_DRAIN_BATCH_SIZE", 200))
+    threads = int(getattr(settings, "NOTIFICATION_DRAIN_THREADS", 4))
+    lease_seconds = int(getattr(settings, "NOTIFICATION_DRAIN_LEASE_SECONDS", 300))
+    max_seconds = float(getattr(settings, "NOTIFICATION_DRAIN_MAX_SECONDS", 50))
+    owner = uuid.uuid4().hex
+
+    started = time.monotonic()
+    claimed = sent_count = failed_count = dead_count = batches = 0
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="notification-drain") as pool:
+        while time.monotonic() - started < max_seconds:
+            notifications = _claim_batch(owner, batch_size, lease_seconds)
+            if not notifications:
+                break
+            batches += 1
+            claimed += len(notifications)
+
+            chunks = list(_chunks(notifications, threads))
+            for chunk, results in zip(chunks, pool.map(_send_chunk, chunks)):
+                sent, failed, dead = _apply_results(chunk, results)
+                sent_count += sent
+                failed_count += failed
+                dead_count += dead
+
+    elapsed = time.monotonic() - started
+    metrics = {
         "status": "completed",
         "at": timezone.now().isoformat(),
-        "candidates": total_candidates,
+        "claimed": claimed,
+        "batches": batches,
         "sent": sent_count,
         "failed": failed_count,
+        "dead": dead_count,
+        "elapsed_seconds": round(elapsed, 3),
+        "sent_per_second": round(sent_count / elapsed, 2) if elapsed else 0.0,
+    }
+    logger.info("Notification drain: %s", metrics)
+    return metrics
+
+
+@shared_task(bind=True)
+def deliver_notification_outbox(self, outbox_id):
+    """
+    Outbox consumer: render and send one queued security alert.
+
+    The pending -> processing UPDATE is the claim, so a row published twice
+    (on commit and again by the sweep) is only sent once. Provider failures
+    are handled by send_security_alert (the EmailNotification row is retried
+    by send_pending_notifications); anything else puts the row back to
+    pending for the sweep, until NOTIFICATION_OUTBOX_MAX_ATTEMPTS.
+    """
+    claimed = NotificationOutbox.objects.filter(pk=outbox_id, status="pending", hold_until__isnull=True).update(
+        status="processing", claimed_at=timezone.now(), attempts=F("attempts") + 1,
+    )
+    if not claimed:
+        return {"status": "skipped", "outbox_id": str(outbox_id)}
+
+    outbox = NotificationOutbox.objects.select_related("user").get(pk=outbox_id)
+    try:
+        send_security_alert(outbox.user, outbox.alert_type, restore_context(outbox.context))
+    except Exception as exc:
+        max_attempts = int(getattr(settings, "NOTIFICATION_OUTBOX_MAX_ATTEMPTS", 5))
+        outbox.status = "failed" if outbox.attempts >= max_attempts else "pending"
+        outbox.error_message = str(exc)
+        outbox.save(update_fields=["status", "error_message", "updated_at"])
+        logger.error("Outbox %s (%s) failed: %s", outbox_id, outbox.alert_type, exc)
+        return {"status": outbox.status, "outbox_id": str(outbox_id)}
+
+    outbox.status = "delivered"
+    outbox.processed_at = timezone.now()
+    outbox.save(update_fields=["status", "processed_at", "updated_at"])
+    return {"status": "delivered", "outbox_id": str(outbox_id)}
+
+
+@shared_task(bind=True)
+def deliver_notification_digest(self, user_id):
+    """
+    Send a user's held low-severity alerts once their digest window closed.
+
+    A single held alert goes out as its own email; several are merged into
+    one account_digest email. The held rows are claimed together with one
+    conditional UPDATE, so a digest published twice is only sent once.
+    """
+    now = timezone.now()
+    token = now
+    # Scheduled with eta=hold_until; allow for clock skew between hosts
+    claimed = NotificationOutbox.objects.filter(
+        user_id=user_id, status="pending", hold_until__lte=now + timedelta(seconds=1),
+    ).update(status="processing", claimed_at=token, attempts=F("attempts") + 1)
+    if not claimed:
+        return {"status": "skipped", "user_id": str(user_id)}
+
+    rows = list(
+        NotificationOutbox.objects.filter(user_id=user_id, status="processing", claimed_at=token)
+        .select_related("user").order_by("created_at")
+    )
+    user = rows[0].user
+    try:
+        if len(rows) == 1:
+            send_security_alert(user, rows[0].alert_type, restore_context(rows[0].context), lane="bulk")
+        else:
+            alerts = [
+                {"subject": registry.get(row.alert_type).subject, "at": row.created_at, **restore_context(row.context)}
+                for row in rows
+            ]
+            send_security_alert(user, "account_digest", {"alerts": alerts}, lane="bulk")
+    except Exception as exc:
+        max_attempts = int(getattr(settings, "NOTIFICATION_OUTBOX_MAX_ATTEMPTS", 5))
+        for row in rows:
+            row.status = "failed" if row.attempts >= max_attempts else "pending"
+            row.error_message = str(exc)
+            row.updated_at = timezone.now()
+        NotificationOutbox.objects.bulk_update(rows, ["status", "error_message", "updated_at"])
+        logger.error("Digest for %s (%s alerts) failed: %s", user_id, len(rows), exc)
+        return {"status": "failed", "user_id": str(user_id), "alerts": len(rows)}
+
+    NotificationOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(
+        status="delivered", processed_at=timezone.now(), updated_at=timezone.now(),
+    )
+    return {"status": "delivered", "user_id": str(user_id), "alerts": len(rows)}
+
+
+@shared_task(bind=True)
+def sweep_notification_outbox(self):
+    """
+    Recover outbox rows the on-commit publish did not get through.
+
+    - processing rows claimed more than NOTIFICATION_OUTBOX_STALE_SECONDS ago
+      (worker died mid-send) go back to pending
+    - pending rows older than that are published again; held (digest) rows
+      are published per user once their window is STALE_SECONDS past
+    - delivered rows are purged after NOTIFICATION_OUTBOX_RETENTION_DAYS
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=int(getattr(settings, "NOTIFICATION_OUTBOX_STALE_SECONDS", 120)))
+    retention = now - timedelta(days=int(getattr(settings, "NOTIFICATION_OUTBOX_RETENTION_DAYS", 7)))
+    batch_size = int(getattr(settings, "NOTIFICATION_DRAIN_BATCH_SIZE", 200))
+
+    reclaimed = NotificationOutbox.objects.filter(status="processing", claimed_at__lt=stale).update(status="pending")
+    stale_ids = list(
+        NotificationOutbox.objects.filter(status="pending", hold_until__isnull=True, created_at__lt=stale)
+        .order_by("created_at").values_list("id", flat=True)[:batch_size]
+    )
+    for outbox_id in stale_ids:
+        deliver_notification_outbox.delay(str(outbox_id))
+    digest_users = list(
+        NotificationOutbox.objects.filter(status="pending", hold_until__lt=stale)
+        .order_by().values_list("user_id", flat=True).distinct()[:batch_size]
+    )
+    for user_id in digest_users:
+        deliver_notification_digest.delay(str(user_id))
+    purged, _ = NotificationOutbox.objects.filter(status="delivered", processed_at__lt=retention).delete()
+
+    metrics = {
+        "reclaimed": reclaimed, "republished": len(stale_ids),
+        "digests": len(digest_users), "purged": purged,
     }
+    if reclaimed or stale_ids or digest_users:
+        logger.warning("Notification outbox sweep: %s", metrics)
+    return metrics
+
+
+@shared_task(bind=True)
+def purge_orphan_notification_bodies(self):
+    """
+    Delete stored bodies no EmailNotification or NotificationLog refers to.
+    Only rows not stored or reused for a day are considered, so a body
+    (new or deduplicated) stored moments before its notification row is
+    never removed in between.
+    """
+    cutoff = timezone.now() - timedelta(days=1)
+    deleted, _ = NotificationBody.objects.filter(
+        last_referenced_at__lt=cutoff,
+        email_notifications__isnull=True,
+        notification_logs__isnull=True,
+    ).delete()
+    logger.info("Purged %s orphan notification bodies", deleted)
+    return {"status": "completed", "deleted": deleted}
@@ -1,3 +1,730 @@
-from django.test import TestCase
+import os
+import smtplib
+import unittest
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin import site
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import User
+from benchmarks.brevo_stub import BrevoStubServer
+from benchmarks.smtp_stub import SMTPStubServer
+from Real_MFA.email_provider import BrevoClient, SMTPConnectionPool, send_app_email_batch, smtp_pool
+from Real_MFA.email_quota import SendQuota, SendQuotaExceeded
+from .models import (
+    EmailNotification, NotificationBlocklist, NotificationBody, NotificationConsent, NotificationLog,
+    NotificationOutbox, NotificationPreference, QuietHours,
+)
+from .policy import NotificationPolicy, PolicyDecision
+from .registry import html_to_text, registry
+from . import tasks
+from .tasks import (
+    _chunks,
+    _claim_batch,
+    deliver_notification_digest,
+    deliver_notification_outbox,
+    purge_orphan_notification_bodies,
+    send_pending_notifications,
+    sweep_notification_outbox,
+)
+from .utils import queue_security_alert, send_security_alert
+
+# Redis stand-in for the cache-backed KV store
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE, EMAIL_SEND_RATE_LIMITS={})
+class InlineSecurityAlertTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice', email='alice@example.com', email_verified=True)
+
+    def _alert(self, **patches):
+        with mock.patch('notification.utils.send_app_email', **patches) as send:
+            notification = send_security_alert(self.user, 'password_changed', {})
+        notification.refresh_from_db()
+        return notification, send
+
+    def test_drain_cannot_claim_a_row_being_sent_inline(self):
+        claimed_mid_send = []
+
+        def send(**kwargs):
+            claimed_mid_send.extend(_claim_batch('drain-worker', 10, 300))
+            return {'provider': 'smtp', 'message_id': 'm-1'}
+
+        notification, _ = self._alert(side_effect=send)
+        self.assertEqual(claimed_mid_send, [])
+        self.assertEqual(notification.status, 'sent')
+        self.assertEqual(notification.lease_owner, '')
+        self.assertEqual(_claim_batch('drain-worker', 10, 300), [])
+
+    def test_held_alert_is_due_at_send_at(self):
+        send_at = timezone.now() + timedelta(hours=2)
+        decision = PolicyDecision(True, send_at, 'quiet_hours')
+        with mock.patch('notification.utils.NotificationPolicy.evaluate', return_value=decision):
+            notification, send = self._alert()
+        send.assert_not_called()
+        self.assertEqual(notification.status, 'pending')
+        self.assertEqual(notification.lease_owner, '')
+        self.assertEqual(notification.next_retry_at, send_at)
+
+    def test_permanent_failure_is_dead_lettered(self):
+        refused = smtplib.SMTPRecipientsRefused({'alice@example.com': (550, b'No such user')})
+        notification, _ = self._alert(side_effect=refused)
+        self.assertEqual(notification.status, 'dead')
+        self.assertEqual(notification.retry_count, 1)
+        self.assertEqual(_claim_batch('drain-worker', 10, 300), [])
+
+    def test_transient_failure_is_retried_with_backoff(self):
+        before = timezone.now()
+        notification, _ = self._alert(side_effect=ConnectionError('reset by peer'))
+        self.assertEqual(notification.status, 'failed')
+        self.assertEqual(notification.retry_count, 1)
+        self.assertEqual(notification.lease_owner, '')
+        self.assertGreater(notification.next_retry_at, before)
+        self.assertEqual(_claim_batch('drain-worker', 10, 300), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, EMAIL_SEND_RATE_LIMITS={})
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='grace', email='grace@example.com', email_verified=True)
+        patcher = mock.patch('notification.tasks.deliver_notification_outbox.delay')
+        self.publish = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _queue(self):
+        return queue_security_alert(self.user, 'password_changed', {'changed_at': timezone.now()})
+
+    def test_rolled_back_request_sends_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    self._queue()
+                    raise RuntimeError('request failed')
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.publish.assert_not_called()
+
+    def test_committed_alert_is_published(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            outbox = self._queue()
+        self.publish.assert_called_once_with(str(outbox.pk))
+
+    def test_duplicate_publish_sends_once(self):
+        with self.captureOnCommitCallbacks():
+            outbox = self._queue()
+        with mock.patch('notification.utils.send_app_email', return_value={'provider': 'smtp'}) as send:
+            first = deliver_notification_outbox(str(outbox.pk))
+            second = deliver_notification_outbox(str(outbox.pk))
+        self.assertEqual(first['status'], 'delivered')
+        self.assertEqual(second['status'], 'skipped')
+        send.assert_called_once()
+        self.assertEqual(EmailNotification.objects.filter(user=self.user).count(), 1)
+
+    def test_sweep_republishes_lost_and_stalled_rows(self):
+        with self.captureOnCommitCallbacks():
+            lost = self._queue()
+            stalled = self._queue()
+        long_ago = timezone.now() - timedelta(minutes=10)
+        NotificationOutbox.objects.filter(pk=lost.pk).update(created_at=long_ago)
+        NotificationOutbox.objects.filter(pk=stalled.pk).update(
+            created_at=long_ago, status='processing', claimed_at=long_ago,
+        )
+
+        metrics = sweep_notification_outbox()
+        self.assertEqual(metrics['reclaimed'], 1)
+        self.assertEqual(metrics['republished'], 2)
+        self.assertEqual(
+            {call.args[0] for call in self.publish.call_args_list},
+            {str(lost.pk), str(stalled.pk)},
+        )
+
+
+class NotificationBodyStorageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='heidi', email='heidi@example.com', email_verified=True)
+        self.html = '<p>Your password was changed.</p>' * 40
+
+    def _email(self, body, **fields):
+        return EmailNotification(
+            user=self.user, to_email=self.user.email, subject='Password changed',
+            email_type='security_alert', template_name='password_changed', body=body, **fields,
+        )
+
+    def test_identical_bodies_are_stored_once(self):
+        EmailNotification.objects.bulk_create([
+            self._email(self.html, provider_message_id=f'app-{n}') for n in range(5)
+        ])
+        self._email(self.html, provider_message_id='app-single').save()
+        NotificationLog.objects.create(
+            user=self.user, channel='email', subject='Password changed',
+            message=self.html, recipient=self.user.email,
+        )
+        self.assertEqual(NotificationBody.objects.count(), 1)
+
+    def test_large_bodies_are_compressed_and_read_back(self):
+        notification = self._email(self.html)
+        notification.save()
+        stored = NotificationBody.objects.get()
+        self.assertTrue(stored.compressed)
+        self.assertEqual(stored.size, len(self.html))
+        self.assertLess(len(bytes(stored.content)), stored.size)
+
+        self.assertEqual(EmailNotification.objects.get(pk=notification.pk).body, self.html)
+        self.assertEqual(
+            EmailNotification.objects.select_related('body_content').get(pk=notification.pk).body, self.html,
+        )
+
+    def test_changing_the_body_stores_the_new_text(self):
+        notification = self._email('first')
+        notification.save()
+        notification.body = 'second'
+        notification.save(update_fields=['body'])
+        self.assertEqual(EmailNotification.objects.get(pk=notification.pk).body, 'second')
+        self.assertEqual(NotificationBody.objects.count(), 2)
+
+    def test_purge_keeps_referenced_bodies(self):
+        self._email(self.html).save()
+        orphan = NotificationBody.store('nobody reads this')
+        NotificationBody.objects.update(last_referenced_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(purge_orphan_notification_bodies()['deleted'], 1)
+        self.assertFalse(NotificationBody.objects.filter(pk=orphan).exists())
+        self.assertEqual(EmailNotification.objects.get().body, self.html)
+
+    def test_purge_spares_a_body_reused_since_the_cutoff(self):
+        # An old orphan is picked up again by a notification still being written
+        digest = NotificationBody.store(self.html)
+        NotificationBody.objects.update(
+            created_at=timezone.now() - timedelta(days=2), last_referenced_at=timezone.now() - timedelta(days=2),
+        )
+        self.assertEqual(NotificationBody.store_many([self.html, 'fresh']), [digest, NotificationBody.build('fresh').digest])
+
+        self.assertEqual(purge_orphan_notification_bodies()['deleted'], 0)
+        notification = self._email(self.html)
+        notification.save()
+        self.assertEqual(notification.body_content_id, digest)
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE, EMAIL_SEND_RATE_LIMITS={},
+    CELERY_TASK_ALWAYS_EAGER=False, NOTIFICATION_DIGEST_WINDOW_SECONDS=120,
+)
+class NotificationDigestTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='ivan', email='ivan@example.com', email_verified=True)
+        digest = mock.patch('notification.tasks.deliver_notification_digest.apply_async')
+        outbox = mock.patch('notification.tasks.deliver_notification_outbox.delay')
+        self.schedule_digest = digest.start()
+        self.publish = outbox.start()
+        self.addCleanup(digest.stop)
+        self.addCleanup(outbox.stop)
+
+    def _profile_changed(self, field):
+        with self.captureOnCommitCallbacks(execute=True):
+            return queue_security_alert(
+                self.user, 'profile_changed', {'changed_fields': [field], 'changed_at': timezone.now()},
+            )
+
+    def test_alerts_in_one_window_are_sent_as_one_digest(self):
+        first = self._profile_changed('first_name')
+        second = self._profile_changed('last_name')
+        self.assertIsNotNone(first.hold_until)
+        self.assertEqual(second.hold_until, first.hold_until)
+        self.schedule_digest.assert_called_once()
+        self.publish.assert_not_called()
+
+        NotificationOutbox.objects.update(hold_until=timezone.now() - timedelta(seconds=5))
+        with mock.patch('notification.utils.send_app_email', return_value={'provider': 'smtp'}) as send:
+            result = deliver_notification_digest(str(self.user.pk))
+            self.assertEqual(deliver_notification_digest(str(self.user.pk))['status'], 'skipped')
+
+        self.assertEqual(result, {'status': 'delivered', 'user_id': str(self.user.pk), 'alerts': 2})
+        send.assert_called_once()
+        notification = EmailNotification.objects.get(user=self.user)
+        self.assertEqual(notification.template_name, registry.get('account_digest').template_name)
+        self.assertEqual(set(NotificationOutbox.objects.values_list('status', flat=True)), {'delivered'})
+
+    def test_open_window_is_not_sent_early(self):
+        self._profile_changed('first_name')
+        self.assertEqual(deliver_notification_digest(str(self.user.pk))['status'], 'skipped')
+        self.assertFalse(EmailNotification.objects.exists())
+
+    def test_suspicious_login_is_never_held(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            outbox = queue_security_alert(self.user, 'suspicious_login', {'reason': 'new country'})
+        self.assertIsNone(outbox.hold_until)
+        self.publish.assert_called_once_with(str(outbox.pk))
+        self.schedule_digest.assert_not_called()
+
+
+# 10-token bucket that does not refill during a test
+@override_settings(
+    EMAIL_SEND_RATE_LIMITS={'smtp': (0.001, 10)},
+    EMAIL_QUOTA_LANE_RESERVE={'otp': 0.0, 'alert': 0.2, 'bulk': 0.5},
+)
+class SendQuotaTests(TestCase):
+    def setUp(self):
+        # Per-process bucket: the cache-backed KV has no Lua scripting
+        patcher = mock.patch('Real_MFA.email_quota.redis_client', object())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.quota = SendQuota()
+
+    def _drain(self, lane):
+        granted = 0
+        while self.quota.try_take('smtp', lane)[0]:
+            granted += 1
+        return granted
+
+    def test_lanes_leave_their_reserve_for_higher_lanes(self):
+        self.assertEqual(self._drain('bulk'), 5)
+        self.assertEqual(self._drain('alert'), 3)
+        self.assertEqual(self._drain('otp'), 2)
+
+    def test_acquire_gives_up_after_the_lane_wait(self):
+        self._drain('bulk')
+        with self.assertRaises(SendQuotaExceeded) as raised:
+            self.quota.acquire('smtp', 'bulk', timeout=0.01)
+        self.assertEqual(raised.exception.lane, 'bulk')
+        self.assertGreater(raised.exception.retry_after, 0)
+        self.quota.acquire('smtp', 'otp', timeout=0)
+
+    def test_unlimited_providers_always_grant(self):
+        self.assertTrue(self.quota.try_take('brevo_api', 'bulk')[0])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, EMAIL_DELIVERY_MODE='smtp', NOTIFICATION_DRAIN_MAX_SECONDS=5)
+class ThrottledDrainTests(TestCase):
+    def test_throttled_send_is_not_counted_as_a_retry(self):
+        user = User.objects.create(username='judy', email='judy@example.com', email_verified=True)
+        notification = EmailNotification.objects.create(
+            user=user, to_email=user.email, subject='Password changed', email_type='security_alert',
+            template_name='password_changed', body='<p>changed</p>', provider_message_id='app-throttled',
+        )
+        throttled = SendQuotaExceeded('smtp', 'bulk', 3.0)
+        with mock.patch('Real_MFA.email_provider.send_quota.acquire', side_effect=throttled):
+            metrics = send_pending_notifications()
+
+        notification.refresh_from_db()
+        self.assertEqual(metrics['failed'], 1)
+        self.assertEqual(notification.status, 'pending')
+        self.assertEqual(notification.retry_count, 0)
+        self.assertEqual(notification.lease_owner, '')
+        self.assertGreater(notification.next_retry_at, timezone.now())
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE, EMAIL_DELIVERY_MODE='smtp', NOTIFICATION_DRAIN_THREADS=2, NOTIFICATION_DRAIN_BATCH_SIZE=3,
+)
+class NotificationDrainTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='lena', email='lena@example.com', email_verified=True)
+
+    def _queue(self, count, template_name='password_changed'):
+        return [
+            EmailNotification.objects.create(
+                user=self.user, to_email=f'lena+{template_name}-{n}@example.com', subject='Alert',
+                email_type='security_alert', template_name=template_name, body=f'<p>{n}</p>',
+                provider_message_id=f'app-drain-{template_name}-{n}',
+            )
+            for n in range(count)
+        ]
+
+    def test_concurrent_claims_get_disjoint_rows(self):
+        self._queue(5)
+        real_drainable = tasks._drainable
+        calls = []
+
+        def racing(now):
+            calls.append(now)
+            if len(calls) == 1:
+                # Worker "a" leases two rows between "b" reading and leasing its candidates
+                stale = list(real_drainable(now).order_by('next_retry_at').values_list('id', flat=True)[:2])
+                _claim_batch('a', 2, 60)
+                return EmailNotification.objects.filter(pk__in=stale)
+            return real_drainable(now)
+
+        with mock.patch('notification.tasks._drainable', side_effect=racing):
+            claimed_b = _claim_batch('b', 3, 60)
+        claimed_a = EmailNotification.objects.filter(lease_owner='a')
+
+        self.assertEqual(len(claimed_b), 3)
+        self.assertEqual(claimed_a.count(), 2)
+        self.assertFalse({row.pk for row in claimed_b} & set(claimed_a.values_list('pk', flat=True)))
+        self.assertEqual(_claim_batch('c', 3, 60), [])
+
+    def test_expired_lease_comes_due_again(self):
+        self._queue(2)
+        claimed = _claim_batch('crashed', 3, 60)
+        self.assertEqual(len(claimed), 2)
+        self.assertEqual(_claim_batch('other', 3, 60), [])
+
+        later = timezone.now() + timedelta(seconds=61)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            reclaimed = _claim_batch('other', 3, 60)
+        self.assertEqual({row.pk for row in reclaimed}, {row.pk for row in claimed})
+        self.assertTrue(all(row.lease_owner == 'other' for row in reclaimed))
+
+    def test_chunks_keep_one_template_per_chunk(self):
+        rows = [EmailNotification(template_name='a') for _ in range(5)] + [
+            EmailNotification(template_name='b') for _ in range(2)
+        ]
+        def sizes(chunks):
+            return [(chunk[0].template_name, len(chunk)) for chunk in chunks]
+
+        for chunk in _chunks(rows, 2):
+            self.assertEqual(len({row.template_name for row in chunk}), 1)
+        # SMTP: each template spread over the threads
+        self.assertEqual(sizes(_chunks(rows, 2)), [('a', 3), ('a', 2), ('b', 1), ('b', 1)])
+        # Brevo: one batch request per BREVO_BATCH_SIZE rows of a template
+        with self.settings(EMAIL_DELIVERY_MODE='brevo_api', BREVO_BATCH_SIZE=2):
+            self.assertEqual(sizes(_chunks(rows, 2)), [('a', 2), ('a', 2), ('a', 1), ('b', 2)])
+
+    def test_drain_records_outcomes_and_metrics(self):
+        sent, failing, bounced, *rest = self._queue(4) + self._queue(1, template_name='new_device_login')
+
+        def send(messages, lane):
+            self.assertEqual(lane, 'bulk')
+            results = {
+                sent.to_email: {'provider': 'smtp', 'message_id': '<sent@realmfa.com>'},
+                failing.to_email: {'provider': 'smtp', 'error': 'timeout', 'permanent': False},
+                bounced.to_email: {'provider': 'smtp', 'error': '550 no such user', 'permanent': True},
+            }
+            return [results.get(message['to'], {'provider': 'smtp'}) for message in messages]
+
+        with mock.patch('notification.tasks.send_app_email_batch', side_effect=send):
+            metrics = send_pending_notifications()
+
+        self.assertEqual(
+            {key: metrics[key] for key in ('claimed', 'batches', 'sent', 'failed', 'dead')},
+            {'claimed': 5, 'batches': 2, 'sent': 3, 'failed': 1, 'dead': 1},
+        )
+        rows = {row.pk: row for row in EmailNotification.objects.all()}
+        self.assertEqual(rows[sent.pk].status, 'sent')
+        self.assertEqual(rows[sent.pk].provider_message_id, '<sent@realmfa.com>')
+        self.assertEqual((rows[failing.pk].status, rows[failing.pk].retry_count), ('failed', 1))
+        self.assertGreater(rows[failing.pk].next_retry_at, timezone.now())
+        self.assertEqual(rows[bounced.pk].status, 'dead')
+        self.assertTrue(all(rows[row.pk].status == 'sent' for row in rest))
+        self.assertFalse(any(row.lease_owner for row in rows.values()))
+
+
+class SMTPConnectionPoolTests(TestCase):
+    def setUp(self):
+        self.stub = SMTPStubServer().start()
+        self.addCleanup(self.stub.stop)
+        smtp = self.settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST=self.stub.host, EMAIL_PORT=self.stub.port, EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+            EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', EMAIL_TIMEOUT=5,
+            EMAIL_SMTP_KEEPALIVE_SECONDS=30, EMAIL_SMTP_MAX_MESSAGES_PER_CONNECTION=100, EMAIL_SMTP_POOL_SIZE=4,
+        )
+        smtp.enable()
+        self.addCleanup(smtp.disable)
+        self.pool = SMTPConnectionPool()
+        self.addCleanup(self.pool.close_all)
+
+    def _send(self, count, pool=None):
+        for n in range(count):
+            message = EmailMultiAlternatives('Alert', 'text', 'noreply@realmfa.com', [f'user{n}@example.com'])
+            self.assertEqual((pool or self.pool).send(message), 1)
+
+    def test_connection_is_reused(self):
+        self._send(3)
+        self.assertEqual(self.stub.stats, {'connections': 1, 'messages': 3, 'noops': 0})
+
+    def test_idle_connection_is_probed_with_noop(self):
+        with self.settings(EMAIL_SMTP_KEEPALIVE_SECONDS=0):
+            self._send(3)
+        self.assertEqual(self.stub.stats, {'connections': 1, 'messages': 3, 'noops': 2})
+
+    def test_dropped_connection_is_replaced(self):
+        self.stub.server.drop_after_message = True
+        # Caught by the NOOP probe
+        with self.settings(EMAIL_SMTP_KEEPALIVE_SECONDS=0):
+            self._send(2)
+        self.assertEqual(self.stub.stats['connections'], 2)
+        # Not probed: the send fails, reconnects and is retried once
+        self._send(2)
+        self.assertEqual(self.stub.stats['connections'], 4)
+        self.assertEqual(self.stub.stats['messages'], 4)
+
+    def test_connection_is_retired_after_max_messages(self):
+        with self.settings(EMAIL_SMTP_MAX_MESSAGES_PER_CONNECTION=2):
+            self._send(5)
+        self.assertEqual(self.stub.stats['connections'], 3)
+        self.assertEqual(self.stub.stats['messages'], 5)
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'os.register_at_fork is not available')
+    def test_forked_child_starts_with_an_empty_pool(self):
+        self.addCleanup(smtp_pool.close_all)
+        self._send(1, pool=smtp_pool)
+        self.assertEqual(smtp_pool._idle.qsize(), 1)
+
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover - child
+            os._exit(0 if smtp_pool._idle.qsize() == 0 else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(smtp_pool._idle.qsize(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, EMAIL_SEND_RATE_LIMITS={})
+class BrevoBatchTests(TestCase):
+    def setUp(self):
+        self.stub = BrevoStubServer().start()
+        self.addCleanup(self.stub.stop)
+        brevo = self.settings(
+            EMAIL_DELIVERY_MODE='brevo_api', BREVO_API_KEY='test-key', BREVO_API_ENDPOINT=self.stub.endpoint,
+            DEFAULT_FROM_EMAIL='noreply@realmfa.com', BREVO_BATCH_SIZE=2,
+        )
+        brevo.enable()
+        self.addCleanup(brevo.disable)
+
+    def _messages(self, count):
+        return [
+            {'to': f'user{n}@example.com', 'subject': f'Alert {n}', 'message': f'text {n}',
+             'html_message': f'<p>{n}</p>' if n % 2 == 0 else None}
+            for n in range(count)
+        ]
+
+    def test_send_batch_maps_each_message_to_a_version(self):
+        message_ids = BrevoClient().send_batch(self._messages(2))
+
+        [payload] = self.stub.payloads
+        self.assertEqual(payload['sender'], {'email': 'noreply@realmfa.com'})
+        self.assertEqual(payload['subject'], 'Alert 0')
+        self.assertEqual(payload['htmlContent'], '<p>0</p>')
+        self.assertEqual(payload['messageVersions'], [
+            {'to': [{'email': 'user0@example.com'}], 'subject': 'Alert 0',
+             'textContent': 'text 0', 'htmlContent': '<p>0</p>'},
+            # No HTML part: the text doubles as the HTML content
+            {'to': [{'email': 'user1@example.com'}], 'subject': 'Alert 1',
+             'textContent': 'text 1', 'htmlContent': 'text 1'},
+        ])
+        self.assertEqual(message_ids, ['<stub-1@brevo.local>', '<stub-2@brevo.local>'])
+
+    def test_batches_share_one_kept_alive_connection(self):
+        results = send_app_email_batch(self._messages(5))
+
+        self.assertEqual(self.stub.stats, {'connections': 1, 'requests': 3, 'messages': 5})
+        self.assertEqual([len(payload['messageVersions']) for payload in self.stub.payloads], [2, 2, 1])
+        self.assertEqual(
+            [result['message_id'] for result in results], [f'<stub-{n}@brevo.local>' for n in range(1, 6)],
+        )
+
+    def test_rejected_batch_fails_each_message_permanently(self):
+        self.stub.httpd.fail_status = 400
+        with self.assertLogs('Real_MFA.email_provider', 'ERROR'):
+            results = send_app_email_batch(self._messages(3))
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(result['permanent'] and not result['throttled'] for result in results))
+        self.assertTrue(all(result['provider'] == 'brevo_api' for result in results))
+
+
+class HtmlToTextTests(TestCase):
+    def test_plain_text_is_returned_unchanged(self):
+        self.assertEqual(html_to_text('Your code is 123456 & valid'), 'Your code is 123456 & valid')
+        self.assertEqual(html_to_text(None), '')
+
+    def test_paragraphs_and_line_breaks(self):
+        html = '<html><head><title>T</title><style>p {color: red}</style></head><body>\n' \
+               '  <h1>Hello</h1>\n  <p>First line<br>second   line</p>\n<!-- hidden -->\n' \
+               '  <div>Footer</div><script>track()</script></body></html>'
+        self.assertEqual(html_to_text(html), 'Hello\n\nFirst line\nsecond line\n\nFooter')
+
+    def test_lists_become_bullets(self):
+        self.assertEqual(
+            html_to_text('<p>Changes:</p><ul>\n  <li>Email</li>\n  <li>Phone <b>number</b></li>\n</ul><p>Done</p>'),
+            'Changes:\n\n- Email\n- Phone number\n\nDone',
+        )
+
+    def test_links_keep_their_url(self):
+        self.assertEqual(
+            html_to_text('<p><a href="https://mfa.example.com/reset?a=1&amp;b=2">Reset password</a></p>'),
+            'Reset password (https://mfa.example.com/reset?a=1&b=2)',
+        )
+        # Single-quoted and unquoted hrefs
+        self.assertEqual(html_to_text("<a href='https://a.example'>A</a>"), 'A (https://a.example)')
+        self.assertEqual(html_to_text('<a href=https://b.example>B</a>'), 'B (https://b.example)')
+        # The URL is not repeated when it is the label, and fragments are dropped
+        self.assertEqual(html_to_text('<a href="https://c.example">https://c.example</a>'), 'https://c.example')
+        self.assertEqual(html_to_text('<a href="#top">Back to top</a>'), 'Back to top')
+
+    def test_entities_are_unescaped(self):
+        self.assertEqual(
+            html_to_text('<p>&lt;script&gt; &amp; &quot;quotes&quot; &#39;x&#39; caf&eacute;</p>'),
+            '<script> & "quotes" \'x\' caf\u00e9',
+        )
+
+    def test_table_cells_are_separated(self):
+        self.assertEqual(
+            html_to_text('<table><tr><td>Device</td><td>Laptop</td></tr><tr><th>IP</th><td>10.0.0.1</td></tr></table>'),
+            'Device Laptop\nIP 10.0.0.1',
+        )
+
+
+@override_settings(SITE_NAME='Test Site', FRONTEND_URL='https://mfa.example.com/', SUPPORT_EMAIL='help@example.com')
+class TemplateRegistryTests(TestCase):
+    values = {
+        'device_name': 'Test Laptop', 'device_type': 'Desktop', 'browser': 'Firefox', 'os': 'Linux',
+        'location': 'Lahore, Pakistan', 'ip_address': '203.0.113.7', 'mfa_method': 'TOTP',
+        'reason': 'Unusual location', 'otp_code': '482913',
+        'verification_link': 'https://mfa.example.com/verify/abc123',
+    }
+
+    def _context(self):
+        user = User(username='nora', email='nora@example.com', first_name='Nora')
+        now = timezone.now()
+        changed_fields = {'phone_number': {'old': '', 'new': '+15550100'}}
+        return {
+            **self.values,
+            'user': user,
+            'login_time': now, 'verified_time': now, 'enabled_time': now, 'disabled_time': now,
+            'changed_time': now, 'update_time': now, 'detected_time': now,
+            'changed_fields': changed_fields,
+            'alerts': [{'subject': 'Profile updated', 'at': now, 'ip_address': '203.0.113.7',
+                        'changed_fields': changed_fields}],
+        }
+
+    def test_every_registered_template_renders(self):
+        shared = {'site_name': 'Test Site', 'site_url': 'https://mfa.example.com', 'support_email': 'help@example.com'}
+        context = self._context()
+        for name in registry.names():
+            with self.subTest(name):
+                entry = registry.get(name)
+                source = registry.compiled(name).source
+                email = registry.render(name, context)
+
+                self.assertEqual((email.subject, email.email_type), (entry.subject, entry.email_type))
+                self.assertTrue(email.text)
+                self.assertNotIn('{{', email.html)
+                self.assertNotRegex(email.text, r'<[a-zA-Z/]')
+                for key, value in {**shared, **self.values}.items():
+                    if '{{ %s' % key in source:
+                        self.assertIn(value, email.text, key)
+                if 'user.first_name' in source:
+                    self.assertIn('Nora', email.text)
+
+    def test_message_values_shadow_the_shared_context(self):
+        email = registry.render('password_reset_otp', {'otp_code': '111222', 'site_name': 'Other Site'})
+        self.assertIn('Other Site', email.html)
+        self.assertNotIn('Test Site', email.html)
+
+    def test_changed_settings_rebuild_the_shared_context(self):
+        self.assertEqual(registry.shared_context()['site_name'], 'Test Site')
+        with self.settings(SITE_NAME='Renamed'):
+            self.assertIn('Renamed', registry.render('password_reset_otp', {'otp_code': '1'}).html)
+        self.assertEqual(registry.shared_context()['site_name'], 'Test Site')
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class EmailNotificationAdminTests(TestCase):
+    def test_retry_requeues_failed_and_dead_rows(self):
+        user = User.objects.create(username='kate', email='kate@example.com', email_verified=True)
+        later = timezone.now() + timedelta(hours=6)
+        rows = [
+            EmailNotification.objects.create(
+                user=user, to_email=user.email, subject='Alert', email_type='security_alert', body='<p>x</p>',
+                status=status, retry_count=3, next_retry_at=later, lease_owner='crashed-worker',
+                error_message='SMTP timeout', provider_message_id=f'app-admin-{status}',
+            )
+            for status in ('failed', 'dead', 'sent')
+        ]
+        admin = site._registry[EmailNotification]
+        with mock.patch.object(admin, 'message_user'):
+            admin.retry_failed(None, EmailNotification.objects.all())
+
+        failed, dead, sent = (EmailNotification.objects.get(pk=row.pk) for row in rows)
+        for row in (failed, dead):
+            self.assertEqual(row.status, 'pending')
+            self.assertEqual(row.retry_count, 0)
+            self.assertEqual(row.lease_owner, '')
+            self.assertEqual(row.error_message, '')
+        self.assertEqual(sent.status, 'sent')
+        # Due for the next drain straight away
+        self.assertEqual({row.pk for row in _claim_batch('drain', 10, 60)}, {failed.pk, dead.pk})
+
+
+@override_settings(CACHES=LOCMEM_CACHE, EMAIL_SEND_RATE_LIMITS={}, DEFAULT_FROM_EMAIL='noreply@realmfa.com')
+class NotificationPolicyTests(TestCase):
+    # A Monday
+    monday = datetime(2026, 10, 19, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        self.user = User.objects.create(username='kim', email='kim@example.com', email_verified=True)
+
+    def _evaluate(self, alert_type='profile_changed', now=None, **kwargs):
+        return NotificationPolicy.evaluate(self.user.pk, 'email', alert_type, now=now, **kwargs)
+
+    def _changed(self, model, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return model.objects.create(user=self.user, **fields)
+
+    def test_quiet_window_crossing_midnight(self):
+        self._changed(QuietHours, day_of_week=0, start_time=time(22), end_time=time(6))
+        tuesday_6am = self.monday + timedelta(days=1, hours=6)
+
+        late_monday = self._evaluate(now=self.monday + timedelta(hours=23, minutes=30))
+        self.assertEqual((late_monday.send_at, late_monday.reason), (tuesday_6am, 'quiet_hours'))
+        early_tuesday = self._evaluate(now=self.monday + timedelta(days=1, hours=2))
+        self.assertEqual(early_tuesday.send_at, tuesday_6am)
+        # The window opens on Mondays only
+        self.assertIsNone(self._evaluate(now=self.monday + timedelta(days=1, hours=23, minutes=30)).send_at)
+        self.assertIsNone(self._evaluate(now=self.monday + timedelta(hours=21)).send_at)
+
+    def test_critical_only_window_lets_critical_alerts_through(self):
+        self._changed(QuietHours, day_of_week=0, start_time=time(1), end_time=time(5), allow_critical_only=True)
+        now = self.monday + timedelta(hours=2)
+        self.assertEqual(self._evaluate(now=now).reason, 'quiet_hours')
+        self.assertEqual(self._evaluate(now=now, critical=True), PolicyDecision(True, None, 'allowed'))
+
+    def test_security_alerts_are_not_held_by_the_legacy_quiet_window(self):
+        minute = timezone.now().hour * 60 + timezone.now().minute
+        start, end = (minute - 60) % 1440, (minute + 60) % 1440
+        self._changed(
+            NotificationPreference, quiet_hours_enabled=True,
+            quiet_start=time(start // 60, start % 60), quiet_end=time(end // 60, end % 60),
+        )
+        with mock.patch('notification.utils.send_app_email', return_value={'provider': 'smtp'}) as send:
+            for alert_type in ('suspicious_login', 'mfa_disabled', 'password_changed'):
+                self.assertEqual(send_security_alert(self.user, alert_type, {}).status, 'sent', alert_type)
+            held = send_security_alert(self.user, 'profile_changed', {})
+        self.assertEqual(send.call_count, 3)
+        self.assertEqual(held.status, 'pending')
+        self.assertGreater(held.next_retry_at, timezone.now())
+
+    def test_blocked_sender_suppresses_email(self):
+        self._changed(NotificationBlocklist, block_type='domain', blocked_value='@realmfa.com')
+        self.assertEqual(self._evaluate(), PolicyDecision(False, None, 'blocked'))
+
+    def test_withdrawn_consent_suppresses_alerts(self):
+        self._changed(NotificationConsent, consent_type='security', is_consented=False, source='settings')
+        self.assertEqual(self._evaluate().reason, 'no_consent')
+
+    def test_marketing_needs_an_explicit_opt_in(self):
+        self._changed(NotificationPreference, email_marketing=True)
+        self.assertEqual(self._evaluate('security_alert', category='marketing').reason, 'no_consent')
+        self._changed(NotificationConsent, consent_type='marketing', is_consented=True, source='settings')
+        self.assertTrue(self._evaluate('security_alert', category='marketing').allowed)
+
+    def test_source_changes_invalidate_the_cached_policy(self):
+        self.assertTrue(self._evaluate().allowed)
+        block = self._changed(NotificationBlocklist, block_type='email', blocked_value='kim@example.com')
+        self.assertEqual(self._evaluate().reason, 'blocked')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            block.delete()
+        self.assertTrue(self._evaluate().allowed)
+
+        # The blocked address moves with the user's email
+        self._changed(NotificationBlocklist, block_type='email', blocked_value='kim@new.example.com')
+        self.assertTrue(self._evaluate().allowed)
+        self.user.email = 'kim@new.example.com'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save(update_fields=['email'])
+        self.assertEqual(self._evaluate().reason, 'blocked')
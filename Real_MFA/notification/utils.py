@@ -5,12 +5,17 @@ Send security alerts and notifications to users
 
 import json
 import uuid
+from datetime import timedelta
+from django.db import transaction
 from django.utils import timezone
-from django.template.loader import render_to_string
+from django.utils.dateparse import parse_datetime
 from django.core.serializers.json import DjangoJSONEncoder
 from django.conf import settings
-from Real_MFA.email_provider import send_app_email
-from .models import EmailNotification, NotificationLog, NotificationPreference
+from accounts.redis_utils import redis_client
+from Real_MFA.email_provider import failure_result, send_app_email
+from .models import EmailNotification, NotificationLog, NotificationOutbox
+from .policy import NotificationPolicy
+from .registry import registry
 import logging
 
 logger = logging.getLogger(__name__)
@@ -35,7 +40,7 @@ def get_device_info(request):
     }
 
 
-def send_security_alert(user, alert_type, context, request=None):
+def send_security_alert(user, alert_type, context, request=None, lane='alert'):
     """
     Send security alert to user
     
@@ -44,96 +49,67 @@ def send_security_alert(user, alert_type, context, request=None):
         alert_type: Type of alert (new_device_login, mfa_enabled, mfa_disabled, password_changed, profile_changed)
         context: Dict with alert-specific context data
         request: HttpRequest object (optional)
+        lane: Send quota lane (Real_MFA.email_quota); digests use 'bulk'
     """
-    # Check if user wants to receive security alerts
-    try:
-        prefs = NotificationPreference.objects.get(user=user)
-        if not prefs.email_alerts:
-            logger.info(f"User {user.email} has email alerts disabled")
-            return
-    except NotificationPreference.DoesNotExist:
-        # Default to sending alerts if no preference set
-        pass
+    if alert_type not in registry:
+        logger.error(f"Unknown alert type: {alert_type}")
+        return
+    
+    alert_config = registry.get(alert_type)
+    
+    # Preferences, per-type rules, quiet hours, blocklist and consent: one cache lookup
+    decision = NotificationPolicy.evaluate(user.pk, 'email', alert_type, critical=alert_config.critical)
+    if not decision.allowed:
+        logger.info(f"Security alert '{alert_type}' for {user.email} suppressed ({decision.reason})")
+        return
     
     # Add device info if request provided
     if request:
         device_info = get_device_info(request)
         context.update(device_info)
     
-    # Map alert types to email details
-    alert_templates = {
-        'new_device_login': {
-            'subject': '🔐 New Device Login Detected',
-            'template': 'notification/email/new_device_login.html',
-            'email_type': 'security_alert'
-        },
-        'mfa_enabled': {
-            'subject': '✅ Two-Factor Authentication Enabled',
-            'template': 'notification/email/mfa_enabled.html',
-            'email_type': 'security_alert'
-        },
-        'mfa_disabled': {
-            'subject': '⚠️ Two-Factor Authentication Disabled',
-            'template': 'notification/email/mfa_disabled.html',
-            'email_type': 'security_alert'
-        },
-        'password_changed': {
-            'subject': '🔑 Password Changed Successfully',
-            'template': 'notification/email/password_changed.html',
-            'email_type': 'security_alert'
-        },
-        'profile_changed': {
-            'subject': '👤 Profile Information Updated',
-            'template': 'notification/email/profile_changed.html',
-            'email_type': 'account_alert'
-        },
-        'suspicious_login': {
-            'subject': '🚨 Suspicious Login Attempt',
-            'template': 'notification/email/suspicious_login.html',
-            'email_type': 'security_alert'
-        },
-        'device_verified': {
-            'subject': '✓ New Device Verified',
-            'template': 'notification/email/device_verified.html',
-            'email_type': 'security_alert'
-        }
-    }
-    
-    if alert_type not in alert_templates:
-        logger.error(f"Unknown alert type: {alert_type}")
-        return
-    
-    alert_config = alert_templates[alert_type]
-    
-    # Add common context
+    # Add common context (site_name / site_url / support_email come from the registry)
     context.update({
         'user': user,
         'timestamp': timezone.now(),
-        'site_name': 'Real MFA',
     })
     
-    # Render email body
+    # Render email body from the compiled template
     try:
-        body = render_to_string(alert_config['template'], context)
+        email = registry.render(alert_type, context)
+        body, text = email.html, email.text
     except Exception as e:
-        logger.error(f"Failed to render template {alert_config['template']}: {e}")
+        logger.error(f"Failed to render template {alert_config.template_name}: {e}")
         # Fallback to simple text
-        body = f"{alert_config['subject']}\n\n"
+        body = f"{alert_config.subject}\n\n"
         for key, value in context.items():
-            if key not in ['user', 'site_name']:
+            if key != 'user':
                 body += f"{key}: {value}\n"
+        text = body
     
+    # A row sent inline below is created leased, so the drain cannot pick it
+    # up mid-send; it only comes due when it is held (send_at), when the send
+    # fails, or when this process dies before recording the outcome.
+    now = timezone.now()
+    if decision.send_at:
+        lease_owner, next_retry_at = '', decision.send_at
+    else:
+        lease_seconds = int(getattr(settings, 'NOTIFICATION_DRAIN_LEASE_SECONDS', 300))
+        lease_owner, next_retry_at = f"inline-{uuid.uuid4().hex}", now + timedelta(seconds=lease_seconds)
+
     # Create email notification
     email_notification = EmailNotification.objects.create(
         user=user,
         to_email=user.email,
-        subject=alert_config['subject'],
-        email_type=alert_config['email_type'],
-        template_name=alert_config['template'],
+        subject=alert_config.subject,
+        email_type=alert_config.email_type,
+        template_name=alert_config.template_name,
         body=body,
         status='pending',
         provider='app',
-        provider_message_id=f"app-{uuid.uuid4()}"
+        provider_message_id=f"app-{uuid.uuid4()}",
+        lease_owner=lease_owner,
+        next_retry_at=next_retry_at,
     )
     
     # Create notification log
@@ -145,32 +121,43 @@ def send_security_alert(user, alert_type, context, request=None):
     notification_log = NotificationLog.objects.create(
         user=user,
         channel='email',
-        subject=alert_config['subject'],
+        subject=alert_config.subject,
         message=body,
         recipient=user.email,
         delivered=False,
         metadata=safe_metadata
     )
     
+    # Held for quiet hours / a per-type delay: send_pending_notifications sends it when due
+    if decision.send_at:
+        logger.info(f"Security alert '{alert_type}' for {user.email} scheduled for {decision.send_at} ({decision.reason})")
+        return email_notification
+    
     # Send email immediately so user receives security alerts reliably.
     try:
         send_result = send_app_email(
-            subject=alert_config['subject'],
-            message=body,
+            subject=alert_config.subject,
+            message=text,
             from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', ''),
             recipient_list=[user.email],
             fail_silently=False,
             html_message=body,
+            lane=lane,
         )
         provider_message_id = send_result.get('message_id') or f"smtp-{uuid.uuid4()}"
         email_notification.provider = send_result.get('provider', 'smtp')
-        email_notification.save(update_fields=['provider'])
+        email_notification.lease_owner = ''
+        email_notification.save(update_fields=['provider', 'lease_owner'])
         email_notification.mark_sent(provider_message_id=provider_message_id)
         notification_log.delivered = True
         notification_log.save(update_fields=['delivered'])
         logger.info(f"Security alert '{alert_type}' sent to user {user.email}")
     except Exception as exc:
-        email_notification.mark_failed(str(exc))
+        # Same bookkeeping as a failed drain send: backoff, dead-letter on permanent errors
+        from .tasks import FAILURE_FIELDS, record_send_failure
+        mode = str(getattr(settings, 'EMAIL_DELIVERY_MODE', 'smtp')).strip().lower()
+        record_send_failure(email_notification, failure_result(mode, exc), timezone.now())
+        email_notification.save(update_fields=FAILURE_FIELDS)
         notification_log.delivered = False
         notification_log.save(update_fields=['delivered'])
         logger.error("Failed to send security alert '%s' to %s: %s", alert_type, user.email, exc)
@@ -178,6 +165,106 @@ def send_security_alert(user, alert_type, context, request=None):
     return email_notification
 
 
+def _publish_outbox(outbox_id):
+    """Hand a committed outbox row to the consumer; the sweep retries lost publishes"""
+    from .tasks import deliver_notification_outbox
+    try:
+        deliver_notification_outbox.delay(str(outbox_id))
+    except Exception as exc:
+        logger.warning("Outbox %s not published (sweep will retry): %s", outbox_id, exc)
+
+
+def _publish_digest(user_id, hold_until):
+    """Schedule the user's digest for when the window closes; the sweep covers a lost publish"""
+    from .tasks import deliver_notification_digest
+    try:
+        deliver_notification_digest.apply_async(args=[str(user_id)], eta=hold_until)
+    except Exception as exc:
+        logger.warning("Digest for %s not scheduled (sweep will retry): %s", user_id, exc)
+
+
+def _digest_window(user, alert_type):
+    """
+    (hold_until, opens_window) for a coalescible alert, or (None, False).
+
+    Alerts whose email type is in NOTIFICATION_DIGEST_EMAIL_TYPES are held
+    for NOTIFICATION_DIGEST_WINDOW_SECONDS from the first one; later alerts
+    join the open window. Everything else (e.g. suspicious_login,
+    security_alert types) is sent straight away. Eager Celery (no worker to
+    run the delayed digest) disables coalescing.
+    """
+    window = int(getattr(settings, 'NOTIFICATION_DIGEST_WINDOW_SECONDS', 120))
+    email_types = getattr(settings, 'NOTIFICATION_DIGEST_EMAIL_TYPES', ['account_alert'])
+    if (
+        window <= 0
+        or registry.get(alert_type).email_type not in email_types
+        or getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False)
+    ):
+        return None, False
+
+    key = f"notification_digest:{user.pk}"
+    hold_until = timezone.now() + timedelta(seconds=window)
+    if redis_client.set(key, hold_until.isoformat(), ex=window, nx=True):
+        return hold_until, True
+    current = redis_client.get(key)
+    if current:
+        return parse_datetime(current), False
+    # Window closed between the two calls: start a new one
+    redis_client.set(key, hold_until.isoformat(), ex=window)
+    return hold_until, True
+
+
+def queue_security_alert(user, alert_type, context, request=None):
+    """
+    Record a security alert in the outbox instead of sending it inline.
+
+    The row joins the caller's transaction and is published to
+    deliver_notification_outbox on commit, which renders and sends it with
+    send_security_alert. A rolled-back request therefore sends nothing, and
+    request latency does not depend on the email provider.
+    Low-severity alerts are held instead and merged into one digest per
+    user window (see _digest_window).
+    """
+    if alert_type not in registry:
+        logger.error(f"Unknown alert type: {alert_type}")
+        return None
+
+    # Skip the outbox write for users who would not get it anyway
+    critical = registry.get(alert_type).critical
+    if not NotificationPolicy.evaluate(user.pk, 'email', alert_type, critical=critical).allowed:
+        return None
+
+    # The request is gone by the time the consumer runs; keep what it needs
+    if request:
+        context.update(get_device_info(request))
+
+    hold_until, opens_window = _digest_window(user, alert_type)
+    outbox = NotificationOutbox.objects.create(
+        user=user,
+        alert_type=alert_type,
+        context=json.loads(json.dumps(context, cls=DjangoJSONEncoder)),
+        hold_until=hold_until,
+    )
+    if hold_until is None:
+        transaction.on_commit(lambda: _publish_outbox(outbox.pk))
+    elif opens_window:
+        transaction.on_commit(lambda: _publish_digest(user.pk, hold_until))
+    return outbox
+
+
+def restore_context(payload):
+    """Outbox context back to template values: ISO datetimes become datetimes again"""
+    context = {}
+    for key, value in payload.items():
+        if isinstance(value, str):
+            try:
+                value = parse_datetime(value) or value
+            except ValueError:
+                pass
+        context[key] = value
+    return context
+
+
 def notify_new_device_login(user, device, request=None):
     """Notify user about new device login"""
     context = {
@@ -189,7 +276,7 @@ def notify_new_device_login(user, device, request=None):
         'ip_address': device.ip_address,
         'login_time': device.created_at,
     }
-    return send_security_alert(user, 'new_device_login', context, request)
+    return queue_security_alert(user, 'new_device_login', context, request)
 
 
 def notify_mfa_enabled(user, mfa_method, request=None):
@@ -198,7 +285,7 @@ def notify_mfa_enabled(user, mfa_method, request=None):
         'mfa_method': mfa_method,
         'enabled_at': timezone.now(),
     }
-    return send_security_alert(user, 'mfa_enabled', context, request)
+    return queue_security_alert(user, 'mfa_enabled', context, request)
 
 
 def notify_mfa_disabled(user, mfa_method, request=None):
@@ -207,7 +294,7 @@ def notify_mfa_disabled(user, mfa_method, request=None):
         'mfa_method': mfa_method,
         'disabled_at': timezone.now(),
     }
-    return send_security_alert(user, 'mfa_disabled', context, request)
+    return queue_security_alert(user, 'mfa_disabled', context, request)
 
 
 def notify_password_changed(user, request=None):
@@ -215,7 +302,7 @@ def notify_password_changed(user, request=None):
     context = {
         'changed_at': timezone.now(),
     }
-    return send_security_alert(user, 'password_changed', context, request)
+    return queue_security_alert(user, 'password_changed', context, request)
 
 
 def notify_profile_changed(user, changed_fields, request=None):
@@ -224,7 +311,7 @@ def notify_profile_changed(user, changed_fields, request=None):
         'changed_fields': changed_fields,
         'changed_at': timezone.now(),
     }
-    return send_security_alert(user, 'profile_changed', context, request)
+    return queue_security_alert(user, 'profile_changed', context, request)
 
 
 def notify_device_verified(user, device, request=None):
@@ -234,7 +321,7 @@ def notify_device_verified(user, device, request=None):
         'device_type': device.get_device_type_display(),
         'verified_at': device.verified_at,
     }
-    return send_security_alert(user, 'device_verified', context, request)
+    return queue_security_alert(user, 'device_verified', context, request)
 
 
 def notify_suspicious_login(user, reason, request=None):
@@ -243,4 +330,4 @@ def notify_suspicious_login(user, reason, request=None):
         'reason': reason,
         'attempt_time': timezone.now(),
     }
-    return send_security_alert(user, 'suspicious_login', context, request)
+    return queue_security_alert(user, 'suspicious_login', context, request)
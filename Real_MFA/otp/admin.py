@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import OTP, TOTPDevice, BackupCode, MFAChallenge, EmailMFAMethod, SMSMFAMethod, MFARecovery
+from .models import OTP, TOTPDevice, BackupCode, MFAChallenge, EmailMFAMethod, SMSMFAMethod, MFARecovery, EmergencyCodeJob
 
 
 @admin.register(OTP)
@@ -197,3 +197,20 @@ class MFARecoveryAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         return False
 
+
+@admin.register(EmergencyCodeJob)
+class EmergencyCodeJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'requested_by', 'status', 'processed_users', 'total_users', 'created_at', 'completed_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('requested_by__email', 'reason')
+    readonly_fields = (
+        'id', 'requested_by', 'user_ids', 'user_filter', 'codes_per_user', 'reason',
+        'ip_address', 'user_agent', 'status', 'total_users', 'processed_users', 'error',
+        'started_at', 'completed_at', 'artifact_path', 'artifact_sha256',
+        'artifact_expires_at', 'downloaded_at', 'created_at', 'updated_at',
+    )
+    ordering = ('-created_at',)
+    date_hierarchy = 'created_at'
+    
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,399 @@
+"""
+MFA Challenge Store - Redis-backed challenge state machine
+
+Active challenges live in Redis with a native TTL and an atomic attempt
+counter. Terminal states (verified / failed / expired) are queued and flushed
+to the `mfa_challenges` table in batches, so the table only ever receives
+final rows and never accumulates stale 'pending' challenges.
+
+Key layout (all keys expire on their own):
+- mfa_challenge:{id}           JSON with the static challenge fields
+- mfa_challenge_attempts:{id}  INCR counter for failed attempts
+- mfa_challenge_final:{id}     terminal status (SET NX - first transition wins),
+                               kept at least as long as the challenge key
+- mfa_challenge_device:{id}    device a verified challenge was completed on
+- mfa_challenges:active        ZSET of active ids scored by expiry (sweeper index)
+- mfa_challenges:flush         LIST of terminal records waiting for the DB flush
+- mfa_challenges:flush_lock    held by the sweeper while it flushes a batch
+
+When Redis is not reachable (cache-backed KV in local dev) the store falls
+back to reading and writing MFAChallenge rows directly.
+"""
+
+import json
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from accounts.redis_utils import redis_client
+from .models import MFAChallenge
+
+ACTIVE_INDEX_KEY = "mfa_challenges:active"
+FLUSH_QUEUE_KEY = "mfa_challenges:flush"
+FLUSH_LOCK_KEY = "mfa_challenges:flush_lock"
+
+# Terminal keys outlive the challenge so late verify/fail calls still see
+# the final state, and the sweeper can read data of just-expired challenges.
+_GRACE_SECONDS = 300
+
+# The device link waits here until the flush writes the row; generous so a
+# sweeper outage does not drop it
+_DEVICE_LINK_SECONDS = 24 * 3600
+
+
+def _challenge_key(challenge_id):
+    return f"mfa_challenge:{challenge_id}"
+
+
+def _attempts_key(challenge_id):
+    return f"mfa_challenge_attempts:{challenge_id}"
+
+
+def _final_key(challenge_id):
+    return f"mfa_challenge_final:{challenge_id}"
+
+
+def _device_key(challenge_id):
+    return f"mfa_challenge_device:{challenge_id}"
+
+
+def _uses_redis():
+    """Sorted sets are required for the expiry index; the cache KV has none."""
+    return hasattr(redis_client, 'zadd')
+
+
+def _from_ts(value):
+    return datetime.fromtimestamp(float(value), tz=dt_timezone.utc) if value else None
+
+
+class MFAChallengeStore:
+    """Issue, verify and expire MFA challenges"""
+
+    @staticmethod
+    def issue(user, challenge_type, ip_address, user_agent='', session_id=None,
+              ttl_seconds=None, max_attempts=None):
+        """Create a pending challenge and return its id"""
+        ttl_seconds = int(ttl_seconds or getattr(settings, 'MFA_CHALLENGE_TTL_SECONDS', 600))
+        max_attempts = int(max_attempts or getattr(settings, 'MFA_CHALLENGE_MAX_ATTEMPTS', 3))
+
+        if not _uses_redis():
+            challenge = MFAChallenge.objects.create(
+                user=user,
+                challenge_type=challenge_type,
+                session_id=session_id,
+                ip_address=ip_address,
+                user_agent=user_agent or '',
+                max_attempts=max_attempts,
+                expires_at=timezone.now() + timezone.timedelta(seconds=ttl_seconds),
+            )
+            return str(challenge.id)
+
+        challenge_id = str(uuid.uuid4())
+        now = time.time()
+        expires_at = now + ttl_seconds
+        key_ttl = ttl_seconds + _GRACE_SECONDS
+
+        payload = json.dumps({
+            'id': challenge_id,
+            'user_id': str(user.id),
+            'challenge_type': challenge_type,
+            'session_id': session_id,
+            'ip_address': ip_address,
+            'user_agent': user_agent or '',
+            'max_attempts': max_attempts,
+            'created_at': now,
+            'expires_at': expires_at,
+        })
+
+        pipe = redis_client.pipeline()
+        pipe.setex(_challenge_key(challenge_id), key_ttl, payload)
+        pipe.setex(_attempts_key(challenge_id), key_ttl, 0)
+        pipe.zadd(ACTIVE_INDEX_KEY, {challenge_id: expires_at})
+        pipe.execute()
+        return challenge_id
+
+    @staticmethod
+    def get(challenge_id):
+        """
+        Return the current challenge state as a dict, or None if unknown.
+
+        Status is derived: a final key wins, otherwise a challenge past its
+        expiry reads as 'expired' even before the sweeper has processed it.
+        """
+        if not challenge_id:
+            return None
+
+        if not _uses_redis():
+            challenge = MFAChallenge.objects.filter(id=challenge_id).first()
+            if challenge is None:
+                return None
+            status = challenge.status
+            if status == 'pending' and timezone.now() >= challenge.expires_at:
+                status = 'expired'
+            return {
+                'id': str(challenge.id),
+                'user_id': str(challenge.user_id),
+                'status': status,
+                'attempts': challenge.attempts,
+                'max_attempts': challenge.max_attempts,
+                'expires_at': challenge.expires_at,
+            }
+
+        pipe = redis_client.pipeline()
+        pipe.get(_challenge_key(challenge_id))
+        pipe.get(_attempts_key(challenge_id))
+        pipe.get(_final_key(challenge_id))
+        raw, attempts, final_status = pipe.execute()
+        if not raw:
+            return None
+
+        data = json.loads(raw)
+        status = final_status or 'pending'
+        if status == 'pending' and time.time() >= data['expires_at']:
+            status = 'expired'
+        return {
+            'id': data['id'],
+            'user_id': data['user_id'],
+            'status': status,
+            'attempts': int(attempts or 0),
+            'max_attempts': data['max_attempts'],
+            'expires_at': _from_ts(data['expires_at']),
+        }
+
+    @classmethod
+    def is_valid(cls, challenge_id):
+        """Check if challenge is still pending, unexpired and under the attempt cap"""
+        state = cls.get(challenge_id)
+        return bool(
+            state
+            and state['status'] == 'pending'
+            and state['attempts'] < state['max_attempts']
+        )
+
+    @classmethod
+    def record_failure(cls, challenge_id):
+        """
+        Atomically count a failed attempt.
+        Moves the challenge to 'failed' once max_attempts is reached.
+        """
+        if not _uses_redis():
+            challenge = MFAChallenge.objects.filter(id=challenge_id, status='pending').first()
+            if challenge is None:
+                return cls.get(challenge_id)
+            challenge.increment_attempts()
+            return cls.get(challenge_id)
+
+        state = cls.get(challenge_id)
+        if state is None or state['status'] != 'pending':
+            return state
+
+        attempts = redis_client.incr(_attempts_key(challenge_id))
+        state['attempts'] = attempts
+        if attempts >= state['max_attempts'] and cls._finalize(challenge_id, 'failed'):
+            state['status'] = 'failed'
+        return state
+
+    @classmethod
+    def mark_verified(cls, challenge_id, device=None):
+        """
+        Move a pending challenge to 'verified'; returns False if it already ended.
+
+        The transition happens at most once, so it is the claim a login takes
+        before issuing anything: of two concurrent verifies only one gets True.
+        """
+        if not _uses_redis():
+            now = timezone.now()
+            return bool(MFAChallenge.objects.filter(
+                id=challenge_id,
+                status='pending',
+                expires_at__gt=now,
+                attempts__lt=F('max_attempts'),
+            ).update(status='verified', verified_at=now, verified_device=device))
+
+        if not cls.is_valid(challenge_id):
+            return False
+        return cls._finalize(
+            challenge_id,
+            'verified',
+            verified_at=time.time(),
+            verified_device_id=str(device.id) if device else None,
+        )
+
+    @staticmethod
+    def attach_device(challenge_id, device):
+        """
+        Link a challenge verified without a device (the login claims the
+        challenge before it registers the device) to that device.
+        """
+        if _uses_redis():
+            # Picked up by flush(); the UPDATE below covers a row flushed already
+            redis_client.set(_device_key(challenge_id), str(device.id), ex=_DEVICE_LINK_SECONDS)
+        MFAChallenge.objects.filter(id=challenge_id).update(verified_device=device)
+
+    @classmethod
+    def _finalize(cls, challenge_id, status, **extra):
+        """
+        Record a terminal transition exactly once and queue it for the DB flush.
+        Returns False if another transition already won.
+        """
+        # The final key must not expire before the challenge key, or the
+        # challenge would read as 'pending' again for the rest of its life
+        remaining_ms = redis_client.pttl(_challenge_key(challenge_id))
+        final_ms = remaining_ms + 1000 if remaining_ms > 0 else _GRACE_SECONDS * 1000
+        if not redis_client.set(_final_key(challenge_id), status, px=final_ms, nx=True):
+            return False
+
+        pipe = redis_client.pipeline()
+        pipe.get(_challenge_key(challenge_id))
+        pipe.get(_attempts_key(challenge_id))
+        raw, attempts = pipe.execute()
+
+        pipe = redis_client.pipeline()
+        pipe.zrem(ACTIVE_INDEX_KEY, challenge_id)
+        if raw:
+            record = json.loads(raw)
+            record.update(extra)
+            record['status'] = status
+            record['attempts'] = int(attempts or 0)
+            pipe.rpush(FLUSH_QUEUE_KEY, json.dumps(record))
+        pipe.execute()
+        return True
+
+    @classmethod
+    def expire_due(cls, limit=None):
+        """
+        Transition challenges whose expiry has passed to 'expired'.
+        Reads only the due slice of the expiry index - no table scan.
+        """
+        if not _uses_redis():
+            return MFAChallengeStore.expire_rows()
+
+        limit = int(limit or getattr(settings, 'MFA_CHALLENGE_FLUSH_BATCH_SIZE', 500))
+        due_ids = redis_client.zrangebyscore(ACTIVE_INDEX_KEY, '-inf', time.time(), start=0, num=limit)
+
+        expired = 0
+        for challenge_id in due_ids:
+            if cls._finalize(challenge_id, 'expired'):
+                expired += 1
+            else:
+                # Already terminal; drop the stale index entry.
+                redis_client.zrem(ACTIVE_INDEX_KEY, challenge_id)
+        return expired
+
+    @staticmethod
+    def expire_rows():
+        """Close out pending mfa_challenges rows past their expiry"""
+        return MFAChallenge.objects.filter(
+            status='pending',
+            expires_at__lte=timezone.now()
+        ).update(status='expired')
+
+    @classmethod
+    def expire_legacy_rows(cls):
+        """
+        Close out 'pending' rows written before challenges moved to Redis.
+        Without Redis expire_due() already covers the table.
+        """
+        return cls.expire_rows() if _uses_redis() else 0
+
+    @staticmethod
+    def flush(batch_size=None):
+        """
+        Write queued terminal challenges to the mfa_challenges table in one batch.
+
+        Records leave the queue only after the insert committed, so a failed
+        insert is retried by the next sweep. Records of users deleted since
+        are dropped; a verifying device deleted since is cleared. Devices
+        linked with attach_device() are filled in.
+        """
+        if not _uses_redis():
+            return 0
+
+        batch_size = int(batch_size or getattr(settings, 'MFA_CHALLENGE_FLUSH_BATCH_SIZE', 500))
+
+        # One flusher at a time: the trim below assumes nobody else read the head
+        lock_token = uuid.uuid4().hex
+        if not redis_client.set(FLUSH_LOCK_KEY, lock_token, ex=60, nx=True):
+            return 0
+        try:
+            raw_records = redis_client.lrange(FLUSH_QUEUE_KEY, 0, batch_size - 1)
+            if not raw_records:
+                return 0
+
+            records = [json.loads(raw) for raw in raw_records]
+            linked = MFAChallengeStore._link_devices(records)
+            challenges = MFAChallengeStore._rows(records)
+            with transaction.atomic():
+                MFAChallenge.objects.bulk_create(challenges, batch_size=batch_size, ignore_conflicts=True)
+            redis_client.ltrim(FLUSH_QUEUE_KEY, len(raw_records), -1)
+
+            # A device attached while the batch was inserted found no row to update
+            unlinked = [
+                challenge for challenge in challenges
+                if challenge.status == 'verified' and not challenge.verified_device_id
+                and str(challenge.id) not in linked
+            ]
+            for challenge_id, device_id in MFAChallengeStore._link_devices(
+                [{'id': str(challenge.id), 'status': 'verified'} for challenge in unlinked]
+            ).items():
+                MFAChallenge.objects.filter(id=challenge_id).update(verified_device_id=device_id)
+            return len(challenges)
+        finally:
+            if redis_client.get(FLUSH_LOCK_KEY) == lock_token:
+                redis_client.delete(FLUSH_LOCK_KEY)
+
+    @staticmethod
+    def _link_devices(records):
+        """Fill in devices attached to verified records; returns {id: device id} found"""
+        pending = [record for record in records
+                   if record['status'] == 'verified' and not record.get('verified_device_id')]
+        if not pending:
+            return {}
+        pipe = redis_client.pipeline()
+        for record in pending:
+            pipe.get(_device_key(record['id']))
+        linked = {}
+        for record, device_id in zip(pending, pipe.execute()):
+            if device_id:
+                record['verified_device_id'] = linked[record['id']] = device_id
+        return linked
+
+    @staticmethod
+    def _rows(records):
+        """MFAChallenge instances for queued records whose user still exists"""
+        from accounts.models import User
+        from devices.models import Device
+
+        user_ids = {str(pk) for pk in User.objects.filter(
+            pk__in={record['user_id'] for record in records}
+        ).values_list('pk', flat=True)}
+        device_ids = {str(pk) for pk in Device.objects.filter(
+            pk__in={record['verified_device_id'] for record in records if record.get('verified_device_id')}
+        ).values_list('pk', flat=True)}
+
+        challenges = []
+        for record in records:
+            if record['user_id'] not in user_ids:
+                continue
+            if record.get('verified_device_id') not in device_ids:
+                record['verified_device_id'] = None
+            challenges.append(MFAChallenge(
+                id=record['id'],
+                user_id=record['user_id'],
+                challenge_type=record['challenge_type'],
+                status=record['status'],
+                session_id=record.get('session_id'),
+                ip_address=record.get('ip_address') or '0.0.0.0',
+                user_agent=record.get('user_agent', ''),
+                attempts=record.get('attempts', 0),
+                max_attempts=record.get('max_attempts', 3),
+                expires_at=_from_ts(record['expires_at']),
+                verified_at=_from_ts(record.get('verified_at')),
+                verified_device_id=record.get('verified_device_id'),
+            ))
+        return challenges
@@ -0,0 +1,77 @@
+"""
+Emergency Codes - Bulk backup-code issuance with encrypted artifacts
+
+Artifact format: one Fernet token per line. The first token decrypts to the
+CSV header, every following token to a CSV chunk of
+`user_id,email,codes` rows (codes separated by spaces).
+
+The per-job Fernet key is returned to the admin once when the job is created.
+It is handed to the worker through the KV store with a TTL and deleted as
+soon as the artifact is written, so it never reaches the database.
+"""
+
+import csv
+import io
+
+from django.conf import settings
+
+from accounts.redis_utils import redis_client
+
+try:
+    from cryptography.fernet import Fernet
+except Exception:  # pragma: no cover
+    Fernet = None
+
+ARTIFACT_HEADER = ['user_id', 'email', 'codes']
+
+# Time the worker has to pick up the key before the job can no longer run
+_KEY_TTL_SECONDS = 3600
+
+
+def _key_name(job_id):
+    return f"emergency_codes_job_key:{job_id}"
+
+
+def is_available():
+    """Encryption requires the optional cryptography package"""
+    return Fernet is not None
+
+
+def create_job_key(job_id):
+    """Generate a Fernet key for a job and park it for the worker"""
+    key = Fernet.generate_key().decode()
+    redis_client.setex(_key_name(job_id), _KEY_TTL_SECONDS, key)
+    return key
+
+
+def pop_job_key(job_id):
+    """Fetch and delete the job key; returns None if it expired"""
+    key = redis_client.get(_key_name(job_id))
+    redis_client.delete(_key_name(job_id))
+    if isinstance(key, bytes):
+        key = key.decode()
+    return key
+
+
+def artifact_path_for(job_id):
+    directory = settings.EMERGENCY_CODES_ARTIFACT_DIR
+    directory.mkdir(parents=True, exist_ok=True, mode=0o700)
+    return directory / f"{job_id}.enc"
+
+
+def encrypt_rows(fernet, rows):
+    """Encrypt a list of CSV rows into a single artifact line"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return fernet.encrypt(buffer.getvalue().encode()) + b"\n"
+
+
+def decrypt_artifact(path, key):
+    """Yield CSV rows (including the header) from an encrypted artifact"""
+    fernet = Fernet(key.encode() if isinstance(key, str) else key)
+    with open(path, 'rb') as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            yield from csv.reader(io.StringIO(fernet.decrypt(line).decode()))
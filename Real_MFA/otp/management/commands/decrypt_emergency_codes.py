@@ -0,0 +1,37 @@
+"""
+Decrypt a bulk emergency-code artifact to CSV
+
+Usage:
+    python manage.py decrypt_emergency_codes emergency-codes-<job>.enc --key <key> [--output codes.csv]
+"""
+
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from otp.emergency_codes import decrypt_artifact, is_available
+
+
+class Command(BaseCommand):
+    help = 'Decrypt a bulk emergency-code artifact downloaded from the admin API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('artifact', help='Path to the downloaded .enc file')
+        parser.add_argument('--key', required=True, help='Encryption key returned when the job was created')
+        parser.add_argument('--output', help='Write CSV here instead of stdout')
+
+    def handle(self, *args, **options):
+        if not is_available():
+            raise CommandError('cryptography is not installed.')
+
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        writer = csv.writer(out)
+        try:
+            for row in decrypt_artifact(options['artifact'], options['key']):
+                writer.writerow(row)
+        except Exception as exc:
+            raise CommandError(f'Could not decrypt artifact: {exc}')
+        finally:
+            if out is not sys.stdout:
+                out.close()
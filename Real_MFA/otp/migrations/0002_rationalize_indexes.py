@@ -0,0 +1,56 @@
+# Generated by Django 5.2.11 on 2026-10-19 03:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('otp', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='backupcode',
+            name='backup_code_user_id_07fbaf_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='otp',
+            name='otps_user_id_2340ab_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='otp',
+            name='otps_expires_f6308f_idx',
+        ),
+        migrations.AlterField(
+            model_name='backupcode',
+            name='code_hash',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='backupcode',
+            name='is_used',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='otp',
+            name='code_hash',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='otp',
+            name='is_used',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='otp',
+            name='purpose',
+            field=models.CharField(choices=[('email_verification', 'Email Verification'), ('phone_verification', 'Phone Verification'), ('device_verification', 'Device Verification'), ('password_reset', 'Password Reset'), ('login_2fa', 'Login 2FA'), ('sensitive_action', 'Sensitive Action')], max_length=30),
+        ),
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(condition=models.Q(('is_used', False)), fields=['user', 'purpose'], name='otps_user_purpose_unused_idx'),
+        ),
+    ]
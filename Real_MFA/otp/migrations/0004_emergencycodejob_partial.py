@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-19 05:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('otp', '0003_emergencycodejob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emergencycodejob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('partial', 'Partial'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+    ]
@@ -34,8 +34,8 @@ class OTP(TimeStampedModel):
     user = models.ForeignKey('accounts.User', on_delete=models.CASCADE, related_name='otps')
     
     # OTP Details
-    code_hash = models.CharField(max_length=255, db_index=True)  # Hashed OTP code
-    purpose = models.CharField(max_length=30, choices=PURPOSE_CHOICES, db_index=True)
+    code_hash = models.CharField(max_length=255)  # Hashed OTP code
+    purpose = models.CharField(max_length=30, choices=PURPOSE_CHOICES)
     
     # Target (email or phone)
     target = models.CharField(max_length=255)  # Email or phone number
@@ -46,7 +46,7 @@ class OTP(TimeStampedModel):
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     
     # Status
-    is_used = models.BooleanField(default=False, db_index=True)
+    is_used = models.BooleanField(default=False)
     used_at = models.DateTimeField(null=True, blank=True)
     
     # Expiry
@@ -58,8 +58,12 @@ class OTP(TimeStampedModel):
         verbose_name_plural = 'OTPs'
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['user', 'purpose', 'is_used']),
-            models.Index(fields=['expires_at']),
+            # OTPs are only ever looked up while unused; used rows stay out of the index
+            models.Index(
+                fields=['user', 'purpose'],
+                condition=models.Q(is_used=False),
+                name='otps_user_purpose_unused_idx',
+            ),
         ]
     
     def __str__(self):
@@ -140,10 +144,10 @@ class BackupCode(TimeStampedModel):
     user = models.ForeignKey('accounts.User', on_delete=models.CASCADE, related_name='backup_codes')
     
     # Code Storage (hashed)
-    code_hash = models.CharField(max_length=255, db_index=True)
+    code_hash = models.CharField(max_length=255)
     
     # Usage Tracking
-    is_used = models.BooleanField(default=False, db_index=True)
+    is_used = models.BooleanField(default=False)
     used_at = models.DateTimeField(null=True, blank=True)
     used_from_ip = models.GenericIPAddressField(null=True, blank=True)
     
@@ -152,9 +156,6 @@ class BackupCode(TimeStampedModel):
         verbose_name = 'Backup Code'
         verbose_name_plural = 'Backup Codes'
         ordering = ['is_used', '-created_at']
-        indexes = [
-            models.Index(fields=['user', 'is_used']),
-        ]
     
     def __str__(self):
         status = 'Used' if self.is_used else 'Active'
@@ -380,6 +381,92 @@ class MFARecovery(TimeStampedModel):
         return f"MFA Recovery for {self.user.email} - {status}"
 
 
+
+# ---------------------------
+# Emergency Code Job Model
+# ---------------------------
+class EmergencyCodeJob(TimeStampedModel):
+    """
+    Background job issuing emergency backup codes for many users at once
+    Security: Codes only ever leave the system inside an encrypted artifact;
+    the artifact key is returned once at creation and never stored in the DB
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('partial', 'Partial'),  # a chunk failed; the artifact holds the users processed
+        ('failed', 'Failed'),
+    ]
+    
+    # User filter fields accepted instead of an explicit id list
+    ALLOWED_FILTERS = ('role', 'mfa_enabled', 'mfa_method', 'is_active', 'email_verified')
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    requested_by = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='emergency_code_jobs'
+    )
+    
+    # Target selection
+    user_ids = models.JSONField(default=list, blank=True)
+    user_filter = models.JSONField(default=dict, blank=True)
+    codes_per_user = models.PositiveIntegerField(default=10)
+    reason = models.CharField(max_length=255, blank=True)
+    
+    # Request Context
+    ip_address = models.GenericIPAddressField()
+    user_agent = models.TextField(blank=True)
+    
+    # Progress
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total_users = models.PositiveIntegerField(default=0)
+    processed_users = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    # Encrypted artifact
+    artifact_path = models.CharField(max_length=500, blank=True)
+    artifact_sha256 = models.CharField(max_length=64, blank=True)
+    artifact_expires_at = models.DateTimeField(null=True, blank=True)
+    downloaded_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'emergency_code_jobs'
+        verbose_name = 'Emergency Code Job'
+        verbose_name_plural = 'Emergency Code Jobs'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Emergency Code Job {self.id} - {self.status}"
+    
+    def get_user_queryset(self):
+        """Users targeted by this job"""
+        from accounts.models import User
+        
+        users = User.objects.filter(is_deleted=False)
+        if self.user_ids:
+            return users.filter(id__in=self.user_ids)
+        return users.filter(**{
+            key: value for key, value in self.user_filter.items()
+            if key in self.ALLOWED_FILTERS
+        })
+    
+    def is_artifact_available(self):
+        """Check if the encrypted artifact can still be downloaded"""
+        return (
+            self.status in ('completed', 'partial')
+            and bool(self.artifact_path)
+            and self.artifact_expires_at is not None
+            and timezone.now() < self.artifact_expires_at
+        )
+
+
 # ============================================================================
 # END OF FILE
 # ============================================================================
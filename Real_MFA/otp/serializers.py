@@ -2,11 +2,12 @@
 OTP Serializers - Resend OTP for device verification
 """
 
+import uuid
 from rest_framework import serializers
 from django.conf import settings
 from django.utils import timezone
 from accounts.models import User
-from accounts.redis_utils import redis_client
+from accounts.redis_utils import redis_client, OTPDispatchDeduplicator
 from .models import OTP
 from .utils import generate_otp_code, hash_otp, get_client_ip
 
@@ -76,49 +77,69 @@ class ResendDeviceOTPSerializer(serializers.Serializer):
         user = self.validated_data['user']
         fingerprint_hash = self.validated_data['fingerprint_hash']
         ip_address = self.validated_data['ip_address']
-        
-        # Set cooldown (60 seconds) - per device
-        cooldown_key = f"device_otp_cooldown:{user.id}:{fingerprint_hash}"
-        redis_client.setex(cooldown_key, 60, "1")
-        
-        # Increment resend count - per device
-        limit_key = f"device_otp_limit:{user.id}:{fingerprint_hash}"
-        count = redis_client.incr(limit_key)
-        if count == 1:
-            redis_client.expire(limit_key, 600)  # 10 minutes
-        
-        # Invalidate previous OTPs
-        OTP.objects.filter(
-            user=user,
-            purpose='device_verification',
-            is_used=False
-        ).update(is_used=True)
-        
-        # Generate new OTP
-        otp_code = generate_otp_code(6)
         expires_at = timezone.now() + timezone.timedelta(minutes=10)
+        otp_id = uuid.uuid4()
+        limit_key = f"device_otp_limit:{user.id}:{fingerprint_hash}"
         
-        otp = OTP.objects.create(
-            user=user,
-            code_hash=hash_otp(otp_code),
-            purpose='device_verification',
-            target=user.email,
-            ip_address=ip_address,
-            expires_at=expires_at
-        )
-        
-        # Update pending verification reference (with fingerprint_hash)
-        pending_key = f"pending_device_verification:{user.id}:{fingerprint_hash}"
-        redis_client.setex(pending_key, 600, str(otp.id))
+        # A send for this device just happened (login or a parallel resend):
+        # hand back the pending OTP without counting against the resend limit
+        pending = OTPDispatchDeduplicator.claim(user.id, fingerprint_hash, 'device_verification', otp_id, expires_at)
+        if pending is not None:
+            return {
+                'message': 'OTP already sent',
+                'email_hint': f"{user.email[:3]}***@{user.email.split('@')[1]}",
+                'otp_id': pending['otp_id'],
+                'expires_at': pending['expires_at'],
+                'remaining_resends': 3 - int(redis_client.get(limit_key) or 0),
+                'deduplicated': True
+            }
         
-        # Send OTP email.
-        _dispatch_device_verification_otp(str(user.id), otp_code)
+        try:
+            # Set cooldown (60 seconds) - per device
+            cooldown_key = f"device_otp_cooldown:{user.id}:{fingerprint_hash}"
+            redis_client.setex(cooldown_key, 60, "1")
+            
+            # Increment resend count - per device
+            count = redis_client.incr(limit_key)
+            if count == 1:
+                redis_client.expire(limit_key, 600)  # 10 minutes
+            
+            # Invalidate previous OTPs
+            OTP.objects.filter(
+                user=user,
+                purpose='device_verification',
+                is_used=False
+            ).update(is_used=True)
+            
+            # Generate new OTP
+            otp_code = generate_otp_code(6)
+            
+            otp = OTP.objects.create(
+                id=otp_id,
+                user=user,
+                code_hash=hash_otp(otp_code),
+                purpose='device_verification',
+                target=user.email,
+                ip_address=ip_address,
+                expires_at=expires_at
+            )
+            
+            # Update pending verification reference (with fingerprint_hash)
+            pending_key = f"pending_device_verification:{user.id}:{fingerprint_hash}"
+            redis_client.setex(pending_key, 600, str(otp.id))
+            
+            # Send OTP email.
+            _dispatch_device_verification_otp(str(user.id), otp_code)
+        except Exception:
+            OTPDispatchDeduplicator.release(user.id, fingerprint_hash, 'device_verification')
+            raise
         
         remaining = 3 - int(redis_client.get(limit_key) or 0)
         
         return {
             'message': 'OTP resent successfully',
             'email_hint': f"{user.email[:3]}***@{user.email.split('@')[1]}",
+            'otp_id': str(otp.id),
             'expires_at': expires_at.isoformat(),
             'remaining_resends': remaining
         }
@@ -0,0 +1,203 @@
+"""Celery tasks for MFA challenge lifecycle and bulk emergency codes."""
+
+import hashlib
+import os
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .challenges import MFAChallengeStore
+from .emergency_codes import (
+    ARTIFACT_HEADER,
+    Fernet,
+    artifact_path_for,
+    encrypt_rows,
+    pop_job_key,
+)
+from .models import BackupCode, EmergencyCodeJob
+from .utils import generate_backup_code, hash_backup_code
+
+
+@shared_task(bind=True)
+def sweep_mfa_challenges(self):
+    """
+    Expire due challenges and flush terminal states to the DB.
+
+    Also closes out legacy 'pending' rows written before challenges moved
+    to Redis.
+    """
+    expired = MFAChallengeStore.expire_due()
+    flushed = MFAChallengeStore.flush()
+    legacy_expired = MFAChallengeStore.expire_legacy_rows()
+
+    return {
+        'expired': expired,
+        'flushed': flushed,
+        'legacy_expired': legacy_expired,
+    }
+
+
+def _issue_codes_for_chunk(job, users):
+    """
+    Replace backup codes for a chunk of users.
+    One UPDATE, one BackupCode bulk insert and one audit bulk insert per chunk.
+    """
+    from audits_logs.models import AuditLog
+
+    user_ids = [user_id for user_id, _ in users]
+    rows = []
+    backup_codes = []
+    audit_logs = []
+    requested_by = job.requested_by
+
+    for user_id, email in users:
+        codes = [generate_backup_code() for _ in range(job.codes_per_user)]
+        backup_codes.extend(BackupCode(user_id=user_id, code_hash=hash_backup_code(code)) for code in codes)
+        # Same event as AdminGenerateEmergencyCodesView so admin MFA reports list bulk issuances
+        audit_logs.append(AuditLog(
+            user_id=user_id,
+            event_type='emergency_codes_generated',
+            severity='high',
+            description='Emergency backup codes issued by bulk admin job',
+            ip_address=job.ip_address,
+            user_agent=job.user_agent,
+            metadata={
+                'action': 'bulk_generate_emergency_codes',
+                'generated_by': str(job.requested_by_id) if job.requested_by_id else None,
+                'generated_by_email': requested_by.email if requested_by else None,
+                'codes_count': len(codes),
+                'job_id': str(job.id),
+                'reason': job.reason,
+            },
+        ))
+        rows.append([str(user_id), email, ' '.join(codes)])
+
+    with transaction.atomic():
+        BackupCode.objects.filter(user_id__in=user_ids, is_used=False).update(is_used=True)
+        BackupCode.objects.bulk_create(backup_codes)
+        AuditLog.objects.bulk_create(audit_logs)
+
+    return rows
+
+
+@shared_task(bind=True)
+def generate_emergency_codes_job(self, job_id):
+    """
+    Issue emergency backup codes for every user targeted by the job and
+    write them to an encrypted artifact, one encrypted chunk per batch.
+
+    A chunk's codes are retired and issued in a transaction that commits only
+    once its line is on disk, so the artifact holds every code issued. If a
+    later chunk fails the job ends 'partial': the artifact is cut back to the
+    committed chunks and stays downloadable, processed_users says how far it
+    got, and users of the failed chunks keep their old codes.
+    """
+    job = EmergencyCodeJob.objects.get(id=job_id)
+    if job.status != 'pending':
+        return {'status': job.status, 'job_id': str(job.id)}
+
+    key = pop_job_key(job.id)
+    if not key or Fernet is None:
+        job.status = 'failed'
+        job.error = 'Encryption key expired or cryptography is not installed.'
+        job.completed_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'completed_at'])
+        return {'status': 'failed', 'job_id': str(job.id)}
+
+    fernet = Fernet(key.encode())
+    users = job.get_user_queryset().order_by('id')
+
+    job.status = 'running'
+    job.started_at = timezone.now()
+    job.total_users = users.count()
+    job.save(update_fields=['status', 'started_at', 'total_users'])
+
+    path = artifact_path_for(job.id)
+    chunk_size = settings.EMERGENCY_CODES_CHUNK_SIZE
+    digest = hashlib.sha256()
+    # Artifact bytes backed by committed chunks
+    committed = 0
+
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as fh:
+            line = encrypt_rows(fernet, [ARTIFACT_HEADER])
+            fh.write(line)
+            digest.update(line)
+            committed = fh.tell()
+
+            # Keyset pagination over the primary key keeps every chunk query cheap
+            last_id = None
+            while True:
+                chunk_qs = users if last_id is None else users.filter(id__gt=last_id)
+                chunk = list(chunk_qs.values_list('id', 'email')[:chunk_size])
+                if not chunk:
+                    break
+
+                # The codes only replace the old ones once they are on disk
+                with transaction.atomic():
+                    line = encrypt_rows(fernet, _issue_codes_for_chunk(job, chunk))
+                    fh.write(line)
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                digest.update(line)
+                committed = fh.tell()
+
+                last_id = chunk[-1][0]
+                job.processed_users += len(chunk)
+                job.save(update_fields=['processed_users'])
+    except Exception as exc:
+        job.error = str(exc)
+        if job.processed_users:
+            # Issued codes exist only in the artifact: keep what was committed
+            os.truncate(path, committed)
+            _finish_job(job, 'partial', path, digest)
+        else:
+            path.unlink(missing_ok=True)
+            job.status = 'failed'
+            job.completed_at = timezone.now()
+            job.save(update_fields=['status', 'error', 'completed_at'])
+        raise
+
+    _finish_job(job, 'completed', path, digest)
+    return {
+        'status': 'completed',
+        'job_id': str(job.id),
+        'processed_users': job.processed_users,
+    }
+
+
+def _finish_job(job, status, path, digest):
+    """Close the job with a downloadable artifact"""
+    job.status = status
+    job.completed_at = timezone.now()
+    job.artifact_path = str(path)
+    job.artifact_sha256 = digest.hexdigest()
+    job.artifact_expires_at = job.completed_at + timezone.timedelta(
+        hours=settings.EMERGENCY_CODES_ARTIFACT_TTL_HOURS
+    )
+    job.save(update_fields=[
+        'status', 'error', 'completed_at', 'artifact_path', 'artifact_sha256', 'artifact_expires_at'
+    ])
+
+
+@shared_task(bind=True)
+def purge_emergency_code_artifacts(self):
+    """Delete encrypted artifacts past their download window"""
+    expired_jobs = EmergencyCodeJob.objects.filter(
+        artifact_expires_at__lt=timezone.now()
+    ).exclude(artifact_path='')
+
+    purged = 0
+    for job in expired_jobs:
+        try:
+            os.remove(job.artifact_path)
+        except FileNotFoundError:
+            pass
+        job.artifact_path = ''
+        job.save(update_fields=['artifact_path'])
+        purged += 1
+
+    return {'purged': purged}
@@ -1,3 +1,160 @@
-from django.test import TestCase
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+
+from accounts.models import User
+from devices.models import Device
+from . import emergency_codes, tasks
+from .challenges import FLUSH_QUEUE_KEY, MFAChallengeStore, _challenge_key, _final_key
+from .models import BackupCode, EmergencyCodeJob, MFAChallenge
+from .utils import hash_backup_code
+
+try:
+    import fakeredis
+except ImportError:  # pragma: no cover
+    fakeredis = None
+
+# Redis stand-in for the cache-backed KV store
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+@override_settings(CACHES=LOCMEM_CACHE)
+class RedisChallengeStoreTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis(decode_responses=True)
+        patcher = mock.patch('otp.challenges.redis_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username='carol', email='carol@example.com', email_verified=True)
+
+    def _issue(self):
+        return MFAChallengeStore.issue(self.user, 'totp', '10.0.0.1', ttl_seconds=900)
+
+    def test_final_state_outlives_the_challenge_key(self):
+        challenge_id = self._issue()
+        self.assertTrue(MFAChallengeStore.mark_verified(challenge_id))
+
+        self.assertGreaterEqual(
+            self.redis.pttl(_final_key(challenge_id)),
+            self.redis.pttl(_challenge_key(challenge_id)),
+        )
+        self.assertEqual(MFAChallengeStore.get(challenge_id)['status'], 'verified')
+        self.assertFalse(MFAChallengeStore.mark_verified(challenge_id))
+
+    def test_failed_challenge_cannot_be_attempted_again(self):
+        challenge_id = self._issue()
+        for _ in range(3):
+            state = MFAChallengeStore.record_failure(challenge_id)
+        self.assertEqual(state['status'], 'failed')
+
+        self.assertGreaterEqual(
+            self.redis.pttl(_final_key(challenge_id)),
+            self.redis.pttl(_challenge_key(challenge_id)),
+        )
+        self.assertFalse(MFAChallengeStore.is_valid(challenge_id))
+        self.assertEqual(MFAChallengeStore.record_failure(challenge_id)['attempts'], 3)
+
+    def test_flush_keeps_records_queued_when_the_insert_fails(self):
+        challenge_id = self._issue()
+        MFAChallengeStore.mark_verified(challenge_id)
+
+        with mock.patch.object(MFAChallenge.objects, 'bulk_create', side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError):
+                MFAChallengeStore.flush()
+        self.assertEqual(self.redis.llen(FLUSH_QUEUE_KEY), 1)
+
+        self.assertEqual(MFAChallengeStore.flush(), 1)
+        self.assertEqual(self.redis.llen(FLUSH_QUEUE_KEY), 0)
+        self.assertEqual(MFAChallenge.objects.get(pk=challenge_id).status, 'verified')
+
+    def test_flush_drops_records_of_deleted_users(self):
+        gone = User.objects.create(username='dave', email='dave@example.com', email_verified=True)
+        challenge_id = self._issue()
+        MFAChallengeStore.mark_verified(challenge_id)
+        orphan = json.loads(self.redis.lindex(FLUSH_QUEUE_KEY, 0))
+        orphan.update(id='00000000-0000-0000-0000-000000000001', user_id=str(gone.pk))
+        self.redis.rpush(FLUSH_QUEUE_KEY, json.dumps(orphan))
+        gone.delete()
+
+        self.assertEqual(MFAChallengeStore.flush(), 1)
+        self.assertEqual(self.redis.llen(FLUSH_QUEUE_KEY), 0)
+        self.assertEqual(MFAChallenge.objects.count(), 1)
+
+    def test_device_attached_after_the_flush_reaches_the_row(self):
+        challenge_id = self._issue()
+        MFAChallengeStore.mark_verified(challenge_id)
+        self.assertEqual(MFAChallengeStore.flush(), 1)
+
+        device = Device.objects.create(user=self.user, fingerprint_hash='late-device', ip_address='10.0.0.1')
+        MFAChallengeStore.attach_device(challenge_id, device)
+        self.assertEqual(MFAChallenge.objects.get(pk=challenge_id).verified_device, device)
+
+
+@unittest.skipUnless(emergency_codes.is_available(), 'cryptography is not installed')
+@override_settings(CACHES=LOCMEM_CACHE, EMERGENCY_CODES_CHUNK_SIZE=1)
+class EmergencyCodesJobTests(TestCase):
+    def setUp(self):
+        artifacts = tempfile.TemporaryDirectory()
+        self.addCleanup(artifacts.cleanup)
+        artifact_dir = self.settings(EMERGENCY_CODES_ARTIFACT_DIR=Path(artifacts.name))
+        artifact_dir.enable()
+        self.addCleanup(artifact_dir.disable)
+
+        self.users = sorted(
+            (User.objects.create(username=f'user{n}', email=f'user{n}@example.com', email_verified=True)
+             for n in range(3)),
+            key=lambda user: user.pk,
+        )
+        for user in self.users:
+            BackupCode.objects.create(user=user, code_hash=hash_backup_code(f'OLD-{user.pk}'))
+        self.job = EmergencyCodeJob.objects.create(
+            user_ids=[str(user.pk) for user in self.users], codes_per_user=2, ip_address='10.0.0.1',
+        )
+        self.key = emergency_codes.create_job_key(self.job.id)
+
+    def _usable(self, user):
+        return set(BackupCode.objects.filter(user=user, is_used=False).values_list('code_hash', flat=True))
+
+    def test_failed_chunk_leaves_a_partial_artifact(self):
+        encrypt_rows = tasks.encrypt_rows
+        calls = []
+
+        def fail_second_chunk(fernet, rows):
+            calls.append(rows)
+            if len(calls) == 3:  # header, first chunk, second chunk
+                raise OSError('disk full')
+            return encrypt_rows(fernet, rows)
+
+        with mock.patch('otp.tasks.encrypt_rows', side_effect=fail_second_chunk):
+            with self.assertRaises(OSError):
+                tasks.generate_emergency_codes_job(str(self.job.id))
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'partial')
+        self.assertEqual(self.job.processed_users, 1)
+        self.assertTrue(self.job.is_artifact_available())
+
+        header, *rows = emergency_codes.decrypt_artifact(self.job.artifact_path, self.key)
+        self.assertEqual(header, emergency_codes.ARTIFACT_HEADER)
+        [(user_id, _, codes)] = rows
+        first, *others = self.users
+        self.assertEqual(user_id, str(first.pk))
+        self.assertEqual(self._usable(first), {hash_backup_code(code) for code in codes.split()})
+        for user in others:
+            self.assertEqual(self._usable(user), {hash_backup_code(f'OLD-{user.pk}')})
+
+    def test_completed_job_covers_every_user(self):
+        result = tasks.generate_emergency_codes_job(str(self.job.id))
+        self.assertEqual(result['processed_users'], 3)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'completed')
+        rows = list(emergency_codes.decrypt_artifact(self.job.artifact_path, self.key))
+        self.assertEqual(len(rows), 4)
+        for user in self.users:
+            self.assertEqual(len(self._usable(user)), 2)
@@ -22,6 +22,18 @@ def verify_otp_hash(code, code_hash):
     return hash_otp(code) == code_hash
 
 
+def generate_backup_code():
+    """Generate a backup code in the XXXX-XXXX format shown to users"""
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ234567'
+    raw = ''.join(secrets.choice(alphabet) for _ in range(8))
+    return f"{raw[:4]}-{raw[4:]}"
+
+
+def hash_backup_code(code):
+    """Hash backup code for storage (case-insensitive)"""
+    return hashlib.sha256(code.upper().encode()).hexdigest()
+
+
 def get_client_ip(request):
     """Extract client IP address from request"""
     if request is None:
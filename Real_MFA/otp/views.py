@@ -32,6 +32,7 @@ def resend_device_otp(request):
     {
         "message": "OTP resent successfully",
         "email_hint": "use***@example.com",
+        "otp_id": "uuid",
         "expires_at": "2026-01-08T12:30:00Z",
         "remaining_resends": 2
     }